@@ -14,22 +14,69 @@
 #  limitations under the License.
 #
 import base64
+import hashlib
 import json
 import logging
 import re
+import threading
 import time
-from concurrent.futures import ThreadPoolExecutor
-from copy import deepcopy
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from functools import partial
 from typing import Any, Union, Tuple
 
 from agent.component import component_class
 from agent.component.base import ComponentBase
+from agent.settings import CANVAS_TEMPLATE_CACHE_SIZE, MAX_CONCURRENT_COMPONENTS
 from api.db.services.file_service import FileService
 from api.utils import get_uuid, hash_str2int
 from rag.prompts.generator import chunks_format
 from rag.utils.redis_conn import REDIS_CONN
 
+# Long-lived pool shared by every canvas run instead of one pool per batch.
+COMPONENT_EXECUTOR = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_COMPONENTS, thread_name_prefix="canvas_component")
+# Files are read for components already running on COMPONENT_EXECUTOR, which would deadlock
+# waiting on a pool they fill up.
+FILE_EXECUTOR = ThreadPoolExecutor(max_workers=5, thread_name_prefix="canvas_file")
+
+# Components started ahead of their turn may still be dropped if a sibling of their upstream fails,
+# so only those without side effects outside the canvas are.
+PREFETCH_SAFE_COMPONENTS = ("llm", "stringtransform", "retrieval", "wikipedia", "duckduckgo", "arxiv", "pubmed", "googlescholar", "searxng", "tavilysearch")
+
+# Per-session runtime state carried in component params; everything else defines the template.
+_RUNTIME_PARAMS = ("inputs", "outputs", "debug_inputs")
+
+
+class TemplateCache:
+    """
+    LRU of compiled (validated and instantiated) components keyed by the static part of a DSL.
+    Canvases built from the same agent version clone these instead of re-compiling.
+    """
+
+    def __init__(self, capacity: int):
+        self._capacity = capacity
+        self._templates = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            tpl = self._templates.get(key)
+            if tpl is not None:
+                self._templates.move_to_end(key)
+            return tpl
+
+    def put(self, key, tpl):
+        if self._capacity <= 0:
+            return
+        with self._lock:
+            self._templates[key] = tpl
+            self._templates.move_to_end(key)
+            while len(self._templates) > self._capacity:
+                self._templates.popitem(last=False)
+
+
+CANVAS_TEMPLATES = TemplateCache(CANVAS_TEMPLATE_CACHE_SIZE)
+
 
 class Graph:
     """
@@ -81,22 +128,48 @@ class Graph:
         self.task_id = task_id if task_id else get_uuid()
         self.load()
 
-    def load(self):
-        self.components = self.dsl["components"]
-        cpn_nms = set([])
+    def _template_key(self):
+        static = {}
         for k, cpn in self.components.items():
-            cpn_nms.add(cpn["obj"]["component_name"])
+            params = {p: v for p, v in cpn["obj"]["params"].items() if p not in _RUNTIME_PARAMS}
+            static[k] = [cpn["obj"]["component_name"], params]
+        digest = hashlib.sha256(json.dumps(static, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8")).hexdigest()
+        return self.__class__.__name__, self._tenant_id, digest
 
+    def _compile(self) -> dict[str, ComponentBase]:
+        compiled = {}
         for k, cpn in self.components.items():
-            cpn_nms.add(cpn["obj"]["component_name"])
             param = component_class(cpn["obj"]["component_name"] + "Param")()
-            param.update(cpn["obj"]["params"])
+            param.update({p: v for p, v in cpn["obj"]["params"].items() if p not in _RUNTIME_PARAMS})
             try:
                 param.check()
             except Exception as e:
                 raise ValueError(self.get_component_name(k) + f": {e}")
 
-            cpn["obj"] = component_class(cpn["obj"]["component_name"])(self, k, param)
+            compiled[k] = component_class(cpn["obj"]["component_name"])(self, k, param)
+        return compiled
+
+    def load(self):
+        self.components = self.dsl["components"]
+        key = self._template_key()
+        compiled = CANVAS_TEMPLATES.get(key)
+        fresh = compiled is None
+        if fresh:
+            compiled = self._compile()
+
+        for k, cpn in self.components.items():
+            params = cpn["obj"]["params"]
+            obj = compiled[k].clone(self)
+            for p in _RUNTIME_PARAMS:
+                if p in params:
+                    setattr(obj._param, p, params[p])
+            cpn["obj"] = obj
+
+        if fresh:
+            # Templates outlive the canvas that compiled them, which they must not keep alive.
+            for tpl in compiled.values():
+                tpl.detach()
+            CANVAS_TEMPLATES.put(key, compiled)
 
         self.path = self.dsl["path"]
 
@@ -104,10 +177,11 @@ class Graph:
         self.dsl["path"] = self.path
         self.dsl["task_id"] = self.task_id
         dsl = {"components": {}}
+        # json.dumps already produces an independent copy, no need to deepcopy first.
         for k in self.dsl.keys():
             if k in ["components"]:
                 continue
-            dsl[k] = deepcopy(self.dsl[k])
+            dsl[k] = self.dsl[k]
 
         for k, cpn in self.components.items():
             if k not in dsl["components"]:
@@ -116,7 +190,7 @@ class Graph:
                 if c == "obj":
                     dsl["components"][k][c] = json.loads(str(cpn["obj"]))
                     continue
-                dsl["components"][k][c] = deepcopy(cpn[c])
+                dsl["components"][k][c] = cpn[c]
         return json.dumps(dsl, ensure_ascii=False)
 
     def reset(self):
@@ -232,17 +306,77 @@ class Canvas(Graph):
         yield decorate("workflow_started", {"inputs": kwargs.get("inputs")})
         self.retrieval.append({"chunks": {}, "doc_aggs": {}})
 
+        # Components started ahead of their turn in `self.path`, while the batch holding their
+        # upstream was still running, because all of that upstream had already finished in this run.
+        prefetched = set()
+        finished = set()
+        timings = {}
+
+        def _submit(cpn_id):
+            cpn = self.get_component_obj(cpn_id)
+            if cpn.component_name.lower() in ["begin", "userfillup"]:
+                return COMPONENT_EXECUTOR.submit(cpn.invoke, inputs=kwargs.get("inputs", {}))
+            return COMPONENT_EXECUTOR.submit(cpn.invoke, **cpn.get_input())
+
+        def _prefetchable(cpn_id, scheduled):
+            if cpn_id in scheduled or cpn_id in prefetched:
+                return False
+            # The run stops or takes the exception branch once a component of the batch failed.
+            if any(self.get_component_obj(c).error() for c in finished.intersection(scheduled)):
+                return False
+            cpn = self.get_component(cpn_id)
+            if not cpn or cpn["obj"].get_parent() or cpn["obj"].component_name.lower() not in PREFETCH_SAFE_COMPONENTS:
+                return False
+            if not cpn.get("upstream"):
+                return False
+            # Components whose variables are read count as upstream too, wherever they are in the graph.
+            refs = {r.split("@")[0] for r in re.findall(ComponentBase.variable_ref_patt, str(cpn["obj"]._param), flags=re.IGNORECASE | re.DOTALL) if r.find("@") > 0}
+            if any(ref not in self.components for ref in refs):
+                return False
+            for up in set(cpn["upstream"]) | refs:
+                up_obj = self.get_component_obj(up)
+                if up not in finished or up_obj.error() or up_obj.component_name.lower() in ["categorize", "switch", "iteration", "iterationitem"]:
+                    return False
+                if isinstance(up_obj.output("content"), partial):
+                    return False
+            return True
+
+        def _node_started(cpn_id):
+            return decorate(
+                "node_started",
+                {
+                    "inputs": None,
+                    "created_at": int(time.time()),
+                    "component_id": cpn_id,
+                    "component_name": self.get_component_name(cpn_id),
+                    "component_type": self.get_component_type(cpn_id),
+                    "thoughts": self.get_component_thoughts(cpn_id),
+                },
+            )
+
         def _run_batch(f, t):
-            with ThreadPoolExecutor(max_workers=5) as executor:
-                thr = []
-                for i in range(f, t):
-                    cpn = self.get_component_obj(self.path[i])
-                    if cpn.component_name.lower() in ["begin", "userfillup"]:
-                        thr.append(executor.submit(cpn.invoke, inputs=kwargs.get("inputs", {})))
-                    else:
-                        thr.append(executor.submit(cpn.invoke, **cpn.get_input()))
-                for t in thr:
-                    t.result()
+            running = {}
+            for i in range(f, t):
+                if self.path[i] in prefetched:
+                    prefetched.discard(self.path[i])
+                    continue
+                running[_submit(self.path[i])] = self.path[i]
+            scheduled = set(self.path[f:t])
+            while running:
+                done, _ = wait(running.keys(), return_when=FIRST_COMPLETED)
+                for fut in done:
+                    cpn_id = running.pop(fut)
+                    fut.result()
+                    finished.add(cpn_id)
+                    timings[cpn_id] = self.get_component_obj(cpn_id).output("_elapsed_time")
+                    # Only the downstream of the batch itself, which is the next batch unless a branch is taken.
+                    if cpn_id not in scheduled:
+                        continue
+                    for down in self.get_component(cpn_id).get("downstream", []):
+                        if _prefetchable(down, scheduled):
+                            prefetched.add(down)
+                            yield _node_started(down)
+                            running[_submit(down)] = down
 
         def _node_finished(cpn_obj):
             return decorate(
@@ -264,19 +398,14 @@ class Canvas(Graph):
         partials = []
         while idx < len(self.path):
             to = len(self.path)
+            # A component coming round again starts another pass of a loop or iteration,
+            # in which no upstream has finished yet. Those started ahead already ran in this one.
+            if finished.intersection(c for c in self.path[idx:to] if c not in prefetched):
+                finished.clear()
             for i in range(idx, to):
-                yield decorate(
-                    "node_started",
-                    {
-                        "inputs": None,
-                        "created_at": int(time.time()),
-                        "component_id": self.path[i],
-                        "component_name": self.get_component_name(self.path[i]),
-                        "component_type": self.get_component_type(self.path[i]),
-                        "thoughts": self.get_component_thoughts(self.path[i]),
-                    },
-                )
-            _run_batch(idx, to)
+                if self.path[i] not in prefetched:
+                    yield _node_started(self.path[i])
+            yield from _run_batch(idx, to)
 
             # post processing of components invocation
             for i in range(idx, to):
@@ -359,6 +488,11 @@ class Canvas(Graph):
                 else:
                     _extend_path(cpn["downstream"])
 
+            # Started ahead for a batch the path no longer leads to, e.g. after a failure.
+            for cpn_id in [c for c in prefetched if c not in self.path[to:]]:
+                prefetched.discard(cpn_id)
+                yield _node_finished(self.get_component_obj(cpn_id))
+
             if self.error:
                 logging.error(f"Runtime Error: {self.error}")
                 break
@@ -388,6 +522,7 @@ class Canvas(Graph):
                     "outputs": self.get_component_obj(self.path[-1]).output(),
                     "elapsed_time": time.perf_counter() - st,
                     "created_at": st,
+                    "component_elapsed_time": timings,
                 },
             )
             self.history.append(("assistant", self.get_component_obj(self.path[-1]).output()))
@@ -449,13 +584,12 @@ class Canvas(Graph):
         def image_to_base64(file):
             return "data:{};base64,{}".format(file["mime_type"], base64.b64encode(FileService.get_blob(file["created_by"], file["id"])).decode("utf-8"))
 
-        exe = ThreadPoolExecutor(max_workers=5)
         threads = []
         for file in files:
             if file["mime_type"].find("image") >= 0:
-                threads.append(exe.submit(image_to_base64, file))
+                threads.append(FILE_EXECUTOR.submit(image_to_base64, file))
                 continue
-            threads.append(exe.submit(FileService.parse, file["name"], FileService.get_blob(file["created_by"], file["id"]), True, file["created_by"]))
+            threads.append(FILE_EXECUTOR.submit(FileService.parse, file["name"], FileService.get_blob(file["created_by"], file["id"]), True, file["created_by"]))
         return [th.result() for th in threads]
 
     def tool_use_callback(self, agent_id: str, func_name: str, params: dict, result: Any, elapsed_time=None):
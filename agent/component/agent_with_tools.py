@@ -68,9 +68,13 @@ class AgentParam(LLMParam, ToolParamBase):
 
 class Agent(LLM, ToolBase):
     component_name = "Agent"
+    _runtime_attrs = ("chat_mdl", "tools", "tool_meta", "callback", "toolcall_session")
 
     def __init__(self, canvas, id, param: LLMParam):
         LLM.__init__(self, canvas, id, param)
+
+    def _init_runtime(self):
+        # Tool objects and MCP sessions are bound to the canvas, so every clone builds its own.
         self.tools = {}
         for cpn in self._param.tools:
             cpn = self._load_tool_obj(cpn)
@@ -93,7 +97,7 @@ class Agent(LLM, ToolBase):
             for tnm, meta in mcp["tools"].items():
                 self.tool_meta.append(mcp_tool_metadata_to_openai_tool(meta))
                 self.tools[tnm] = tool_call_session
-        self.callback = partial(self._canvas.tool_use_callback, id)
+        self.callback = partial(self._canvas.tool_use_callback, self._id)
         self.toolcall_session = LLMToolPluginCallSession(self.tools, self.callback)
         # self.chat_mdl.bind_tools(self.toolcall_session, self.tool_metas)
 
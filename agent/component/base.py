@@ -18,6 +18,7 @@ import re
 import time
 from abc import ABC
 import builtins
+import copy
 import json
 import os
 import logging
@@ -338,6 +339,8 @@ class ComponentParamBase(ABC):
 
 class ComponentBase(ABC):
     component_name: str
+    # Attributes built for each canvas instead of copied into clones, e.g. model bundles carrying a trace context.
+    _runtime_attrs: tuple[str, ...] = ()
     thread_limiter = trio.CapacityLimiter(int(os.environ.get("MAX_CONCURRENT_CHATS", 10)))
     variable_ref_patt = r"\{* *\{([a-zA-Z:0-9]+@[A-Za-z:0-9_.-]+|sys\.[a-z_]+)\} *\}*"
 
@@ -362,6 +365,29 @@ class ComponentBase(ABC):
         self._param = param
         self._param.check()
 
+    def clone(self, canvas):
+        """
+        Copy of this component bound to `canvas`, skipping param validation and re-instantiation.
+        """
+        cpn = copy.copy(self)
+        for attr in self._runtime_attrs:
+            setattr(cpn, attr, None)
+        cpn = copy.deepcopy(cpn, {id(self._canvas): canvas} if self._canvas is not None else {})
+        cpn._canvas = canvas
+        cpn._init_runtime()
+        return cpn
+
+    def detach(self):
+        """
+        Unbind this component from its canvas, to be kept as a template to clone from.
+        """
+        self._canvas = None
+        for attr in self._runtime_attrs:
+            setattr(self, attr, None)
+
+    def _init_runtime(self):
+        pass
+
     def invoke(self, **kwargs) -> dict[str, Any]:
         self.set_output("_created_time", time.perf_counter())
         try:
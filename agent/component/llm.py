@@ -82,13 +82,17 @@ class LLMParam(ComponentParamBase):
 
 class LLM(ComponentBase):
     component_name = "LLM"
+    _runtime_attrs = ("chat_mdl",)
 
     def __init__(self, canvas, component_id, param: ComponentParamBase):
         super().__init__(canvas, component_id, param)
+        self._init_runtime()
+        self.imgs = []
+
+    def _init_runtime(self):
         self.chat_mdl = LLMBundle(
             self._canvas.get_tenant_id(), TenantLLMService.llm_id2llm_type(self._param.llm_id), self._param.llm_id, max_retries=self._param.max_retries, retry_interval=self._param.delay_after_error
         )
-        self.imgs = []
 
     def get_input_form(self) -> dict[str, dict]:
         res = {}
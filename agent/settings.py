@@ -13,6 +13,11 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 #
+import os
 
 FLOAT_ZERO = 1e-8
 PARAM_MAXDEPTH = 5
+# Size of the thread pool shared by all canvas runs in this process.
+MAX_CONCURRENT_COMPONENTS = int(os.environ.get("MAX_CONCURRENT_COMPONENTS", 32))
+# Number of compiled canvas templates kept per process.
+CANVAS_TEMPLATE_CACHE_SIZE = int(os.environ.get("CANVAS_TEMPLATE_CACHE_SIZE", 64))
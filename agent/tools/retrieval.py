@@ -16,6 +16,9 @@
 import os
 import re
 from abc import ABC
+
+import trio
+
 from agent.tools.base import ToolParamBase, ToolBase, ToolMeta
 from api.db import LLMType
 from api.db.services.knowledgebase_service import KnowledgebaseService
@@ -114,12 +117,16 @@ class Retrieval(ToolBase, ABC):
         if self._param.cross_languages:
             query = cross_languages(kbs[0].tenant_id, None, query, self._param.cross_languages)
 
-        if kbs:
-            query = re.sub(r"^user[:：\s]*", "", query, flags=re.IGNORECASE)
-            kbinfos = settings.retrievaler.retrieval(
+        query = re.sub(r"^user[:：\s]*", "", query, flags=re.IGNORECASE)
+        tenant_ids = [kb.tenant_id for kb in kbs]
+        kbinfos, ck = {"chunks": [], "doc_aggs": []}, None
+
+        async def retrieve():
+            nonlocal kbinfos
+            kbinfos = await settings.retrievaler.retrieval_async(
                 query,
                 embd_mdl,
-                [kb.tenant_id for kb in kbs],
+                tenant_ids,
                 filtered_kb_ids,
                 1,
                 self._param.top_n,
@@ -128,20 +135,27 @@ class Retrieval(ToolBase, ABC):
                 aggs=False,
                 rerank_mdl=rerank_mdl,
                 rank_feature=label_question(query, kbs),
+                with_vector=False,
+                tenant_id=kbs[0].tenant_id,
             )
-            if self._param.use_kg:
-                ck = settings.kg_retrievaler.retrieval(query, [kb.tenant_id for kb in kbs], kb_ids, embd_mdl, LLMBundle(self._canvas.get_tenant_id(), LLMType.CHAT))
-                if ck["content_with_weight"]:
-                    kbinfos["chunks"].insert(0, ck)
-        else:
-            kbinfos = {"chunks": [], "doc_aggs": []}
-
-        if self._param.use_kg and kbs:
-            ck = settings.kg_retrievaler.retrieval(query, [kb.tenant_id for kb in kbs], filtered_kb_ids, embd_mdl, LLMBundle(kbs[0].tenant_id, LLMType.CHAT))
-            if ck["content_with_weight"]:
-                ck["content"] = ck["content_with_weight"]
-                del ck["content_with_weight"]
-                kbinfos["chunks"].insert(0, ck)
+
+        async def retrieve_kg():
+            nonlocal ck
+            ck = await settings.kg_retrievaler.retrieval_async(query, tenant_ids, filtered_kb_ids, embd_mdl, LLMBundle(kbs[0].tenant_id, LLMType.CHAT), tenant_id=kbs[0].tenant_id)
+
+        # The chunk and the knowledge graph retrievals go side by side.
+        async def retrieve_all():
+            async with trio.open_nursery() as nursery:
+                nursery.start_soon(retrieve)
+                if self._param.use_kg:
+                    nursery.start_soon(retrieve_kg)
+
+        trio.run(retrieve_all)
+
+        if ck and ck["content_with_weight"]:
+            ck["content"] = ck["content_with_weight"]
+            del ck["content_with_weight"]
+            kbinfos["chunks"].insert(0, ck)
 
         for ck in kbinfos["chunks"]:
             if "vector" in ck:
@@ -822,6 +822,7 @@ def retrieval():
             rerank_mdl=rerank_mdl,
             highlight=highlight,
             rank_feature=label_question(question, kbs),
+            with_vector=False,
         )
         for c in ranks["chunks"]:
             c.pop("vector", None)
@@ -35,7 +35,7 @@ from rag.app.tag import label_question
 from rag.nlp import rag_tokenizer, search
 from rag.prompts.generator import gen_meta_filter, cross_languages, keyword_extraction
 from rag.settings import PAGERANK_FLD
-from rag.utils import rmSpace
+from rag.utils import num_tokens_from_string, rmSpace
 
 
 @manager.route("/list", methods=["POST"])  # noqa: F821
@@ -121,6 +121,7 @@ def set():
     d = {"id": req["chunk_id"], "content_with_weight": req["content_with_weight"]}
     d["content_ltks"] = rag_tokenizer.tokenize(req["content_with_weight"])
     d["content_sm_ltks"] = rag_tokenizer.fine_grained_tokenize(d["content_ltks"])
+    d["token_num_int"] = num_tokens_from_string(d["content_with_weight"])
     if "important_kwd" in req:
         if not isinstance(req["important_kwd"], list):
             return get_data_error_result(message="`important_kwd` should be a list")
@@ -213,6 +214,7 @@ def create():
     chunck_id = xxhash.xxh64((req["content_with_weight"] + req["doc_id"]).encode("utf-8")).hexdigest()
     d = {"id": chunck_id, "content_ltks": rag_tokenizer.tokenize(req["content_with_weight"]), "content_with_weight": req["content_with_weight"]}
     d["content_sm_ltks"] = rag_tokenizer.fine_grained_tokenize(d["content_ltks"])
+    d["token_num_int"] = num_tokens_from_string(d["content_with_weight"])
     d["important_kwd"] = req.get("important_kwd", [])
     if not isinstance(d["important_kwd"], list):
         return get_data_error_result(message="`important_kwd` is required to be a list")
@@ -338,6 +340,7 @@ def retrieval_test():
             rerank_mdl=rerank_mdl,
             highlight=req.get("highlight"),
             rank_feature=labels,
+            with_vector=False,
         )
         if use_kg:
             ck = settings.kg_retrievaler.retrieval(question, tenant_ids, kb_ids, embd_mdl, LLMBundle(kb.tenant_id, LLMType.CHAT))
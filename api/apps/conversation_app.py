@@ -22,7 +22,7 @@ from flask_login import current_user, login_required
 from api import settings
 from api.db import LLMType
 from api.db.db_models import APIToken
-from api.db.services.conversation_service import ConversationService, structure_answer
+from api.db.services.conversation_service import ConversationService, delta_answer, load_archived_turns, structure_answer
 from api.db.services.dialog_service import DialogService, ask, chat, gen_mindmap
 from api.db.services.llm_service import LLMBundle
 from api.db.services.search_service import SearchService
@@ -102,11 +102,34 @@ def get():
 
         conv = conv.to_dict()
         conv["avatar"] = avatar
+        conv["archived_segments"] = ConversationService.count_segments(conv["id"])
         return get_json_result(data=conv)
     except Exception as e:
         return server_error_response(e)
 
 
+@manager.route("/history", methods=["GET"])  # noqa: F821
+@login_required
+def history():
+    conv_id = request.args["conversation_id"]
+    before = request.args.get("before")
+    try:
+        e, conv = ConversationService.get_by_id(conv_id)
+        if not e:
+            return get_data_error_result(message="Conversation not found!")
+        for tenant in UserTenantService.query(user_id=current_user.id):
+            if DialogService.query(tenant_id=tenant.tenant_id, id=conv.dialog_id):
+                break
+        else:
+            return get_json_result(data=False, message="Only owner of conversation authorized for this operation.", code=settings.RetCode.OPERATING_ERROR)
+        e, dia = DialogService.get_by_id(conv.dialog_id)
+        if not e:
+            return get_data_error_result(message="Dialog not found!")
+        return get_json_result(data=load_archived_turns(conv, dia, int(before) if before is not None else None))
+    except Exception as e:
+        return server_error_response(e)
+
+
 @manager.route("/getsse/<dialog_id>", methods=["GET"])  # type: ignore # noqa: F821
 def getsse(dialog_id):
     token = request.headers.get("Authorization").split()
@@ -196,7 +219,8 @@ def completion():
         e, conv = ConversationService.get_by_id(req["conversation_id"])
         if not e:
             return get_data_error_result(message="Conversation not found!")
-        conv.message = deepcopy(req["messages"])
+        messages = deepcopy(req["messages"])
+        conv.message = ConversationService.drop_archived(conv.message or [], messages) or messages
         e, dia = DialogService.get_by_id(conv.dialog_id)
         if not e:
             return get_data_error_result(message="Dialog not found!")
@@ -217,15 +241,19 @@ def completion():
             dia.llm_setting = chat_model_config
 
         is_embedded = bool(chat_model_id)
+        delta = req.pop("delta", False)
 
         def stream():
             nonlocal dia, msg, req, conv
+            streamed = ""
             try:
                 for ans in chat(dia, msg, True, **req):
                     ans = structure_answer(conv, ans, message_id, conv.id)
+                    if delta:
+                        ans, streamed = delta_answer(ans, streamed)
                     yield "data:" + json.dumps({"code": 0, "message": "", "data": ans}, ensure_ascii=False) + "\n\n"
                 if not is_embedded:
-                    ConversationService.update_by_id(conv.id, conv.to_dict())
+                    ConversationService.save_turn(conv)
             except Exception as e:
                 logging.exception(e)
                 yield "data:" + json.dumps({"code": 500, "message": str(e), "data": {"answer": "**ERROR**: " + str(e), "reference": []}}, ensure_ascii=False) + "\n\n"
@@ -244,7 +272,7 @@ def completion():
             for ans in chat(dia, msg, **req):
                 answer = structure_answer(conv, ans, message_id, conv.id)
                 if not is_embedded:
-                    ConversationService.update_by_id(conv.id, conv.to_dict())
+                    ConversationService.save_turn(conv)
                 break
             return get_json_result(data=answer)
     except Exception as e:
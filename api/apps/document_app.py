@@ -46,6 +46,7 @@ from api.utils.file_utils import filename_type, get_project_base_directory, thum
 from api.utils.web_utils import CONTENT_TYPE_MAP, html2pdf, is_valid_url
 from deepdoc.parser.html_parser import RAGFlowHtmlParser
 from rag.nlp import search
+from rag.settings import TASK_BULK_DOCUMENTS
 from rag.utils.storage_factory import STORAGE_IMPL
 
 
@@ -442,6 +443,7 @@ def run():
             return get_json_result(data=False, message="No authorization.", code=settings.RetCode.AUTHENTICATION_ERROR)
     try:
         kb_table_num_map = {}
+        bulk = len(req["doc_ids"]) > TASK_BULK_DOCUMENTS
         for id in req["doc_ids"]:
             info = {"run": str(req["run"]), "progress": 0}
             if str(req["run"]) == TaskStatus.RUNNING.value and req.get("delete", False):
@@ -485,7 +487,7 @@ def run():
                         if kb_table_num_map[kb_id] <= 0:
                             KnowledgebaseService.delete_field_map(kb_id)
                 bucket, name = File2DocumentService.get_storage_address(doc_id=doc["id"])
-                queue_tasks(doc, bucket, name, 0)
+                queue_tasks(doc, bucket, name, 0, bulk=bulk)
 
         return get_json_result(data=True)
     except Exception as e:
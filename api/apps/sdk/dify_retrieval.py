@@ -66,6 +66,7 @@ def retrieval(tenant_id):
             top=top,
             doc_ids=doc_ids,
             rank_feature=label_question(question, [kb]),
+            with_vector=False,
         )
 
         if use_kg:
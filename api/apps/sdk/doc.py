@@ -41,7 +41,8 @@ from rag.app.qa import beAdoc, rmPrefix
 from rag.app.tag import label_question
 from rag.nlp import rag_tokenizer, search
 from rag.prompts.generator import cross_languages, keyword_extraction
-from rag.utils import rmSpace
+from rag.settings import TASK_BULK_DOCUMENTS
+from rag.utils import num_tokens_from_string, rmSpace
 from rag.utils.storage_factory import STORAGE_IMPL
 
 MAXIMUM_OF_UPLOADING_FILES = 256
@@ -730,6 +731,7 @@ def parse(tenant_id, dataset_id):
 
     not_found = []
     success_count = 0
+    bulk = len(doc_list) > TASK_BULK_DOCUMENTS
     for id in doc_list:
         doc = DocumentService.query(id=id, kb_id=dataset_id)
         if not doc:
@@ -747,7 +749,7 @@ def parse(tenant_id, dataset_id):
         doc = doc.to_dict()
         doc["tenant_id"] = tenant_id
         bucket, name = File2DocumentService.get_storage_address(doc_id=doc["id"])
-        queue_tasks(doc, bucket, name, 0)
+        queue_tasks(doc, bucket, name, 0, bulk=bulk)
         success_count += 1
     if not_found:
         return get_result(message=f"Documents not found: {not_found}", code=settings.RetCode.DATA_ERROR)
@@ -1090,6 +1092,7 @@ def add_chunk(tenant_id, dataset_id, document_id):
         "content_with_weight": req["content"],
     }
     d["content_sm_ltks"] = rag_tokenizer.fine_grained_tokenize(d["content_ltks"])
+    d["token_num_int"] = num_tokens_from_string(d["content_with_weight"])
     d["important_kwd"] = req.get("important_keywords", [])
     d["important_tks"] = rag_tokenizer.tokenize(" ".join(req.get("important_keywords", [])))
     d["question_kwd"] = [str(q).strip() for q in req.get("questions", []) if str(q).strip()]
@@ -1270,6 +1273,7 @@ def update_chunk(tenant_id, dataset_id, document_id, chunk_id):
     d = {"id": chunk_id, "content_with_weight": content}
     d["content_ltks"] = rag_tokenizer.tokenize(d["content_with_weight"])
     d["content_sm_ltks"] = rag_tokenizer.fine_grained_tokenize(d["content_ltks"])
+    d["token_num_int"] = num_tokens_from_string(d["content_with_weight"])
     if "important_keywords" in req:
         if not isinstance(req["important_keywords"], list):
             return get_error_data_result("`important_keywords` should be a list")
@@ -1454,6 +1458,7 @@ def retrieval_test(tenant_id):
             rerank_mdl=rerank_mdl,
             highlight=highlight,
             rank_feature=label_question(question, kbs),
+            with_vector=False,
         )
         if use_kg:
             ck = settings.kg_retrievaler.retrieval(question, [k.tenant_id for k in kbs], kb_ids, embd_mdl, LLMBundle(kb.tenant_id, LLMType.CHAT))
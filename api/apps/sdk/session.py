@@ -27,7 +27,7 @@ from api.db.db_models import APIToken
 from api.db.services.api_service import API4ConversationService
 from api.db.services.canvas_service import UserCanvasService, completionOpenAI
 from api.db.services.canvas_service import completion as agent_completion
-from api.db.services.conversation_service import ConversationService, iframe_completion
+from api.db.services.conversation_service import ConversationService, iframe_completion, load_archived_turns
 from api.db.services.conversation_service import completion as rag_completion
 from api.db.services.dialog_service import DialogService, ask, chat, gen_mindmap, meta_filter
 from api.db.services.document_service import DocumentService
@@ -514,35 +514,62 @@ def list_session(tenant_id, chat_id):
             if "prompt" in info:
                 info.pop("prompt")
         conv["chat_id"] = conv.pop("dialog_id")
-        ref_messages = conv["reference"]
-        if ref_messages:
-            messages = conv["messages"]
-            message_num = 0
-            ref_num = 0
-            while message_num < len(messages) and ref_num < len(ref_messages):
-                if messages[message_num]["role"] != "user":
-                    chunk_list = []
-                    if "chunks" in ref_messages[ref_num]:
-                        chunks = ref_messages[ref_num]["chunks"]
-                        for chunk in chunks:
-                            new_chunk = {
-                                "id": chunk.get("chunk_id", chunk.get("id")),
-                                "content": chunk.get("content_with_weight", chunk.get("content")),
-                                "document_id": chunk.get("doc_id", chunk.get("document_id")),
-                                "document_name": chunk.get("docnm_kwd", chunk.get("document_name")),
-                                "dataset_id": chunk.get("kb_id", chunk.get("dataset_id")),
-                                "image_id": chunk.get("image_id", chunk.get("img_id")),
-                                "positions": chunk.get("positions", chunk.get("position_int")),
-                            }
-
-                            chunk_list.append(new_chunk)
-                    messages[message_num]["reference"] = chunk_list
-                    ref_num += 1
-                message_num += 1
-        del conv["reference"]
+        _fold_references(conv["messages"], conv.pop("reference"))
+        conv["archived_segments"] = ConversationService.count_segments(conv["id"])
     return get_result(data=convs)
 
 
+@manager.route("/chats/<chat_id>/sessions/<session_id>/history", methods=["GET"])  # noqa: F821
+@token_required
+def list_session_history(tenant_id, chat_id, session_id):
+    if not DialogService.query(tenant_id=tenant_id, id=chat_id, status=StatusEnum.VALID.value):
+        return get_error_data_result(message=f"You don't own the assistant {chat_id}.")
+    e, conv = ConversationService.get_by_id(session_id)
+    if not e or conv.dialog_id != chat_id:
+        return get_error_data_result(message="The session doesn't exist")
+    e, dia = DialogService.get_by_id(chat_id)
+    before = request.args.get("before")
+    if before is not None and not before.isdigit():
+        return get_error_data_result(message="`before` should be a non-negative integer.")
+    segment = load_archived_turns(conv, dia, int(before) if before is not None else None)
+    if not segment:
+        return get_result(data=None)
+    for info in segment["message"]:
+        info.pop("prompt", None)
+    _fold_references(segment["message"], segment["reference"])
+    return get_result(data={"seq": segment["seq"], "messages": segment["message"]})
+
+
+def _fold_references(messages, ref_messages):
+    """
+    Attach to each assistant message the chunks of its reference.
+    """
+    if not ref_messages:
+        return
+    message_num = 0
+    ref_num = 0
+    while message_num < len(messages) and ref_num < len(ref_messages):
+        if messages[message_num]["role"] != "user":
+            chunk_list = []
+            if "chunks" in ref_messages[ref_num]:
+                chunks = ref_messages[ref_num]["chunks"]
+                for chunk in chunks:
+                    new_chunk = {
+                        "id": chunk.get("chunk_id", chunk.get("id")),
+                        "content": chunk.get("content_with_weight", chunk.get("content")),
+                        "document_id": chunk.get("doc_id", chunk.get("document_id")),
+                        "document_name": chunk.get("docnm_kwd", chunk.get("document_name")),
+                        "dataset_id": chunk.get("kb_id", chunk.get("dataset_id")),
+                        "image_id": chunk.get("image_id", chunk.get("img_id")),
+                        "positions": chunk.get("positions", chunk.get("position_int")),
+                    }
+
+                    chunk_list.append(new_chunk)
+            messages[message_num]["reference"] = chunk_list
+            ref_num += 1
+        message_num += 1
+
+
 @manager.route("/agents/<agent_id>/sessions", methods=["GET"])  # noqa: F821
 @token_required
 def list_agent_session(tenant_id, agent_id):
@@ -998,7 +1025,7 @@ def retrieval_test_embedded():
 
         labels = label_question(question, [kb])
         ranks = settings.retrievaler.retrieval(
-            question, embd_mdl, tenant_ids, kb_ids, page, size, similarity_threshold, vector_similarity_weight, top, doc_ids, rerank_mdl=rerank_mdl, highlight=req.get("highlight"), rank_feature=labels
+            question, embd_mdl, tenant_ids, kb_ids, page, size, similarity_threshold, vector_similarity_weight, top, doc_ids, rerank_mdl=rerank_mdl, highlight=req.get("highlight"), rank_feature=labels, with_vector=False
         )
         if use_kg:
             ck = settings.kg_retrievaler.retrieval(question, tenant_ids, kb_ids, embd_mdl, LLMBundle(kb.tenant_id, LLMType.CHAT))
@@ -36,6 +36,7 @@ from rag.utils.storage_factory import STORAGE_IMPL, STORAGE_IMPL_TYPE
 from timeit import default_timer as timer
 
 from rag.utils.redis_conn import REDIS_CONN
+from rag.utils.metrics import CONTENT_TYPE, METRICS_ENABLED, REGISTRY
 from flask import jsonify
 from api.utils.health_utils import run_health_checks
 
@@ -178,6 +179,15 @@ def healthz():
     return jsonify(result), (200 if all_ok else 500)
 
 
+@manager.route("/metrics", methods=["GET"])  # noqa: F821
+def metrics():
+    # Metrics of the worker process serving this request only, told apart by their pid label. With gunicorn,
+    # scrape every worker on its own port instead, see RAGFLOW_METRICS_PORT.
+    if not METRICS_ENABLED:
+        return "", 404
+    return REGISTRY.render(), 200, {"Content-Type": CONTENT_TYPE}
+
+
 @manager.route("/ping", methods=["GET"])  # noqa: F821
 def ping():
     return "pong", 200
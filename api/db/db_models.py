@@ -798,6 +798,18 @@ class Conversation(DataBaseModel):
         db_table = "conversation"
 
 
+class ConversationSegment(DataBaseModel):
+    id = CharField(max_length=32, primary_key=True)
+    conversation_id = CharField(max_length=32, null=False, index=True)
+    seq = IntegerField(default=0, index=True, help_text="archived segments of a conversation, oldest first")
+    message = JSONField(null=True, default=[])
+    reference = JSONField(null=True, default=[])
+
+    class Meta:
+        db_table = "conversation_segment"
+        indexes = ((("conversation_id", "seq"), True),)
+
+
 class APIToken(DataBaseModel):
     tenant_id = CharField(max_length=32, null=False, index=True)
     token = CharField(max_length=255, null=False, index=True)
@@ -1061,4 +1073,8 @@ def migrate_db():
         migrate(migrator.add_column("canvas_template", "canvas_category", CharField(max_length=32, null=False, default="agent_canvas", help_text="agent_canvas|dataflow_canvas", index=True)))
     except Exception:
         pass
+    try:
+        migrate(migrator.add_index("conversation_segment", ("conversation_id", "seq"), True))
+    except Exception:
+        pass
     logging.disable(logging.NOTSET)
@@ -211,11 +211,8 @@ def completion(tenant_id, agent_id, session_id=None, **kwargs):
         yield "data:" + json.dumps(ans, ensure_ascii=False) + "\n\n"
 
     conv.message.append({"role": "assistant", "content": txt, "created_at": time.time(), "id": message_id})
-    conv.reference = canvas.get_reference()
-    conv.errors = canvas.error
-    conv.dsl = str(canvas)
-    conv = conv.to_dict()
-    API4ConversationService.append_message(conv["id"], conv)
+    # Only persist the columns a turn changes instead of rewriting the whole row.
+    API4ConversationService.append_message(session_id, {"message": conv.message, "reference": canvas.get_reference(), "errors": canvas.error, "dsl": str(canvas)})
 
 
 def completionOpenAI(tenant_id, agent_id, question, session_id=None, stream=True, **kwargs):
@@ -13,10 +13,11 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 #
+import os
 import time
 from uuid import uuid4
 from api.db import StatusEnum
-from api.db.db_models import Conversation, DB
+from api.db.db_models import Conversation, ConversationSegment, DB
 from api.db.services.api_service import API4ConversationService
 from api.db.services.common_service import CommonService
 from api.db.services.dialog_service import DialogService, chat
@@ -25,10 +26,112 @@ import json
 
 from rag.prompts.generator import chunks_format
 
+# Messages kept in the conversation row, older turns are archived into segments loaded on demand
+# through the session history API. 0, the default, keeps the whole history in the row.
+CONVERSATION_HOT_MESSAGES = int(os.environ.get("CONVERSATION_HOT_MESSAGES", 0))
+# Dropped from the references of archived turns and fetched back by chunk id, web results keep theirs.
+ARCHIVED_CHUNK_FIELDS = ["content", "content_with_weight", "content_ltks", "highlight", "vector"]
+
+
+def archive_reference(reference):
+    if not isinstance(reference, dict):
+        return reference
+    reference = dict(reference)
+    reference["chunks"] = [ck if ck.get("url") else {k: v for k, v in ck.items() if k not in ARCHIVED_CHUNK_FIELDS} for ck in reference.get("chunks", [])]
+    return reference
+
 
 class ConversationService(CommonService):
     model = Conversation
 
+    @classmethod
+    @DB.connection_context()
+    def save_turn(cls, conv):
+        """
+        Persist the history of a conversation after a turn. Once it grows past CONVERSATION_HOT_MESSAGES,
+        its oldest turns move into a segment so the row, rewritten on every turn, stays bounded.
+        """
+        with DB.atomic():
+            # Turns of one conversation saved concurrently wait on each other here. One of them may have
+            # archived part of the history this one was read with: keep only what it left in the row.
+            stored = cls.model.select(cls.model.message).where(cls.model.id == conv.id).for_update().first()
+            aligned = True
+            if stored:
+                messages = conv.message or []
+                kept = cls.drop_archived(stored.message or [], messages)
+                # Without a turn to line the history up on, references may not pair with the messages: keep both as is.
+                aligned = kept is not None
+                if aligned:
+                    conv.message = kept
+                    conv.reference = (conv.reference or [])[(len(messages) - len(conv.message)) // 2 :]
+            if aligned:
+                cls._archive_oldest_turns(conv)
+            return cls.update_by_id(conv.id, {"message": conv.message, "reference": conv.reference})
+
+    @classmethod
+    def _archive_oldest_turns(cls, conv):
+        messages, references = conv.message or [], conv.reference or []
+        if CONVERSATION_HOT_MESSAGES <= 0 or len(messages) <= CONVERSATION_HOT_MESSAGES:
+            return
+        # The prologue stays, then whole user/assistant turns along with their reference,
+        # down to half the budget so that archiving happens once every few dozen turns.
+        start = 1 if messages[0].get("role") == "assistant" else 0
+        # Each question has its reference, a history where they no longer pair up is left in the row.
+        if len(references) != sum(1 for m in messages[start:] if m.get("role") == "user"):
+            return
+        turns = (len(messages) - start - CONVERSATION_HOT_MESSAGES // 2) // 2
+        archived = messages[start : start + 2 * turns]
+        if turns <= 0 or any(m.get("role") != ("user" if i % 2 == 0 else "assistant") for i, m in enumerate(archived)):
+            return
+        last = cls.get_segments(conv.id, limit=1)
+        ConversationSegment.create(
+            id=get_uuid(),
+            conversation_id=conv.id,
+            seq=last[0]["seq"] + 1 if last else 0,
+            message=archived,
+            reference=[archive_reference(r) for r in references[:turns]],
+        )
+        conv.message = messages[:start] + messages[start + 2 * turns :]
+        conv.reference = references[turns:]
+
+    @staticmethod
+    def drop_archived(stored, incoming):
+        """
+        Drop from the history a client sent back the turns already archived,
+        those before the oldest turn still kept in the row.
+        Returns None when that turn cannot be found in it.
+        """
+        oldest = next((m.get("id") for m in stored if m.get("role") == "user" and m.get("id")), None)
+        if not oldest:
+            return None
+        for i, m in enumerate(incoming):
+            if m.get("id") == oldest:
+                prologue = incoming[:1] if i > 0 and incoming[0].get("role") == "assistant" else []
+                return prologue + incoming[i:]
+        return None
+
+    @classmethod
+    @DB.connection_context()
+    def get_segments(cls, conversation_id, before_seq=None, limit=1):
+        """
+        Archived segments of a conversation, the most recent first.
+        """
+        segments = ConversationSegment.select().where(ConversationSegment.conversation_id == conversation_id)
+        if before_seq is not None:
+            segments = segments.where(ConversationSegment.seq < before_seq)
+        return list(segments.order_by(ConversationSegment.seq.desc()).limit(limit).dicts())
+
+    @classmethod
+    @DB.connection_context()
+    def count_segments(cls, conversation_id):
+        return ConversationSegment.select().where(ConversationSegment.conversation_id == conversation_id).count()
+
+    @classmethod
+    @DB.connection_context()
+    def delete_by_id(cls, pid):
+        ConversationSegment.delete().where(ConversationSegment.conversation_id == pid).execute()
+        return super().delete_by_id(pid)
+
     @classmethod
     @DB.connection_context()
     def get_list(cls, dialog_id, page_number, items_per_page, orderby, desc, id, name, user_id=None):
@@ -91,7 +194,54 @@ def structure_answer(conv, ans, message_id, session_id):
     return ans
 
 
-def completion(tenant_id, chat_id, question, name="New session", session_id=None, stream=True, **kwargs):
+def load_archived_turns(conv, dialog, before_seq=None):
+    """
+    The segment archived right before `before_seq` (the latest one when None) with the content of its cited chunks
+    fetched back from the doc store. Returns None when there is nothing older.
+    """
+    from api import settings
+    from api.db.services.knowledgebase_service import KnowledgebaseService
+    from rag.nlp.search import index_name
+
+    segments = ConversationService.get_segments(conv.id, before_seq=before_seq, limit=1)
+    if not segments:
+        return None
+    segment = segments[0]
+    chunks = [ck for ref in segment["reference"] if isinstance(ref, dict) for ck in ref.get("chunks", []) if "content" not in ck]
+    if chunks:
+        kbs = KnowledgebaseService.get_by_ids(dialog.kb_ids)
+        fields = settings.retrievaler.fetch_fields(
+            list(set([ck["id"] for ck in chunks])), ["content_with_weight"], [index_name(t) for t in set([kb.tenant_id for kb in kbs])], dialog.kb_ids
+        )
+        for ck in chunks:
+            ck["content"] = fields.get(ck["id"], {}).get("content_with_weight", "")
+    return {"seq": segment["seq"], "message": segment["message"], "reference": segment["reference"]}
+
+
+def delta_answer(ans, streamed):
+    """
+    Rewrite a cumulative streaming answer into one carrying only the text added since `streamed`.
+    An answer that no longer extends what was streamed (e.g. citations were inserted) is sent whole with `replace`,
+    references and prompt are only sent by the event that has them, the final one.
+    Returns the event and the text streamed so far.
+    """
+    answer = ans["answer"] or ""
+    res = {k: v for k, v in ans.items() if k not in ["answer", "reference", "prompt"]}
+    res["delta"] = True
+    if answer.startswith(streamed):
+        res["answer"] = answer[len(streamed) :]
+    else:
+        res["answer"] = answer
+        res["replace"] = True
+    reference = ans.get("reference")
+    if reference and (reference.get("chunks") or reference.get("doc_aggs")):
+        res["reference"] = reference
+    if ans.get("prompt"):
+        res["prompt"] = ans["prompt"]
+    return res, answer
+
+
+def completion(tenant_id, chat_id, question, name="New session", session_id=None, stream=True, delta=False, **kwargs):
     assert name, "`name` can not be empty."
     dia = DialogService.query(id=chat_id, tenant_id=tenant_id, status=StatusEnum.VALID.value)
     assert dia, "You do not own the chat."
@@ -142,11 +292,14 @@ def completion(tenant_id, chat_id, question, name="New session", session_id=None
     conv.reference.append({"chunks": [], "doc_aggs": []})
 
     if stream:
+        streamed = ""
         try:
             for ans in chat(dia, msg, True, **kwargs):
                 ans = structure_answer(conv, ans, message_id, session_id)
+                if delta:
+                    ans, streamed = delta_answer(ans, streamed)
                 yield "data:" + json.dumps({"code": 0, "data": ans}, ensure_ascii=False) + "\n\n"
-            ConversationService.update_by_id(conv.id, conv.to_dict())
+            ConversationService.save_turn(conv)
         except Exception as e:
             yield "data:" + json.dumps({"code": 500, "message": str(e), "data": {"answer": "**ERROR**: " + str(e), "reference": []}}, ensure_ascii=False) + "\n\n"
         yield "data:" + json.dumps({"code": 0, "data": True}, ensure_ascii=False) + "\n\n"
@@ -155,12 +308,12 @@ def completion(tenant_id, chat_id, question, name="New session", session_id=None
         answer = None
         for ans in chat(dia, msg, False, **kwargs):
             answer = structure_answer(conv, ans, message_id, session_id)
-            ConversationService.update_by_id(conv.id, conv.to_dict())
+            ConversationService.save_turn(conv)
             break
         yield answer
 
 
-def iframe_completion(dialog_id, question, session_id=None, stream=True, **kwargs):
+def iframe_completion(dialog_id, question, session_id=None, stream=True, delta=False, **kwargs):
     e, dia = DialogService.get_by_id(dialog_id)
     assert e, "Dialog not found"
     if not session_id:
@@ -201,9 +354,12 @@ def iframe_completion(dialog_id, question, session_id=None, stream=True, **kwarg
     conv.reference.append({"chunks": [], "doc_aggs": []})
 
     if stream:
+        streamed = ""
         try:
             for ans in chat(dia, msg, True, **kwargs):
                 ans = structure_answer(conv, ans, message_id, session_id)
+                if delta:
+                    ans, streamed = delta_answer(ans, streamed)
                 yield "data:" + json.dumps({"code": 0, "message": "", "data": ans}, ensure_ascii=False) + "\n\n"
             API4ConversationService.append_message(conv.id, conv.to_dict())
         except Exception as e:
@@ -15,8 +15,10 @@
 #
 import binascii
 import logging
+import os
 import re
 import time
+from concurrent.futures import ThreadPoolExecutor
 from copy import deepcopy
 from datetime import datetime
 from functools import partial
@@ -35,14 +37,28 @@ from api.db.services.langfuse_service import TenantLangfuseService
 from api.db.services.llm_service import LLMBundle
 from api.db.services.tenant_llm_service import TenantLLMService
 from api.utils import current_timestamp, datetime_format
+from api.utils.stage_graph import StageGraph
 from graphrag.general.mind_map_extractor import MindMapExtractor
 from rag.app.resume import forbidden_select_fields4resume
 from rag.app.tag import label_question
+from rag.nlp import rag_tokenizer
 from rag.nlp.search import index_name
 from rag.prompts.generator import chunks_format, citation_prompt, cross_languages, full_question, kb_prompt, keyword_extraction, message_fit_in, gen_meta_filter, PROMPT_JINJA_ENV, ASK_SUMMARY
 from rag.utils import num_tokens_from_string, rmSpace
+from rag.utils.metrics import CHAT_SECONDS, SPECULATIVE_RETRIEVALS
 from rag.utils.tavily_conn import Tavily
 
+# Characters of new text gathered before a streaming event is emitted, measured by length so that the tokenizer
+# doesn't run on every streamed token.
+STREAM_FLUSH_CHARS = int(os.environ.get("STREAM_FLUSH_CHARS", 32))
+# Answer post-processing run off the request thread: embedding finished pieces of a streaming answer for citations
+# while the rest is generated, speech synthesis alongside citation insertion.
+CITATION_EXECUTOR = ThreadPoolExecutor(max_workers=int(os.environ.get("CITATION_PREFETCH_WORKERS", 8)), thread_name_prefix="citation")
+# With refine_multiturn, retrieve on the raw last question while the LLM rewrites it, and keep those results when
+# the rewrite adds little to it: at least this share of the rewrite's term weight is found in the raw question.
+SPECULATIVE_REFINE = os.environ.get("SPECULATIVE_REFINE", "false").lower() in ["1", "true", "yes"]
+SPECULATIVE_REFINE_SIMILARITY = float(os.environ.get("SPECULATIVE_REFINE_SIMILARITY", 0.8))
+
 
 class DialogService(CommonService):
     model = Dialog
@@ -193,7 +209,7 @@ def chat_solo(dialog, messages, stream=True):
         for ans in chat_mdl.chat_streamly(prompt_config.get("system", ""), msg, dialog.llm_setting):
             answer = ans
             delta_ans = ans[len(last_ans) :]
-            if num_tokens_from_string(delta_ans) < 16:
+            if len(delta_ans) < STREAM_FLUSH_CHARS:
                 continue
             last_ans = answer
             yield {"answer": answer, "reference": {}, "audio_binary": tts(tts_mdl, delta_ans), "prompt": "", "created_at": time.time()}
@@ -232,6 +248,34 @@ def get_models(dialog):
     return kbs, embd_mdl, rerank_mdl, chat_mdl, tts_mdl
 
 
+def get_langfuse_tracer(tenant_id):
+    langfuse_keys = TenantLangfuseService.filter_by_tenant(tenant_id=tenant_id)
+    if langfuse_keys:
+        langfuse = Langfuse(public_key=langfuse_keys.public_key, secret_key=langfuse_keys.secret_key, host=langfuse_keys.host)
+        if langfuse.auth_check():
+            return langfuse, {"trace_id": langfuse.create_trace_id()}
+    return None, {}
+
+
+class PrefetchedQueryEmbedding:
+    """
+    An embedding model whose vector of `question` was computed ahead, alongside other stages of the request.
+    """
+
+    def __init__(self, embd_mdl, question, encoded):
+        self.embd_mdl = embd_mdl
+        self.question = question
+        self.encoded = encoded
+
+    def encode_queries(self, query: str):
+        if query == self.question:
+            return self.encoded
+        return self.embd_mdl.encode_queries(query)
+
+    def __getattr__(self, name):
+        return getattr(self.embd_mdl, name)
+
+
 BAD_CITATION_PATTERNS = [
     re.compile(r"\(\s*ID\s*[: ]*\s*(\d+)\s*\)"),  # (ID: 12)
     re.compile(r"\[\s*ID\s*[: ]*\s*(\d+)\s*\]"),  # [ID: 12]
@@ -334,27 +378,27 @@ def chat(dialog, messages, stream=True, **kwargs):
 
     chat_start_ts = timer()
 
+    # Lookups that don't depend on each other start at once, results are waited for where they are needed.
+    stages = StageGraph("chat")
     if TenantLLMService.llm_id2llm_type(dialog.llm_id) == "image2text":
-        llm_model_config = TenantLLMService.get_model_config(dialog.tenant_id, LLMType.IMAGE2TEXT, dialog.llm_id)
+        stages.add("llm_config", TenantLLMService.get_model_config, dialog.tenant_id, LLMType.IMAGE2TEXT, dialog.llm_id)
     else:
-        llm_model_config = TenantLLMService.get_model_config(dialog.tenant_id, LLMType.CHAT, dialog.llm_id)
+        stages.add("llm_config", TenantLLMService.get_model_config, dialog.tenant_id, LLMType.CHAT, dialog.llm_id)
+    stages.add("langfuse", get_langfuse_tracer, dialog.tenant_id)
+    stages.add("models", get_models, dialog)
+    stages.add("field_map", KnowledgebaseService.get_field_map, dialog.kb_ids)
+    if dialog.meta_data_filter:
+        stages.add("metas", DocumentService.get_meta_by_kbs, dialog.kb_ids)
 
+    llm_model_config = stages.result("llm_config")
     max_tokens = llm_model_config.get("max_tokens", 8192)
 
     check_llm_ts = timer()
 
-    langfuse_tracer = None
-    trace_context = {}
-    langfuse_keys = TenantLangfuseService.filter_by_tenant(tenant_id=dialog.tenant_id)
-    if langfuse_keys:
-        langfuse = Langfuse(public_key=langfuse_keys.public_key, secret_key=langfuse_keys.secret_key, host=langfuse_keys.host)
-        if langfuse.auth_check():
-            langfuse_tracer = langfuse
-            trace_id = langfuse_tracer.create_trace_id()
-            trace_context = {"trace_id": trace_id}
+    langfuse_tracer, trace_context = stages.result("langfuse")
 
     check_langfuse_tracer_ts = timer()
-    kbs, embd_mdl, rerank_mdl, chat_mdl, tts_mdl = get_models(dialog)
+    kbs, embd_mdl, rerank_mdl, chat_mdl, tts_mdl = stages.result("models")
     toolcall_session, tools = kwargs.get("toolcall_session"), kwargs.get("tools")
     if toolcall_session and tools:
         chat_mdl.bind_tools(toolcall_session, tools)
@@ -367,7 +411,7 @@ def chat(dialog, messages, stream=True, **kwargs):
         attachments = messages[-1]["doc_ids"]
 
     prompt_config = dialog.prompt_config
-    field_map = KnowledgebaseService.get_field_map(dialog.kb_ids)
+    field_map = stages.result("field_map")
     # try to use sql if field mapping is good to go
     if field_map:
         logging.debug("Use SQL to retrieval:{}".format(questions[-1]))
@@ -384,7 +428,52 @@ def chat(dialog, messages, stream=True, **kwargs):
         if p["key"] not in kwargs:
             prompt_config["system"] = prompt_config["system"].replace("{%s}" % p["key"], " ")
 
-    if len(questions) > 1 and prompt_config.get("refine_multiturn"):
+    def add_retrieval(prefix, question):
+        tenant_ids = list(set([kb.tenant_id for kb in kbs]))
+        stages.add(prefix + "query_vector", embd_mdl.encode_queries, question)
+        stages.add(prefix + "rank_feature", label_question, question, kbs)
+        stages.add(
+            prefix + "retrieval",
+            lambda qv, rank_feature: retriever.retrieval(
+                question,
+                PrefetchedQueryEmbedding(embd_mdl, question, qv),
+                tenant_ids,
+                dialog.kb_ids,
+                1,
+                dialog.top_n,
+                dialog.similarity_threshold,
+                dialog.vector_similarity_weight,
+                doc_ids=attachments,
+                top=dialog.top_k,
+                aggs=False,
+                rerank_mdl=rerank_mdl,
+                rank_feature=rank_feature,
+            ),
+            deps=[prefix + "query_vector", prefix + "rank_feature"],
+        )
+
+    # Only when the refined question goes to retrieval as is.
+    speculate = (
+        prompt_config.get("speculative_refine", SPECULATIVE_REFINE)
+        and len(questions) > 1
+        and prompt_config.get("refine_multiturn")
+        and embd_mdl
+        and not prompt_config.get("reasoning", False)
+        and not prompt_config.get("cross_languages")
+        and not prompt_config.get("keyword", False)
+        and not dialog.meta_data_filter
+        and "knowledge" in [p["key"] for p in prompt_config["parameters"]]
+    )
+    speculation_hit = False
+    if speculate:
+        add_retrieval("speculative_", questions[-1])
+        refined = full_question(dialog.tenant_id, dialog.llm_id, messages)
+        sim = retriever.qryr.token_similarity(rag_tokenizer.tokenize(refined), [rag_tokenizer.tokenize(questions[-1])])[0]
+        speculation_hit = sim >= SPECULATIVE_REFINE_SIMILARITY
+        SPECULATIVE_RETRIEVALS.inc(result="hit" if speculation_hit else "miss")
+        logging.debug("Speculative retrieval of '{}' for '{}': similarity {:.3f}".format(questions[-1], refined, sim))
+        questions = [refined]
+    elif len(questions) > 1 and prompt_config.get("refine_multiturn"):
         questions = [full_question(dialog.tenant_id, dialog.llm_id, messages)]
     else:
         questions = questions[-1:]
@@ -392,8 +481,11 @@ def chat(dialog, messages, stream=True, **kwargs):
     if prompt_config.get("cross_languages"):
         questions = [cross_languages(dialog.tenant_id, dialog.llm_id, questions[0], prompt_config["cross_languages"])]
 
+    if prompt_config.get("keyword", False):
+        stages.add("keywords", keyword_extraction, chat_mdl, questions[-1])
+
     if dialog.meta_data_filter:
-        metas = DocumentService.get_meta_by_kbs(dialog.kb_ids)
+        metas = stages.result("metas")
         if dialog.meta_data_filter.get("method") == "auto":
             filters = gen_meta_filter(chat_mdl, metas, questions[-1])
             attachments.extend(meta_filter(metas, filters))
@@ -405,7 +497,7 @@ def chat(dialog, messages, stream=True, **kwargs):
                 attachments = None
 
     if prompt_config.get("keyword", False):
-        questions[-1] += keyword_extraction(chat_mdl, questions[-1])
+        questions[-1] += stages.result("keywords")
 
     refine_question_ts = timer()
 
@@ -440,29 +532,21 @@ def chat(dialog, messages, stream=True, **kwargs):
                 elif stream:
                     yield think
         else:
-            if embd_mdl:
-                kbinfos = retriever.retrieval(
-                    " ".join(questions),
-                    embd_mdl,
-                    tenant_ids,
-                    dialog.kb_ids,
-                    1,
-                    dialog.top_n,
-                    dialog.similarity_threshold,
-                    dialog.vector_similarity_weight,
-                    doc_ids=attachments,
-                    top=dialog.top_k,
-                    aggs=False,
-                    rerank_mdl=rerank_mdl,
-                    rank_feature=label_question(" ".join(questions), kbs),
-                )
+            question = " ".join(questions)
+            if embd_mdl and not speculation_hit:
+                add_retrieval("", question)
+            if prompt_config.get("tavily_api_key"):
+                stages.add("web_search", lambda: Tavily(prompt_config["tavily_api_key"]).retrieve_chunks(question))
+            if prompt_config.get("use_kg"):
+                stages.add("kg_retrieval", settings.kg_retrievaler.retrieval, question, tenant_ids, dialog.kb_ids, embd_mdl, LLMBundle(dialog.tenant_id, LLMType.CHAT))
+
+            kbinfos = stages.result("speculative_retrieval" if speculation_hit else "retrieval", kbinfos)
             if prompt_config.get("tavily_api_key"):
-                tav = Tavily(prompt_config["tavily_api_key"])
-                tav_res = tav.retrieve_chunks(" ".join(questions))
+                tav_res = stages.result("web_search")
                 kbinfos["chunks"].extend(tav_res["chunks"])
                 kbinfos["doc_aggs"].extend(tav_res["doc_aggs"])
             if prompt_config.get("use_kg"):
-                ck = settings.kg_retrievaler.retrieval(" ".join(questions), tenant_ids, dialog.kb_ids, embd_mdl, LLMBundle(dialog.tenant_id, LLMType.CHAT))
+                ck = stages.result("kg_retrieval")
                 if ck["content_with_weight"]:
                     kbinfos["chunks"].insert(0, ck)
 
@@ -491,6 +575,31 @@ def chat(dialog, messages, stream=True, **kwargs):
     if "max_tokens" in gen_conf:
         gen_conf["max_tokens"] = min(gen_conf["max_tokens"], max_tokens - used_token_count)
 
+    cite_ahead = bool(knowledges and embd_mdl and prompt_config.get("quote", True) and kwargs.get("quote", True))
+    requested_pieces = set()
+    piece_futures = []
+
+    def embed_finished_pieces(answer):
+        if piece_futures and not piece_futures[-1].done():
+            return
+        if re.search(r"\[ID:([0-9]+)\]", answer) or ("<think>" in answer and "</think>" not in answer):
+            return
+        _, _, pieces = retriever.citation_pieces(answer.split("</think>")[-1])
+        # The last piece may still grow.
+        todo = [p for p in pieces[:-1] if p not in requested_pieces]
+        if todo:
+            requested_pieces.update(todo)
+            piece_futures.append(CITATION_EXECUTOR.submit(lambda: dict(zip(todo, embd_mdl.encode(todo)[0]))))
+
+    def embedded_pieces():
+        vectors = {}
+        for f in piece_futures:
+            try:
+                vectors.update(f.result())
+            except Exception:
+                logging.exception("Embedding answer pieces ahead of citation failed")
+        return vectors
+
     def decorate_answer(answer):
         nonlocal embd_mdl, prompt_config, knowledges, kwargs, kbinfos, prompt, retrieval_ts, questions, langfuse_tracer
 
@@ -511,6 +620,7 @@ def chat(dialog, messages, stream=True, **kwargs):
                     embd_mdl,
                     tkweight=1 - dialog.vector_similarity_weight,
                     vtweight=dialog.vector_similarity_weight,
+                    piece_vectors=embedded_pieces(),
                 )
             else:
                 for match in re.finditer(r"\[ID:([0-9]+)\]", answer):
@@ -542,6 +652,10 @@ def chat(dialog, messages, stream=True, **kwargs):
         refine_question_time_cost = (refine_question_ts - bind_models_ts) * 1000
         retrieval_time_cost = (retrieval_ts - refine_question_ts) * 1000
         generate_result_time_cost = (finish_chat_ts - retrieval_ts) * 1000
+        CHAT_SECONDS.observe(total_time_cost / 1000, phase="total")
+        CHAT_SECONDS.observe(refine_question_time_cost / 1000, phase="refine_question")
+        CHAT_SECONDS.observe(retrieval_time_cost / 1000, phase="retrieval")
+        CHAT_SECONDS.observe(generate_result_time_cost / 1000, phase="generate")
 
         tk_num = num_tokens_from_string(think + answer)
         prompt += "\n\n### Query:\n%s" % " ".join(questions)
@@ -582,9 +696,11 @@ def chat(dialog, messages, stream=True, **kwargs):
                 ans = re.sub(r"^.*</think>", "", ans, flags=re.DOTALL)
             answer = ans
             delta_ans = ans[len(last_ans) :]
-            if num_tokens_from_string(delta_ans) < 16:
+            if len(delta_ans) < STREAM_FLUSH_CHARS:
                 continue
             last_ans = answer
+            if cite_ahead:
+                embed_finished_pieces(answer)
             yield {"answer": thought + answer, "reference": {}, "audio_binary": tts(tts_mdl, delta_ans)}
         delta_ans = answer[len(last_ans) :]
         if delta_ans:
@@ -594,8 +710,10 @@ def chat(dialog, messages, stream=True, **kwargs):
         answer = chat_mdl.chat(prompt + prompt4citation, msg[1:], gen_conf)
         user_content = msg[-1].get("content", "[content not available]")
         logging.debug("User: {}|Assistant: {}".format(user_content, answer))
+        # Speech is synthesized while citations are inserted.
+        audio = CITATION_EXECUTOR.submit(tts, tts_mdl, answer) if tts_mdl else None
         res = decorate_answer(answer)
-        res["audio_binary"] = tts(tts_mdl, answer)
+        res["audio_binary"] = audio.result() if audio else None
         yield res
 
 
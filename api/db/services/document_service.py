@@ -35,8 +35,9 @@ from api.db.services.common_service import CommonService
 from api.db.services.knowledgebase_service import KnowledgebaseService
 from api.utils import current_timestamp, get_format_time, get_uuid
 from rag.nlp import rag_tokenizer, search
-from rag.settings import get_svr_queue_name, SVR_CONSUMER_GROUP_NAME
+from rag.settings import get_svr_queue_name, SVR_CONSUMER_GROUP_NAME, TASK_FAIR_SCHEDULING
 from rag.utils.redis_conn import REDIS_CONN
+from rag.utils.task_scheduler import LANE_BACKGROUND, queue_length, queue_task, task_lane
 from rag.utils.storage_factory import STORAGE_IMPL
 from rag.utils.doc_store_conn import OrderByExpr
 
@@ -278,8 +279,13 @@ class DocumentService(CommonService):
                 if not chunk_ids:
                     break
                 all_chunk_ids.extend(chunk_ids)
+                # Images shared by identical crops are stored under their own name, see task_executor.upload_chunk_images.
+                for ck in settings.docStoreConn.getFields(chunks, ["img_id"]).values():
+                    img_id = ck.get("img_id") or ""
+                    if img_id.startswith(f"{doc.kb_id}-"):
+                        all_chunk_ids.append(img_id[len(doc.kb_id) + 1 :])
                 page += 1
-            for cid in all_chunk_ids:
+            for cid in set(all_chunk_ids):
                 if STORAGE_IMPL.obj_exist(doc.kb_id, cid):
                     STORAGE_IMPL.rm(doc.kb_id, cid)
             if doc.thumbnail and not doc.thumbnail.startswith(IMG_BASE64_PREFIX):
@@ -631,7 +637,7 @@ class DocumentService(CommonService):
                 if msg:
                     info["progress_msg"] = msg
                     if msg.endswith("created task graphrag") or msg.endswith("created task raptor"):
-                        info["progress_msg"] += "\n%d tasks are ahead in the queue..." % get_queue_length(priority)
+                        info["progress_msg"] += "\n%d tasks are ahead in the queue..." % get_queue_length(priority, LANE_BACKGROUND)
                 else:
                     info["progress_msg"] = "%d tasks are ahead in the queue..." % get_queue_length(priority)
                 cls.update_by_id(d["id"], info)
@@ -718,10 +724,12 @@ def queue_raptor_o_graphrag_tasks(doc, ty, priority):
     hasher.update(ty.encode("utf-8"))
     task["digest"] = hasher.hexdigest()
     bulk_insert_into_db(Task, [task], True)
-    assert REDIS_CONN.queue_product(get_svr_queue_name(priority), message=task), "Can't access Redis. Please check the Redis' status."
+    assert queue_task(task, chunking_config["tenant_id"], chunking_config["kb_id"], task_lane(ty, priority), priority), "Can't access Redis. Please check the Redis' status."
 
 
-def get_queue_length(priority):
+def get_queue_length(priority, lane=None):
+    if TASK_FAIR_SCHEDULING:
+        return queue_length(lane)
     group_info = REDIS_CONN.queue_info(get_svr_queue_name(priority), SVR_CONSUMER_GROUP_NAME)
     if not group_info:
         return 0
@@ -17,10 +17,16 @@ import inspect
 import logging
 import re
 from functools import partial
+from timeit import default_timer as timer
 from typing import Generator
+
+import trio
+
 from api.db.db_models import LLM
 from api.db.services.common_service import CommonService
 from api.db.services.tenant_llm_service import LLM4Tenant, TenantLLMService
+from rag.utils.llm_cache import LLM_CALL_CACHE
+from rag.utils.metrics import EMBEDDING_SECONDS, LLM_FIRST_TOKEN_SECONDS, LLM_SECONDS, RERANK_SECONDS
 
 
 class LLMService(CommonService):
@@ -97,7 +103,8 @@ class LLMBundle(LLM4Tenant):
         if self.langfuse:
             generation = self.langfuse.start_generation(trace_context=self.trace_context, name="encode", model=self.llm_name, input={"texts": texts})
 
-        embeddings, used_tokens = self.mdl.encode(texts)
+        with EMBEDDING_SECONDS.time(op="encode"):
+            embeddings, used_tokens = self.mdl.encode(texts)
         llm_name = getattr(self, "llm_name", None)
         if not TenantLLMService.increase_usage(self.tenant_id, self.llm_type, used_tokens, llm_name):
             logging.error("LLMBundle.encode can't update token usage for {}/EMBEDDING used_tokens: {}".format(self.tenant_id, used_tokens))
@@ -108,11 +115,28 @@ class LLMBundle(LLM4Tenant):
 
         return embeddings, used_tokens
 
+    async def async_encode(self, texts: list):
+        if self.langfuse:
+            generation = self.langfuse.start_generation(trace_context=self.trace_context, name="encode", model=self.llm_name, input={"texts": texts})
+
+        with EMBEDDING_SECONDS.time(op="encode"):
+            embeddings, used_tokens = await self.mdl.async_encode(texts)
+        llm_name = getattr(self, "llm_name", None)
+        if not await trio.to_thread.run_sync(lambda: TenantLLMService.increase_usage(self.tenant_id, self.llm_type, used_tokens, llm_name)):
+            logging.error("LLMBundle.async_encode can't update token usage for {}/EMBEDDING used_tokens: {}".format(self.tenant_id, used_tokens))
+
+        if self.langfuse:
+            generation.update(usage_details={"total_tokens": used_tokens})
+            generation.end()
+
+        return embeddings, used_tokens
+
     def encode_queries(self, query: str):
         if self.langfuse:
             generation = self.langfuse.start_generation(trace_context=self.trace_context, name="encode_queries", model=self.llm_name, input={"query": query})
 
-        emd, used_tokens = self.mdl.encode_queries(query)
+        with EMBEDDING_SECONDS.time(op="encode_queries"):
+            emd, used_tokens = self.mdl.encode_queries(query)
         llm_name = getattr(self, "llm_name", None)
         if not TenantLLMService.increase_usage(self.tenant_id, self.llm_type, used_tokens, llm_name):
             logging.error("LLMBundle.encode_queries can't update token usage for {}/EMBEDDING used_tokens: {}".format(self.tenant_id, used_tokens))
@@ -127,7 +151,8 @@ class LLMBundle(LLM4Tenant):
         if self.langfuse:
             generation = self.langfuse.start_generation(trace_context=self.trace_context, name="similarity", model=self.llm_name, input={"query": query, "texts": texts})
 
-        sim, used_tokens = self.mdl.similarity(query, texts)
+        with RERANK_SECONDS.time():
+            sim, used_tokens = self.mdl.similarity(query, texts)
         if not TenantLLMService.increase_usage(self.tenant_id, self.llm_type, used_tokens):
             logging.error("LLMBundle.similarity can't update token usage for {}/RERANK used_tokens: {}".format(self.tenant_id, used_tokens))
 
@@ -224,7 +249,20 @@ class LLMBundle(LLM4Tenant):
             use_kwargs = {k: v for k, v in kwargs.items() if k in keyword_args}
         return use_kwargs
 
+    def _cache_key(self, system: str, history: list, gen_conf: dict, **kwargs) -> str:
+        # Per tenant: a tenant's own API key and base url are not told apart by the model name alone.
+        mdl_cfg = [self.tenant_id, type(self.mdl).__name__, getattr(self.mdl, "model_name", self.llm_name), str(getattr(getattr(self.mdl, "client", None), "base_url", ""))]
+        return LLM_CALL_CACHE.key(mdl_cfg, system, history, gen_conf, **kwargs)
+
     def chat(self, system: str, history: list, gen_conf: dict = {}, **kwargs) -> str:
+        # Opt-in response cache for deterministic helper calls; never used with tool calling.
+        cache_key = None
+        if kwargs.pop("cache", False) and LLM_CALL_CACHE and not (self.is_tools and self.mdl.is_tools):
+            cache_key = self._cache_key(system, history, gen_conf, **kwargs)
+            cached = LLM_CALL_CACHE.get(cache_key)
+            if cached is not None:
+                return cached
+
         if self.langfuse:
             generation = self.langfuse.start_generation(trace_context=self.trace_context, name="chat", model=self.llm_name, input={"system": system, "history": history})
 
@@ -233,7 +271,8 @@ class LLMBundle(LLM4Tenant):
             chat_partial = partial(self.mdl.chat_with_tools, system, history, gen_conf)
 
         use_kwargs = self._clean_param(chat_partial, **kwargs)
-        txt, used_tokens = chat_partial(**use_kwargs)
+        with LLM_SECONDS.time(op="chat"):
+            txt, used_tokens = chat_partial(**use_kwargs)
         txt = self._remove_reasoning_content(txt)
 
         if not self.verbose_tool_use:
@@ -246,6 +285,9 @@ class LLMBundle(LLM4Tenant):
             generation.update(output={"output": txt}, usage_details={"total_tokens": used_tokens})
             generation.end()
 
+        if cache_key and isinstance(txt, str) and txt and txt.find("**ERROR**") < 0:
+            LLM_CALL_CACHE.set(cache_key, txt)
+
         return txt
 
     def chat_streamly(self, system: str, history: list, gen_conf: dict = {}, **kwargs):
@@ -258,7 +300,12 @@ class LLMBundle(LLM4Tenant):
         if self.is_tools and self.mdl.is_tools:
             chat_partial = partial(self.mdl.chat_streamly_with_tools, system, history, gen_conf)
         use_kwargs = self._clean_param(chat_partial, **kwargs)
+        st = timer()
+        first_token = True
         for txt in chat_partial(**use_kwargs):
+            if first_token:
+                LLM_FIRST_TOKEN_SECONDS.observe(timer() - st)
+                first_token = False
             if isinstance(txt, int):
                 total_tokens = txt
                 if self.langfuse:
@@ -275,6 +322,7 @@ class LLMBundle(LLM4Tenant):
             ans += txt
             yield ans
 
+        LLM_SECONDS.observe(timer() - st, op="chat_streamly")
         if total_tokens > 0:
             if not TenantLLMService.increase_usage(self.tenant_id, self.llm_type, txt, self.llm_name):
                 logging.error("LLMBundle.chat_streamly can't update token usage for {}/CHAT llm_name: {}, content: {}".format(self.tenant_id, self.llm_name, txt))
@@ -29,9 +29,9 @@ from api.db.services.common_service import CommonService
 from api.db.services.document_service import DocumentService
 from api.utils import current_timestamp, get_uuid
 from deepdoc.parser.excel_parser import RAGFlowExcelParser
-from rag.settings import get_svr_queue_name
 from rag.utils.storage_factory import STORAGE_IMPL
 from rag.utils.redis_conn import REDIS_CONN
+from rag.utils.task_scheduler import queue_task, task_lane
 from api import settings
 from rag.nlp import search
 
@@ -98,6 +98,7 @@ class TaskService(CommonService):
             Document.type,
             Document.location,
             Document.size,
+            Document.create_time.alias("doc_create_time"),
             Knowledgebase.tenant_id,
             Knowledgebase.language,
             Knowledgebase.embd_id,
@@ -299,7 +300,7 @@ class TaskService(CommonService):
         return cls.model.delete().where(cls.model.doc_id.in_(doc_ids)).execute()
 
 
-def queue_tasks(doc: dict, bucket: str, name: str, priority: int):
+def queue_tasks(doc: dict, bucket: str, name: str, priority: int, bulk: bool = False):
     """Create and queue document processing tasks.
 
     This function creates processing tasks for a document based on its type and configuration.
@@ -312,6 +313,7 @@ def queue_tasks(doc: dict, bucket: str, name: str, priority: int):
         bucket (str): Storage bucket name where the document is stored.
         name (str): File name of the document.
         priority (int, optional): Priority level for task queueing (default is 0).
+        bulk (bool, optional): Part of a parse request of many documents, queued in the bulk lane.
 
     Note:
         - For PDF documents, tasks are created per page range based on configuration
@@ -392,8 +394,9 @@ def queue_tasks(doc: dict, bucket: str, name: str, priority: int):
     DocumentService.begin2parse(doc["id"])
 
     unfinished_task_array = [task for task in parse_task_array if task["progress"] < 1.0]
+    lane = task_lane(priority=priority, bulk=bulk)
     for unfinished_task in unfinished_task_array:
-        assert REDIS_CONN.queue_product(get_svr_queue_name(priority), message=unfinished_task), "Can't access Redis. Please check the Redis' status."
+        assert queue_task(unfinished_task, chunking_config["tenant_id"], chunking_config["kb_id"], lane, priority), "Can't access Redis. Please check the Redis' status."
 
 
 def reuse_prev_task_chunks(task: dict, prev_tasks: list[dict], chunking_config: dict):
@@ -486,7 +489,7 @@ def queue_dataflow(dsl: str, tenant_id: str, doc_id: str, task_id: str, flow_id:
     task["dsl"] = dsl
     task["dataflow_id"] = get_uuid() if not flow_id else flow_id
 
-    if not REDIS_CONN.queue_product(get_svr_queue_name(priority), message=task):
+    if not queue_task(task, tenant_id, kb_id, task_lane(priority=priority), priority):
         return False, "Can't access Redis. Please check the Redis' status."
 
     return True, ""
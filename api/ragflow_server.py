@@ -24,6 +24,7 @@ from plugin import GlobalPluginManager
 init_root_logger("ragflow_server")
 
 import logging
+import multiprocessing
 import os
 import signal
 import sys
@@ -45,12 +46,26 @@ from api.versions import get_ragflow_version
 from api.utils.configs import show_configs
 from rag.settings import print_rag_settings
 from rag.utils.mcp_tool_call_conn import shutdown_all_mcp_sessions
+from rag.utils.metrics import serve_metrics
 from rag.utils.redis_conn import RedisDistributedLock
 
 stop_event = threading.Event()
 
 RAGFLOW_DEBUGPY_LISTEN = int(os.environ.get("RAGFLOW_DEBUGPY_LISTEN", "0"))
 
+# `werkzeug`: the single process, thread per connection server. `gunicorn`: pre-forked workers (needs gunicorn installed).
+RAGFLOW_SERVER_MODE = os.environ.get("RAGFLOW_SERVER_MODE", "werkzeug").lower()
+RAGFLOW_HTTP_WORKERS = int(os.environ.get("RAGFLOW_HTTP_WORKERS", multiprocessing.cpu_count()))
+RAGFLOW_HTTP_THREADS = int(os.environ.get("RAGFLOW_HTTP_THREADS", 32))
+# `gthread`, or `gevent` for many long lived SSE completions per worker (needs gevent installed).
+RAGFLOW_HTTP_WORKER_CLASS = os.environ.get("RAGFLOW_HTTP_WORKER_CLASS", "gthread")
+RAGFLOW_HTTP_TIMEOUT = int(os.environ.get("RAGFLOW_HTTP_TIMEOUT", 600))
+RAGFLOW_HTTP_GRACEFUL_TIMEOUT = int(os.environ.get("RAGFLOW_HTTP_GRACEFUL_TIMEOUT", 120))
+RAGFLOW_HTTP_MAX_REQUESTS = int(os.environ.get("RAGFLOW_HTTP_MAX_REQUESTS", 0))
+# With gunicorn, /metrics only shows the worker that served the request: each worker also serves its own
+# metrics on the first free port from this one on. 0 disables it.
+RAGFLOW_METRICS_PORT = int(os.environ.get("RAGFLOW_METRICS_PORT", 0))
+
 
 def update_progress():
     lock_value = str(uuid.uuid4())
@@ -71,6 +86,65 @@ def update_progress():
             stop_event.wait(6)
 
 
+def run_background_jobs():
+    """
+    Process-wide singletons of the server, run once per node instead of once per HTTP worker.
+    Runs in a spawned process so that no HTTP worker inherits its DB/doc store connections.
+    """
+    settings.init_settings()
+    signal.signal(signal.SIGTERM, lambda sig, frame: stop_event.set())
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    update_progress()
+
+
+def serve_gunicorn():
+    from gunicorn.app.base import BaseApplication
+    from api.db.db_models import DB
+
+    def post_fork(server, worker):
+        # Connections opened by the master before forking must not be shared: the doc store singletons are
+        # per pid, so re-initializing builds fresh clients for this worker.
+        settings.init_settings()
+        if RAGFLOW_METRICS_PORT > 0:
+            # A replaced worker takes the port its predecessor freed.
+            for port in range(RAGFLOW_METRICS_PORT, RAGFLOW_METRICS_PORT + 2 * RAGFLOW_HTTP_WORKERS):
+                if serve_metrics(port):
+                    break
+
+    def worker_exit(server, worker):
+        shutdown_all_mcp_sessions()
+
+    class RAGFlowApplication(BaseApplication):
+        def load_config(self):
+            for k, v in {
+                "bind": f"{settings.HOST_IP}:{settings.HOST_PORT}",
+                "workers": RAGFLOW_HTTP_WORKERS,
+                "threads": RAGFLOW_HTTP_THREADS,
+                "worker_class": RAGFLOW_HTTP_WORKER_CLASS,
+                "timeout": RAGFLOW_HTTP_TIMEOUT,
+                "graceful_timeout": RAGFLOW_HTTP_GRACEFUL_TIMEOUT,
+                "max_requests": RAGFLOW_HTTP_MAX_REQUESTS,
+                "max_requests_jitter": RAGFLOW_HTTP_MAX_REQUESTS // 10,
+                "post_fork": post_fork,
+                "worker_exit": worker_exit,
+            }.items():
+                self.cfg.set(k, v)
+
+        def load(self):
+            return app
+
+    background = multiprocessing.get_context("spawn").Process(target=run_background_jobs, name="ragflow_background", daemon=True)
+    background.start()
+    # The master never serves requests: drop its pooled DB connections so workers don't inherit them.
+    DB.close_all()
+    try:
+        logging.info(f"RAGFlow HTTP server start with {RAGFLOW_HTTP_WORKERS} {RAGFLOW_HTTP_WORKER_CLASS} workers...")
+        RAGFlowApplication().run()
+    finally:
+        background.terminate()
+        background.join(10)
+
+
 def signal_handler(sig, frame):
     logging.info("Received interrupt signal, shutting down...")
     shutdown_all_mcp_sessions()
@@ -125,6 +199,33 @@ if __name__ == "__main__":
 
     GlobalPluginManager.load_plugins()
 
+    if RAGFLOW_SERVER_MODE == "gunicorn":
+        try:
+            import gunicorn  # noqa: F401
+        except ImportError:
+            logging.error("RAGFLOW_SERVER_MODE=gunicorn but gunicorn isn't installed, falling back to the werkzeug server.")
+            RAGFLOW_SERVER_MODE = "werkzeug"
+
+    # init smtp server
+    if settings.SMTP_CONF:
+        app.config["MAIL_SERVER"] = settings.MAIL_SERVER
+        app.config["MAIL_PORT"] = settings.MAIL_PORT
+        app.config["MAIL_USE_SSL"] = settings.MAIL_USE_SSL
+        app.config["MAIL_USE_TLS"] = settings.MAIL_USE_TLS
+        app.config["MAIL_USERNAME"] = settings.MAIL_USERNAME
+        app.config["MAIL_PASSWORD"] = settings.MAIL_PASSWORD
+        app.config["MAIL_DEFAULT_SENDER"] = settings.MAIL_DEFAULT_SENDER
+        smtp_mail_server.init_app(app)
+
+    if RAGFLOW_SERVER_MODE == "gunicorn" and not RuntimeConfig.DEBUG:
+        # gunicorn owns the signals: SIGTERM drains the workers within RAGFLOW_HTTP_GRACEFUL_TIMEOUT.
+        try:
+            serve_gunicorn()
+        except Exception:
+            traceback.print_exc()
+            os.kill(os.getpid(), signal.SIGKILL)
+        sys.exit(0)
+
     signal.signal(signal.SIGINT, signal_handler)
     signal.signal(signal.SIGTERM, signal_handler)
 
@@ -139,17 +240,6 @@ if __name__ == "__main__":
     else:
         threading.Timer(1.0, delayed_start_update_progress).start()
 
-    # init smtp server
-    if settings.SMTP_CONF:
-        app.config["MAIL_SERVER"] = settings.MAIL_SERVER
-        app.config["MAIL_PORT"] = settings.MAIL_PORT
-        app.config["MAIL_USE_SSL"] = settings.MAIL_USE_SSL
-        app.config["MAIL_USE_TLS"] = settings.MAIL_USE_TLS
-        app.config["MAIL_USERNAME"] = settings.MAIL_USERNAME
-        app.config["MAIL_PASSWORD"] = settings.MAIL_PASSWORD
-        app.config["MAIL_DEFAULT_SENDER"] = settings.MAIL_DEFAULT_SENDER
-        smtp_mail_server.init_app(app)
-
     # start http server
     try:
         logging.info("RAGFlow HTTP server start...")
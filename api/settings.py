@@ -27,6 +27,7 @@ from api.constants import RAG_FLOW_SERVICE_NAME
 from api.utils.configs import decrypt_database_config, get_base_config
 from api.utils.file_utils import get_project_base_directory
 from rag.nlp import search
+from rag.utils.metrics import METRICS_ENABLED, TimedDocStoreConnection
 
 LIGHTEN = int(os.environ.get("LIGHTEN", "0"))
 
@@ -186,6 +187,8 @@ def init_settings():
         docStoreConn = rag.utils.opensearch_conn.OSConnection()
     else:
         raise Exception(f"Not supported doc engine: {DOC_ENGINE}")
+    if METRICS_ENABLED:
+        docStoreConn = TimedDocStoreConnection(docStoreConn)
 
     retrievaler = search.Dealer(docStoreConn)
     from graphrag import search as kg_search
@@ -18,11 +18,12 @@ import functools
 import json
 import logging
 import os
-import queue
 import random
 import threading
 import time
 from base64 import b64encode
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from copy import deepcopy
 from functools import wraps
 from hmac import HMAC
@@ -57,6 +58,7 @@ from api.db.services.tenant_llm_service import TenantLLMService
 from api.utils.json import CustomJSONEncoder, json_dumps
 from api.utils import get_uuid
 from rag.utils.mcp_tool_call_conn import MCPToolCallSession, close_multiple_mcp_toolcall_sessions
+from rag.utils.metrics import REGISTRY, stats_families
 
 requests.models.complexjson.dumps = functools.partial(json.dumps, cls=CustomJSONEncoder)
 
@@ -697,35 +699,63 @@ TimeoutException = Union[Type[BaseException], BaseException]
 OnTimeoutCallback = Union[Callable[..., Any], Coroutine[Any, Any, Any]]
 
 
+# Only used with ENABLE_TIMEOUT_ASSERTION: a call that hangs past its deadline keeps one of these workers busy
+# instead of leaking a fresh thread per call.
+_timeout_local = threading.local()
+
+
+def _mark_timeout_worker():
+    _timeout_local.in_executor = True
+
+
+TIMEOUT_EXECUTOR = ThreadPoolExecutor(max_workers=int(os.environ.get("TIMEOUT_EXECUTOR_WORKERS", 32)), thread_name_prefix="timeout", initializer=_mark_timeout_worker)
+_timeout_stats = defaultdict(lambda: {"calls": 0, "timeouts": 0, "elapsed": 0.0})
+_timeout_stats_lock = threading.Lock()
+
+
+def _record_timeout_stats(name: str, elapsed: float, timed_out: bool = False):
+    with _timeout_stats_lock:
+        st = _timeout_stats[name]
+        st["calls"] += 1
+        st["elapsed"] += elapsed
+        if timed_out:
+            st["timeouts"] += 1
+
+
+def timeout_stats() -> dict:
+    """
+    Calls, timeouts and total elapsed seconds of every function decorated with `timeout`.
+    """
+    with _timeout_stats_lock:
+        return {name: dict(st) for name, st in _timeout_stats.items()}
+
+
+REGISTRY.register_collector(lambda: stats_families("ragflow_timeout", "Functions decorated with `timeout`", timeout_stats(), ["function"]))
+
+
 def timeout(seconds: float | int = None, attempts: int = 2, *, exception: Optional[TimeoutException] = None, on_timeout: Optional[OnTimeoutCallback] = None):
     def decorator(func):
         @wraps(func)
         def wrapper(*args, **kwargs):
-            result_queue = queue.Queue(maxsize=1)
-
-            def target():
+            st = time.perf_counter()
+            # No deadline to enforce, or called from a function already running under one: run on the caller's thread.
+            # A nested call waiting on TIMEOUT_EXECUTOR from one of its own workers could deadlock the pool.
+            if seconds is None or not os.environ.get("ENABLE_TIMEOUT_ASSERTION") or getattr(_timeout_local, "in_executor", False):
                 try:
-                    result = func(*args, **kwargs)
-                    result_queue.put(result)
-                except Exception as e:
-                    result_queue.put(e)
-
-            thread = threading.Thread(target=target)
-            thread.daemon = True
-            thread.start()
+                    return func(*args, **kwargs)
+                finally:
+                    _record_timeout_stats(func.__qualname__, time.perf_counter() - st)
 
-            for a in range(attempts):
-                try:
-                    if os.environ.get("ENABLE_TIMEOUT_ASSERTION"):
-                        result = result_queue.get(timeout=seconds)
-                    else:
-                        result = result_queue.get()
-                    if isinstance(result, Exception):
-                        raise result
-                    return result
-                except queue.Empty:
-                    pass
-            raise TimeoutError(f"Function '{func.__name__}' timed out after {seconds} seconds and {attempts} attempts.")
+            timed_out = False
+            future = TIMEOUT_EXECUTOR.submit(func, *args, **kwargs)
+            try:
+                return future.result(timeout=seconds * attempts)
+            except FutureTimeoutError:
+                future.cancel()
+                timed_out = True
+                raise TimeoutError(f"Function '{func.__name__}' timed out after {seconds} seconds and {attempts} attempts.")
+            finally:
+                _record_timeout_stats(func.__qualname__, time.perf_counter() - st, timed_out)
 
         @wraps(func)
         async def async_wrapper(*args, **kwargs) -> Any:
@@ -733,13 +763,17 @@ def timeout(seconds: float | int = None, attempts: int = 2, *, exception: Option
                 return await func(*args, **kwargs)
 
             for a in range(attempts):
+                st = time.perf_counter()
                 try:
                     if os.environ.get("ENABLE_TIMEOUT_ASSERTION"):
                         with trio.fail_after(seconds):
-                            return await func(*args, **kwargs)
+                            res = await func(*args, **kwargs)
                     else:
-                        return await func(*args, **kwargs)
+                        res = await func(*args, **kwargs)
+                    _record_timeout_stats(func.__qualname__, time.perf_counter() - st)
+                    return res
                 except trio.TooSlowError:
+                    _record_timeout_stats(func.__qualname__, time.perf_counter() - st, timed_out=True)
                     if a < attempts - 1:
                         continue
                     if on_timeout is not None:
@@ -0,0 +1,93 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from timeit import default_timer as timer
+from typing import Any, Callable
+
+from rag.utils.metrics import REGISTRY, stats_families
+
+STAGE_WORKERS = int(os.environ.get("STAGE_WORKERS", 64))
+STAGE_EXECUTOR = ThreadPoolExecutor(max_workers=STAGE_WORKERS, thread_name_prefix="stage")
+
+_stats_lock = threading.Lock()
+_stats: dict[tuple[str, str], dict] = {}
+
+
+def _record(pipeline: str, stage: str, elapsed: float, failed: bool):
+    with _stats_lock:
+        st = _stats.setdefault((pipeline, stage), {"count": 0, "failed": 0, "seconds": 0.0, "max_seconds": 0.0})
+        st["count"] += 1
+        st["failed"] += int(failed)
+        st["seconds"] += elapsed
+        st["max_seconds"] = max(st["max_seconds"], elapsed)
+
+
+def stage_stats() -> dict[str, dict[str, dict]]:
+    """
+    Accumulated timings of every stage run so far, by pipeline then stage.
+    """
+    with _stats_lock:
+        res = {}
+        for (pipeline, stage), st in _stats.items():
+            res.setdefault(pipeline, {})[stage] = dict(st)
+        return res
+
+
+REGISTRY.register_collector(lambda: stats_families("ragflow_stage", "Stages of StageGraph pipelines", stage_stats(), ["pipeline", "stage"]))
+
+
+class StageGraph:
+    """
+    The independent steps of one request, each started on a shared pool as soon as the stages it depends on are done.
+
+        stages = StageGraph("chat")
+        stages.add("models", get_models, dialog)
+        stages.add("tags", lambda models: label_question(q, models[0]), deps=["models"])
+        tags = stages.result("tags")
+
+    A stage only waits for stages added before it, so the FIFO pool can't deadlock on them.
+    Exceptions of a stage are raised by `result` of it and of every stage depending on it.
+    """
+
+    def __init__(self, pipeline: str):
+        self.pipeline = pipeline
+        self.futures: dict[str, Future] = {}
+        self.timings: dict[str, float] = {}
+
+    def add(self, name: str, func: Callable, *args, deps: list[str] | None = None, **kwargs) -> Future:
+        deps = [self.futures[d] for d in deps or []]
+
+        def run():
+            dep_results = [d.result() for d in deps]
+            st = timer()
+            failed = True
+            try:
+                res = func(*dep_results, *args, **kwargs)
+                failed = False
+                return res
+            finally:
+                self.timings[name] = timer() - st
+                _record(self.pipeline, name, self.timings[name], failed)
+
+        self.futures[name] = STAGE_EXECUTOR.submit(run)
+        return self.futures[name]
+
+    def result(self, name: str, default: Any = None) -> Any:
+        if name not in self.futures:
+            return default
+        return self.futures[name].result()
@@ -23,7 +23,7 @@ import trio
 
 from api.utils import get_uuid
 from graphrag.query_analyze_prompt import PROMPTS
-from graphrag.utils import get_entity_type2samples, get_llm_cache, set_llm_cache, get_relation
+from graphrag.utils import get_entity_type2samples, get_relation
 from rag.utils import num_tokens_from_string, get_float
 from rag.utils.doc_store_conn import OrderByExpr
 
@@ -32,13 +32,9 @@ from rag.nlp.search import Dealer, index_name
 
 class KGSearch(Dealer):
     def _chat(self, llm_bdl, system, history, gen_conf):
-        response = get_llm_cache(llm_bdl.llm_name, system, history, gen_conf)
-        if response:
-            return response
-        response = llm_bdl.chat(system, history, gen_conf)
+        response = llm_bdl.chat(system, history, gen_conf, cache=True)
         if response.find("**ERROR**") >= 0:
             raise Exception(response)
-        set_llm_cache(llm_bdl.llm_name, system, response, history, gen_conf)
         return response
 
     def query_rewrite(self, llm, question, idxnms, kb_ids):
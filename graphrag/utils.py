@@ -28,6 +28,7 @@ from api.utils import get_uuid
 from api.utils.api_utils import timeout
 from rag.nlp import rag_tokenizer, search
 from rag.utils.doc_store_conn import OrderByExpr
+from rag.utils.metrics import CACHE_REQUESTS
 from rag.utils.redis_conn import REDIS_CONN
 
 GRAPH_FIELD_SEP = "<SEP>"
@@ -99,6 +100,7 @@ def get_llm_cache(llmnm, txt, history, genconf):
 
     k = hasher.hexdigest()
     bin = REDIS_CONN.get(k)
+    CACHE_REQUESTS.inc(cache="graphrag_llm", result="hit" if bin else "miss")
     if not bin:
         return None
     return bin
@@ -122,6 +124,7 @@ def get_embed_cache(llmnm, txt):
 
     k = hasher.hexdigest()
     bin = REDIS_CONN.get(k)
+    CACHE_REQUESTS.inc(cache="graphrag_embed", result="hit" if bin else "miss")
     if not bin:
         return
     return np.array(json.loads(bin))
@@ -137,9 +140,10 @@ def set_embed_cache(llmnm, txt, arr):
     REDIS_CONN.set(k, arr.encode("utf-8"), 24 * 3600)
 
 
-def get_tags_from_cache(kb_ids):
+def get_tags_from_cache(kb_ids, version=""):
     hasher = xxhash.xxh64()
     hasher.update(str(kb_ids).encode("utf-8"))
+    hasher.update(str(version).encode("utf-8"))
 
     k = hasher.hexdigest()
     bin = REDIS_CONN.get(k)
@@ -148,12 +152,24 @@ def get_tags_from_cache(kb_ids):
     return bin
 
 
-def set_tags_to_cache(kb_ids, tags):
+def set_tags_to_cache(kb_ids, tags, version=""):
     hasher = xxhash.xxh64()
     hasher.update(str(kb_ids).encode("utf-8"))
+    hasher.update(str(version).encode("utf-8"))
 
     k = hasher.hexdigest()
-    REDIS_CONN.set(k, json.dumps(tags).encode("utf-8"), 600)
+    # A versioned entry can't go stale, so it may live much longer.
+    REDIS_CONN.set(k, json.dumps(tags).encode("utf-8"), 24 * 3600 if version else 600)
+
+
+def get_tags_version(kb_ids):
+    """
+    Version of the tag prior of `kb_ids`: it changes whenever any of the tag knowledge bases changes.
+    """
+    from api.db.services.knowledgebase_service import KnowledgebaseService
+
+    kbs = KnowledgebaseService.get_by_ids(kb_ids)
+    return ",".join(sorted(f"{kb.id}:{kb.chunk_num}:{kb.update_time}" for kb in kbs))
 
 
 def tidy_graph(graph: nx.Graph, callback, check_attribute: bool = True):
@@ -398,7 +414,7 @@ async def does_graph_contains(tenant_id, kb_id, doc_id):
 
 async def get_graph_doc_ids(tenant_id, kb_id) -> list[str]:
     conds = {"fields": ["source_id"], "removed_kwd": "N", "size": 1, "knowledge_graph_kwd": ["graph"]}
-    res = await trio.to_thread.run_sync(lambda: settings.retrievaler.search(conds, search.index_name(tenant_id), [kb_id]))
+    res = await settings.retrievaler.search_async(conds, search.index_name(tenant_id), [kb_id], tenant_id=tenant_id)
     doc_ids = []
     if res.total == 0:
         return doc_ids
@@ -409,7 +425,7 @@ async def get_graph_doc_ids(tenant_id, kb_id) -> list[str]:
 
 async def get_graph(tenant_id, kb_id, exclude_rebuild=None):
     conds = {"fields": ["content_with_weight", "removed_kwd", "source_id"], "size": 1, "knowledge_graph_kwd": ["graph"]}
-    res = await trio.to_thread.run_sync(settings.retrievaler.search, conds, search.index_name(tenant_id), [kb_id])
+    res = await settings.retrievaler.search_async(conds, search.index_name(tenant_id), [kb_id], tenant_id=tenant_id)
     if not res.total == 0:
         for id in res.ids:
             try:
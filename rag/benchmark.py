@@ -15,17 +15,27 @@
 #
 import json
 import os
+import re
+import subprocess
 import sys
+import threading
 import time
 import argparse
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from timeit import default_timer as timer
+
+import numpy as np
+import xxhash
 
 from api.db import LLMType
 from api.db.services.llm_service import LLMBundle
 from api.db.services.knowledgebase_service import KnowledgebaseService
 from api import settings
 from api.utils import get_uuid
-from rag.nlp import tokenize, search
+from rag.nlp import rag_tokenizer, tokenize, search
+from rag.utils.memory_conn import MemoryConnection
 from ranx import evaluate
 from ranx import Qrels, Run
 import pandas as pd
@@ -34,25 +44,218 @@ from tqdm import tqdm
 global max_docs
 max_docs = sys.maxsize
 
+QUALITY_METRICS = ["ndcg@10", "map@5", "mrr@10"]
+# Stage -> the Dealer methods timed as it. Time spent in a nested stage only counts for the inner one.
+RETRIEVAL_STAGES = {
+    "query_parse": ["qryr.question"],
+    "embed": ["get_vector"],
+    "search": ["search"],
+    "rerank": ["rerank", "rerank_by_model", "rerank_by_store_score"],
+    "citation": ["insert_citations"],
+}
+
+
+class HashEmbedding:
+    """
+    Deterministic feature-hashing embedding standing in for a model in offline benchmarks: texts sharing tokens get
+    close vectors, so dense retrieval and citations behave sensibly without any model service.
+    `latency` seconds are slept per call to mimic a model round trip.
+    """
+
+    def __init__(self, dim: int = 256, latency: float = 0.0):
+        self.dim = dim
+        self.latency = latency
+        self.llm_name = f"hash-{dim}"
+        self.max_length = 8192
+
+    def _encode_one(self, text: str) -> np.ndarray:
+        v = np.zeros(self.dim, dtype=np.float32)
+        for tk in rag_tokenizer.tokenize(text).split():
+            h = xxhash.xxh64_intdigest(tk)
+            v[h % self.dim] += 1.0 if (h >> 63) else -1.0
+        norm = np.linalg.norm(v)
+        return v / norm if norm else v
+
+    def encode(self, texts: list):
+        if self.latency:
+            time.sleep(self.latency)
+        return np.array([self._encode_one(t) for t in texts]), sum(len(t) for t in texts)
+
+    async def async_encode(self, texts: list):
+        return self.encode(texts)
+
+    def encode_queries(self, text: str):
+        if self.latency:
+            time.sleep(self.latency)
+        return self._encode_one(text), len(text)
+
+
+class StageTimer:
+    """
+    Collects the exclusive time of every call of the wrapped functions by stage, from any number of threads.
+    """
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def wrap(self, stage: str, func):
+        def timed(*args, **kwargs):
+            stack = self._local.__dict__.setdefault("stack", [])
+            stack.append(0.0)
+            st = timer()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = timer() - st
+                nested = stack.pop()
+                if stack:
+                    stack[-1] += elapsed
+                with self._lock:
+                    self.samples[stage].append(elapsed - nested)
+
+        return timed
+
+    def wrap_async(self, stage: str, func):
+        async def timed(*args, **kwargs):
+            st = timer()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self.samples[stage].append(timer() - st)
+
+        return timed
+
+    def take(self) -> dict[str, float]:
+        """
+        Total seconds by stage since the last call.
+        """
+        with self._lock:
+            totals = {stage: sum(samples) for stage, samples in self.samples.items()}
+            self.samples.clear()
+        return totals
+
+    def instrument(self, dealer: search.Dealer):
+        for stage, names in RETRIEVAL_STAGES.items():
+            for name in names:
+                owner, _, attr = name.rpartition(".")
+                obj = getattr(dealer, owner) if owner else dealer
+                setattr(obj, attr, self.wrap(stage, getattr(obj, attr)))
+        return dealer
+
+    def summary(self, queries: int) -> dict:
+        with self._lock:
+            return {stage: latency_summary(samples, queries) for stage, samples in self.samples.items()}
+
+
+def latency_summary(samples: list[float], queries: int = 0) -> dict:
+    """
+    Milliseconds percentiles of the samples, plus the mean time per query when `queries` is given.
+    """
+    if not samples:
+        return {}
+    ms = np.array(samples) * 1000
+    res = {
+        "calls": len(samples),
+        "mean_ms": round(float(ms.mean()), 3),
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(ms, 95)), 3),
+        "p99_ms": round(float(np.percentile(ms, 99)), 3),
+        "max_ms": round(float(ms.max()), 3),
+    }
+    if queries:
+        res["per_query_ms"] = round(float(ms.sum()) / queries, 3)
+    return res
+
+
+def peak_rss_mb() -> float:
+    if sys.platform == "win32":
+        import psutil
+
+        return psutil.Process().memory_info().peak_wset / 1024**2
+    import resource
+
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, KiB elsewhere.
+    return max_rss / 1024**2 if sys.platform == "darwin" else max_rss / 1024
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception:
+        return ""
+
+
+def compare_reports(baseline: dict, current: dict, tolerance: float = 0.1) -> list[str]:
+    """
+    Regressions of `current` against `baseline` beyond `tolerance` (a ratio): slower latencies,
+    lower QPS and lower quality, of every dataset and concurrency level both reports share.
+    """
+    regressions = []
+
+    def check(what, old, new, higher_is_better=False):
+        if not old or new is None:
+            return
+        change = (new - old) / old
+        if (change < -tolerance) if higher_is_better else (change > tolerance):
+            regressions.append(f"{what}: {old} -> {new} ({change:+.1%})")
+
+    for name, cur in current.get("datasets", {}).items():
+        base = baseline.get("datasets", {}).get(name)
+        if not base:
+            continue
+        for metric, value in cur.get("quality", {}).items():
+            check(f"{name} {metric}", base.get("quality", {}).get(metric), value, higher_is_better=True)
+        base_runs = {r["concurrency"]: r for r in base.get("runs", [])}
+        for run in cur.get("runs", []):
+            base_run = base_runs.get(run["concurrency"])
+            if not base_run:
+                continue
+            c = run["concurrency"]
+            check(f"{name} c={c} qps", base_run["qps"], run["qps"], higher_is_better=True)
+            check(f"{name} c={c} p95", base_run["latency"].get("p95_ms"), run["latency"].get("p95_ms"))
+            for stage, st in run["stages"].items():
+                check(f"{name} c={c} {stage} per query", base_run["stages"].get(stage, {}).get("per_query_ms"), st.get("per_query_ms"))
+    return regressions
+
 
 class Benchmark:
-    def __init__(self, kb_id):
+    def __init__(self, kb_id, offline=False, embedding_dim=256, embedding_latency=0.0):
         self.kb_id = kb_id
-        e, self.kb = KnowledgebaseService.get_by_id(kb_id)
-        self.similarity_threshold = self.kb.similarity_threshold
-        self.vector_similarity_weight = self.kb.vector_similarity_weight
-        self.embd_mdl = LLMBundle(self.kb.tenant_id, LLMType.EMBEDDING, llm_name=self.kb.embd_id, lang=self.kb.language)
+        self.offline = offline
+        if offline:
+            self.kb = None
+            self.similarity_threshold = 0.2
+            self.vector_similarity_weight = 0.3
+            self.embd_mdl = HashEmbedding(embedding_dim, embedding_latency)
+            self.doc_store = MemoryConnection()
+            self.retriever = search.Dealer(self.doc_store)
+        else:
+            e, self.kb = KnowledgebaseService.get_by_id(kb_id)
+            self.similarity_threshold = self.kb.similarity_threshold
+            self.vector_similarity_weight = self.kb.vector_similarity_weight
+            self.embd_mdl = LLMBundle(self.kb.tenant_id, LLMType.EMBEDDING, llm_name=self.kb.embd_id, lang=self.kb.language)
+            self.doc_store = settings.docStoreConn
+            self.retriever = settings.retrievaler
         self.tenant_id = ""
         self.index_name = ""
         self.initialized_index = False
+        # Concurrency levels of the latency run, none to only evaluate quality.
+        self.concurrency = []
+        self.rounds = 1
+        self.reports = {}
 
     def _get_retrieval(self, qrels):
-        # Need to wait for the ES and Infinity index to be ready
-        time.sleep(20)
+        if not self.offline:
+            # Need to wait for the ES and Infinity index to be ready
+            time.sleep(20)
         run = defaultdict(dict)
         query_list = list(qrels.keys())
         for query in query_list:
-            ranks = settings.retrievaler.retrieval(query, self.embd_mdl, self.tenant_id, [self.kb.id], 1, 30, 0.0, self.vector_similarity_weight)
+            ranks = self.retriever.retrieval(query, self.embd_mdl, self.tenant_id, [self.kb_id], 1, 30, 0.0, self.vector_similarity_weight)
             if len(ranks["chunks"]) == 0:
                 print(f"deleted query: {query}")
                 del qrels[query]
@@ -62,6 +265,89 @@ class Benchmark:
                 run[query][c["chunk_id"]] = c["similarity"]
         return run
 
+    def _retrieve_and_cite(self, dealer, query):
+        ranks = dealer.retrieval(query, self.embd_mdl, self.tenant_id, [self.kb_id], 1, 30, 0.0, self.vector_similarity_weight)
+        chunks = ranks["chunks"]
+        if chunks:
+            # An answer made of the leading sentence of the top chunks, so its pieces have chunks to cite.
+            answer = " ".join(re.split(r"(?<=[.?!。？！])\s*", ck["content_with_weight"])[0] for ck in chunks[:3])
+            dealer.insert_citations(
+                answer, [ck["content_ltks"] for ck in chunks], [ck["vector"] for ck in chunks], self.embd_mdl, 1 - self.vector_similarity_weight, self.vector_similarity_weight
+            )
+        return ranks
+
+    def bench(self, qrels):
+        """
+        Run every query `rounds` times at each concurrency level, through retrieval and citation insertion.
+        Returns the report (QPS, end-to-end and per stage latency, quality, peak RSS) and the ranking of the first pass.
+        """
+        if not self.offline:
+            # Need to wait for the ES and Infinity index to be ready
+            time.sleep(20)
+        queries = list(qrels.keys())
+        report = {"queries": len(queries), "rounds": self.rounds, "runs": []}
+        run = defaultdict(dict)
+        for concurrency in self.concurrency:
+            stages = StageTimer()
+            dealer = stages.instrument(search.Dealer(self.doc_store))
+            latencies = []
+
+            def one(query, dealer=dealer, latencies=latencies):
+                st = timer()
+                ranks = self._retrieve_and_cite(dealer, query)
+                latencies.append(timer() - st)
+                return query, ranks
+
+            jobs = queries * self.rounds
+            st = timer()
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                results = list(tqdm(pool.map(one, jobs), total=len(jobs), colour="green", desc=f"Concurrency {concurrency}"))
+            elapsed = timer() - st
+            if not run:
+                for query, ranks in results[: len(queries)]:
+                    for c in ranks["chunks"]:
+                        run[query][c["chunk_id"]] = c["similarity"]
+            report["runs"].append(
+                {
+                    "concurrency": concurrency,
+                    "queries": len(jobs),
+                    "seconds": round(elapsed, 3),
+                    "qps": round(len(jobs) / elapsed, 3) if elapsed else 0.0,
+                    "latency": latency_summary(latencies),
+                    "stages": stages.summary(len(jobs)),
+                }
+            )
+
+        for query in queries:
+            if query not in run:
+                print(f"deleted query: {query}")
+                del qrels[query]
+        report["quality"] = {k: float(v) for k, v in evaluate(Qrels(qrels), Run(run), QUALITY_METRICS).items()} if run else {}
+        report["peak_rss_mb"] = round(peak_rss_mb(), 1)
+        return report, run
+
+    def _evaluate(self, name, qrels, texts, dataset, file_path, index_seconds):
+        if not self.concurrency:
+            run = self._get_retrieval(qrels)
+            print(dataset, evaluate(Qrels(qrels), Run(run), QUALITY_METRICS))
+        else:
+            report, run = self.bench(qrels)
+            report["index"] = {
+                "chunks": len(texts),
+                "seconds": round(index_seconds, 3),
+                "chunks_per_second": round(len(texts) / index_seconds, 3) if index_seconds else 0.0,
+                "peak_rss_mb": self.index_rss_mb,
+            }
+            print(name, json.dumps(report, indent=2))
+            self.reports[name] = report
+        self.save_results(qrels, run, texts, dataset, file_path)
+
+    def _index(self, func, *args):
+        st = timer()
+        qrels, texts = func(*args)
+        self.index_rss_mb = round(peak_rss_mb(), 1)
+        return qrels, texts, timer() - st
+
     def embedding(self, docs):
         texts = [d["content_with_weight"] for d in docs]
         embeddings, _ = self.embd_mdl.encode(texts)
@@ -76,9 +362,9 @@ class Benchmark:
     def init_index(self, vector_size: int):
         if self.initialized_index:
             return
-        if settings.docStoreConn.indexExist(self.index_name, self.kb_id):
-            settings.docStoreConn.deleteIdx(self.index_name, self.kb_id)
-        settings.docStoreConn.createIdx(self.index_name, self.kb_id, vector_size)
+        if self.doc_store.indexExist(self.index_name, self.kb_id):
+            self.doc_store.deleteIdx(self.index_name, self.kb_id)
+        self.doc_store.createIdx(self.index_name, self.kb_id, vector_size)
         self.initialized_index = True
 
     def ms_marco_index(self, file_path, index_name):
@@ -99,7 +385,7 @@ class Benchmark:
                     break
                 query = data.iloc[i]["query"]
                 for rel, text in zip(data.iloc[i]["passages"]["is_selected"], data.iloc[i]["passages"]["passage_text"]):
-                    d = {"id": get_uuid(), "kb_id": self.kb.id, "docnm_kwd": "xxxxx", "doc_id": "ksksks"}
+                    d = {"id": get_uuid(), "kb_id": self.kb_id, "docnm_kwd": "xxxxx", "doc_id": "ksksks"}
                     tokenize(d, text, "english")
                     docs.append(d)
                     texts[d["id"]] = text
@@ -108,13 +394,13 @@ class Benchmark:
                     docs_count += len(docs)
                     docs, vector_size = self.embedding(docs)
                     self.init_index(vector_size)
-                    settings.docStoreConn.insert(docs, self.index_name, self.kb_id)
+                    self.doc_store.insert(docs, self.index_name, self.kb_id)
                     docs = []
 
         if docs:
             docs, vector_size = self.embedding(docs)
             self.init_index(vector_size)
-            settings.docStoreConn.insert(docs, self.index_name, self.kb_id)
+            self.doc_store.insert(docs, self.index_name, self.kb_id)
         return qrels, texts
 
     def trivia_qa_index(self, file_path, index_name):
@@ -134,7 +420,7 @@ class Benchmark:
                     break
                 query = data.iloc[i]["question"]
                 for rel, text in zip(data.iloc[i]["search_results"]["rank"], data.iloc[i]["search_results"]["search_context"]):
-                    d = {"id": get_uuid(), "kb_id": self.kb.id, "docnm_kwd": "xxxxx", "doc_id": "ksksks"}
+                    d = {"id": get_uuid(), "kb_id": self.kb_id, "docnm_kwd": "xxxxx", "doc_id": "ksksks"}
                     tokenize(d, text, "english")
                     docs.append(d)
                     texts[d["id"]] = text
@@ -143,12 +429,12 @@ class Benchmark:
                     docs_count += len(docs)
                     docs, vector_size = self.embedding(docs)
                     self.init_index(vector_size)
-                    settings.docStoreConn.insert(docs, self.index_name)
+                    self.doc_store.insert(docs, self.index_name, self.kb_id)
                     docs = []
 
         docs, vector_size = self.embedding(docs)
         self.init_index(vector_size)
-        settings.docStoreConn.insert(docs, self.index_name)
+        self.doc_store.insert(docs, self.index_name, self.kb_id)
         return qrels, texts
 
     def miracl_index(self, file_path, corpus_path, index_name):
@@ -183,7 +469,7 @@ class Benchmark:
                 query = topics_total[tmp_data.iloc[i]["qid"]]
                 text = corpus_total[tmp_data.iloc[i]["docid"]]
                 rel = tmp_data.iloc[i]["relevance"]
-                d = {"id": get_uuid(), "kb_id": self.kb.id, "docnm_kwd": "xxxxx", "doc_id": "ksksks"}
+                d = {"id": get_uuid(), "kb_id": self.kb_id, "docnm_kwd": "xxxxx", "doc_id": "ksksks"}
                 tokenize(d, text, "english")
                 docs.append(d)
                 texts[d["id"]] = text
@@ -192,12 +478,12 @@ class Benchmark:
                     docs_count += len(docs)
                     docs, vector_size = self.embedding(docs)
                     self.init_index(vector_size)
-                    settings.docStoreConn.insert(docs, self.index_name)
+                    self.doc_store.insert(docs, self.index_name, self.kb_id)
                     docs = []
 
         docs, vector_size = self.embedding(docs)
         self.init_index(vector_size)
-        settings.docStoreConn.insert(docs, self.index_name)
+        self.doc_store.insert(docs, self.index_name, self.kb_id)
         return qrels, texts
 
     def save_results(self, qrels, run, texts, dataset, file_path):
@@ -223,17 +509,13 @@ class Benchmark:
         if dataset == "ms_marco_v1.1":
             self.tenant_id = "benchmark_ms_marco_v11"
             self.index_name = search.index_name(self.tenant_id)
-            qrels, texts = self.ms_marco_index(file_path, "benchmark_ms_marco_v1.1")
-            run = self._get_retrieval(qrels)
-            print(dataset, evaluate(Qrels(qrels), Run(run), ["ndcg@10", "map@5", "mrr@10"]))
-            self.save_results(qrels, run, texts, dataset, file_path)
+            qrels, texts, index_seconds = self._index(self.ms_marco_index, file_path, "benchmark_ms_marco_v1.1")
+            self._evaluate(dataset, qrels, texts, dataset, file_path, index_seconds)
         if dataset == "trivia_qa":
             self.tenant_id = "benchmark_trivia_qa"
             self.index_name = search.index_name(self.tenant_id)
-            qrels, texts = self.trivia_qa_index(file_path, "benchmark_trivia_qa")
-            run = self._get_retrieval(qrels)
-            print(dataset, evaluate(Qrels(qrels), Run(run), ["ndcg@10", "map@5", "mrr@10"]))
-            self.save_results(qrels, run, texts, dataset, file_path)
+            qrels, texts, index_seconds = self._index(self.trivia_qa_index, file_path, "benchmark_trivia_qa")
+            self._evaluate(dataset, qrels, texts, dataset, file_path, index_seconds)
         if dataset == "miracl":
             for lang in ["ar", "bn", "de", "en", "es", "fa", "fi", "fr", "hi", "id", "ja", "ko", "ru", "sw", "te", "th", "yo", "zh"]:
                 if not os.path.isdir(os.path.join(file_path, "miracl-v1.0-" + lang)):
@@ -251,10 +533,10 @@ class Benchmark:
                 self.tenant_id = "benchmark_miracl_" + lang
                 self.index_name = search.index_name(self.tenant_id)
                 self.initialized_index = False
-                qrels, texts = self.miracl_index(os.path.join(file_path, "miracl-v1.0-" + lang), os.path.join(miracl_corpus, "miracl-corpus-v1.0-" + lang), "benchmark_miracl_" + lang)
-                run = self._get_retrieval(qrels)
-                print(dataset, evaluate(Qrels(qrels), Run(run), ["ndcg@10", "map@5", "mrr@10"]))
-                self.save_results(qrels, run, texts, dataset, file_path)
+                qrels, texts, index_seconds = self._index(
+                    self.miracl_index, os.path.join(file_path, "miracl-v1.0-" + lang), os.path.join(miracl_corpus, "miracl-corpus-v1.0-" + lang), "benchmark_miracl_" + lang
+                )
+                self._evaluate(f"{dataset}_{lang}", qrels, texts, dataset, file_path, index_seconds)
 
 
 if __name__ == "__main__":
@@ -269,11 +551,23 @@ if __name__ == "__main__":
     )
     parser.add_argument("dataset_path", metavar="dataset_path", help="dataset path")
     parser.add_argument("miracl_corpus_path", metavar="miracl_corpus_path", nargs="?", default="", help="miracl corpus path. Only needed when dataset is miracl")
+    parser.add_argument("--offline", action="store_true", help="index into an in-process doc store with a hashing embedding instead of the configured doc engine and the knowledgebase's model")
+    parser.add_argument("--embedding_dim", type=int, default=256, help="dimension of the offline hashing embedding")
+    parser.add_argument("--embedding_latency_ms", type=float, default=0.0, help="latency added to every offline embedding call")
+    parser.add_argument("--concurrency", default="", help="comma separated concurrency levels to measure latency and QPS at, e.g. 1,8,32")
+    parser.add_argument("--rounds", type=int, default=1, help="times every query is run at each concurrency level")
+    parser.add_argument("--output", default="", help="JSON report path, <dataset_path>/<dataset>.bench.json by default")
+    parser.add_argument("--baseline", default="", help="JSON report of an earlier run to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="relative change against the baseline reported as a regression")
 
     args = parser.parse_args()
     max_docs = args.max_docs
     kb_id = args.kb_id
-    ex = Benchmark(kb_id)
+    if not args.offline:
+        settings.init_settings()
+    ex = Benchmark(kb_id, offline=args.offline, embedding_dim=args.embedding_dim, embedding_latency=args.embedding_latency_ms / 1000)
+    ex.concurrency = [int(c) for c in args.concurrency.split(",") if c.strip()]
+    ex.rounds = args.rounds
 
     dataset = args.dataset
     dataset_path = args.dataset_path
@@ -281,10 +575,31 @@ if __name__ == "__main__":
     if dataset == "ms_marco_v1.1" or dataset == "trivia_qa":
         ex(dataset, dataset_path)
     elif dataset == "miracl":
-        if len(args) < 5:
+        if not args.miracl_corpus_path:
             print("Please input the correct parameters!")
             exit(1)
-        miracl_corpus_path = args[4]
         ex(dataset, dataset_path, miracl_corpus=args.miracl_corpus_path)
     else:
         print("Dataset: ", dataset, "not supported!")
+        sys.exit(1)
+
+    if ex.reports:
+        report = {
+            "revision": git_revision(),
+            "time": datetime.now().isoformat(timespec="seconds"),
+            "doc_engine": ex.doc_store.dbType(),
+            "embedding": ex.embd_mdl.llm_name,
+            "max_docs": max_docs,
+            "datasets": ex.reports,
+        }
+        output = args.output or os.path.join(dataset_path, dataset + ".bench.json")
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(output, "Saved!")
+        if args.baseline:
+            with open(args.baseline, encoding="utf-8") as f:
+                regressions = compare_reports(json.load(f), report, args.tolerance)
+            for r in regressions:
+                print("REGRESSION", r)
+            if regressions:
+                sys.exit(1)
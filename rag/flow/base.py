@@ -23,6 +23,7 @@ import trio
 
 from agent.component.base import ComponentBase, ComponentParamBase
 from api.utils.api_utils import timeout
+from rag.settings import PIPELINE_STREAM_BATCH_SIZE
 
 
 class ProcessParamBase(ComponentParamBase):
@@ -33,8 +34,17 @@ class ProcessParamBase(ComponentParamBase):
 
 
 class ProcessBase(ComponentBase):
+    # Components able to work on chunk batches set this and implement `_stream`,
+    # so that `Pipeline` can chain them through bounded channels.
+    stream_capable = False
+    # The callback writes the progress logs of the pipeline it is bound to.
+    _runtime_attrs = ("callback",)
+
     def __init__(self, pipeline, id, param: ProcessParamBase):
         super().__init__(pipeline, id, param)
+        self._init_runtime()
+
+    def _init_runtime(self):
         if hasattr(self._canvas, "callback"):
             self.callback = partial(self._canvas.callback, self.component_name)
         else:
@@ -58,6 +68,63 @@ class ProcessBase(ComponentBase):
         self.set_output("_elapsed_time", time.perf_counter() - self.output("_created_time"))
         return self.output()
 
+    async def invoke_stream(self, upstream: trio.MemoryReceiveChannel | None = None, downstream: trio.MemorySendChannel | None = None, **kwargs) -> dict[str, Any]:
+        """
+        Streaming counterpart of `invoke`.
+        Chunk batches are read from `upstream` (or cut from `kwargs` when this is the first
+        streaming component) and pushed to `downstream`. Only the last component of a chain
+        keeps the whole chunk list as its output.
+        On failure `downstream` is left open, for the pipeline to cancel the components after this one
+        rather than have them take the chunks sent so far for the whole document.
+        """
+        self.set_output("_created_time", time.perf_counter())
+        for k, v in kwargs.items():
+            self.set_output(k, v)
+        chunks = []
+        failed = False
+        try:
+            with trio.fail_after(self._param.timeout):
+                async for batch in self._stream(upstream, **kwargs):
+                    if downstream is None:
+                        chunks.extend(batch)
+                        continue
+                    try:
+                        await downstream.send(batch)
+                    except trio.BrokenResourceError:
+                        # Downstream component failed and stopped listening.
+                        break
+                self.callback(1, "Done")
+        except Exception as e:
+            if self.get_exception_default_value():
+                self.set_exception_default_value()
+            else:
+                self.set_output("_ERROR", str(e))
+                failed = True
+            logging.exception(e)
+            self.callback(-1, str(e))
+        finally:
+            if downstream is not None and not failed:
+                downstream.close()
+            if upstream is not None:
+                upstream.close()
+        self.set_output("chunks", chunks if downstream is None else None)
+        self.set_output("_elapsed_time", time.perf_counter() - self.output("_created_time"))
+        return self.output()
+
+    @staticmethod
+    async def _batches(upstream: trio.MemoryReceiveChannel | None, chunks: list[dict[str, Any]] | None = None):
+        if upstream is None:
+            chunks = chunks or []
+            for i in range(0, len(chunks), PIPELINE_STREAM_BATCH_SIZE):
+                yield chunks[i : i + PIPELINE_STREAM_BATCH_SIZE]
+            return
+        async for batch in upstream:
+            yield batch
+
+    async def _stream(self, upstream: trio.MemoryReceiveChannel | None, **kwargs):
+        raise NotImplementedError()
+        yield
+
     @timeout(int(os.environ.get("COMPONENT_EXEC_TIMEOUT", 10 * 60)))
     async def _invoke(self, **kwargs):
         raise NotImplementedError()
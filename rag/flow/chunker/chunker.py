@@ -70,6 +70,7 @@ class ChunkerParam(ProcessParamBase):
 
 class Chunker(ProcessBase):
     component_name = "Chunker"
+    stream_capable = True
 
     def _general(self, from_upstream: ChunkerFromUpstream):
         self.callback(random.randint(1, 5) / 100.0, "Start to chunk via `General`.")
@@ -142,8 +143,8 @@ class Chunker(ProcessBase):
     def _one(self, from_upstream: ChunkerFromUpstream):
         pass
 
-    async def _invoke(self, **kwargs):
-        function_map = {
+    def _function_map(self):
+        return {
             "general": self._general,
             "q&a": self._q_and_a,
             "resume": self._resume,
@@ -156,13 +157,7 @@ class Chunker(ProcessBase):
             "one": self._one,
         }
 
-        try:
-            from_upstream = ChunkerFromUpstream.model_validate(kwargs)
-        except Exception as e:
-            self.set_output("_ERROR", f"Input error: {str(e)}")
-            return
-
-        chunks = function_map[self._param.method](from_upstream)
+    async def _enrich(self, chunks):
         llm_setting = self._param.llm_setting
 
         async def auto_keywords():
@@ -187,11 +182,11 @@ class Chunker(ProcessBase):
             chat_mdl = LLMBundle(self._canvas._tenant_id, LLMType.CHAT, llm_name=llm_setting["llm_name"], lang=llm_setting["lang"])
 
             async def doc_question_proposal(chat_mdl, d, topn):
-                cached = get_llm_cache(chat_mdl.llm_name, ck["text"], "question", {"topn": topn})
+                cached = get_llm_cache(chat_mdl.llm_name, d["text"], "question", {"topn": topn})
                 if not cached:
                     async with chat_limiter:
-                        cached = await trio.to_thread.run_sync(lambda: question_proposal(chat_mdl, ck["text"], topn))
-                    set_llm_cache(chat_mdl.llm_name, ck["text"], cached, "question", {"topn": topn})
+                        cached = await trio.to_thread.run_sync(lambda: question_proposal(chat_mdl, d["text"], topn))
+                    set_llm_cache(chat_mdl.llm_name, d["text"], cached, "question", {"topn": topn})
                 if cached:
                     d["questions"] = cached.split("\n")
 
@@ -209,4 +204,24 @@ class Chunker(ProcessBase):
             for ck in chunks:
                 ck["page_rank"] = self._param.page_rank
 
+    async def _invoke(self, **kwargs):
+        try:
+            from_upstream = ChunkerFromUpstream.model_validate(kwargs)
+        except Exception as e:
+            self.set_output("_ERROR", f"Input error: {str(e)}")
+            return
+
+        chunks = self._function_map()[self._param.method](from_upstream)
+        await self._enrich(chunks)
         self.set_output("chunks", chunks)
+
+    async def _stream(self, upstream, **kwargs):
+        try:
+            from_upstream = ChunkerFromUpstream.model_validate(kwargs)
+        except Exception as e:
+            raise ValueError(f"Input error: {str(e)}")
+
+        chunks = self._function_map()[self._param.method](from_upstream)
+        async for batch in self._batches(None, chunks):
+            await self._enrich(batch)
+            yield batch
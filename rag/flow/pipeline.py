@@ -18,19 +18,26 @@ import json
 import logging
 import random
 import time
+from functools import partial
 
 import trio
 
 from agent.canvas import Graph
 from api.db.services.document_service import DocumentService
+from rag.settings import PIPELINE_STREAMING, PIPELINE_STREAM_BUFFER
 from rag.utils.redis_conn import REDIS_CONN
 
+# Outputs carrying the document content itself. Past the first stage of a stream chain, chunks come through
+# the channel and a stage only gets the rest: the metadata of the stage before it.
+STREAM_PAYLOAD_KEYS = ("output_format", "json", "markdown", "text", "html", "chunks")
+
 
 class Pipeline(Graph):
-    def __init__(self, dsl: str, tenant_id=None, doc_id=None, task_id=None, flow_id=None):
+    def __init__(self, dsl: str, tenant_id=None, doc_id=None, task_id=None, flow_id=None, streaming=None):
         super().__init__(dsl, tenant_id, task_id)
         self._doc_id = doc_id
         self._flow_id = flow_id
+        self._streaming = PIPELINE_STREAMING if streaming is None else streaming
         self._kb_id = None
         if doc_id:
             self._kb_id = DocumentService.get_knowledgebase_id(doc_id)
@@ -70,6 +77,47 @@ class Pipeline(Graph):
         except Exception as e:
             logging.exception(e)
 
+    def _stream_chain(self, cpn_id) -> list[str]:
+        """
+        The longest linear run of stream-capable components starting from `cpn_id`.
+        """
+        chain = [cpn_id]
+        while True:
+            downstream = self.get_component_obj(chain[-1]).get_downstream()
+            if len(downstream) != 1 or downstream[0] in chain:
+                break
+            nxt = self.get_component_obj(downstream[0])
+            if not getattr(nxt, "stream_capable", False) or len(nxt.get_upstream()) > 1:
+                break
+            chain.append(downstream[0])
+        return chain
+
+    async def _run_stream(self, chain: list[str], inputs: dict):
+        scopes = [trio.CancelScope() for _ in chain]
+
+        async def run_stage(i, upstream, downstream, stage_inputs):
+            cpn_obj = self.get_component_obj(chain[i])
+            with scopes[i]:
+                await cpn_obj.invoke_stream(upstream, downstream, **stage_inputs)
+            if scopes[i].cancelled_caught or not cpn_obj.error():
+                return
+            # The stages after a failed one would otherwise finish on the chunks it sent so far.
+            for j in range(i + 1, len(chain)):
+                if not scopes[j].cancel_called:
+                    self.get_component_obj(chain[j]).set_output("_ERROR", f"Canceled since upstream {cpn_obj.component_name} failed.")
+                    self.get_component_obj(chain[j]).set_output("chunks", None)
+                    scopes[j].cancel()
+
+        async with trio.open_nursery() as nursery:
+            upstream = None
+            for i in range(len(chain)):
+                downstream, receiver = None, None
+                if i < len(chain) - 1:
+                    downstream, receiver = trio.open_memory_channel(PIPELINE_STREAM_BUFFER)
+                nursery.start_soon(partial(run_stage, i, upstream, downstream, inputs))
+                upstream = receiver
+                inputs = {k: v for k, v in inputs.items() if k not in STREAM_PAYLOAD_KEYS}
+
     async def run(self, **kwargs):
         st = time.perf_counter()
         if not self.path:
@@ -95,6 +143,20 @@ class Pipeline(Graph):
             last_cpn = self.get_component_obj(self.path[idx - 1])
             cpn_obj = self.get_component_obj(self.path[idx])
 
+            if self._streaming and getattr(cpn_obj, "stream_capable", False):
+                chain = self._stream_chain(self.path[idx])
+                if len(chain) > 1:
+                    await self._run_stream(chain, last_cpn.output())
+                    for cpn_id in chain:
+                        cpn_obj = self.get_component_obj(cpn_id)
+                        if cpn_obj.error():
+                            self.error = "[ERROR]" + cpn_obj.error()
+                            self.callback(cpn_obj.component_name, -1, self.error)
+                            break
+                        idx += 1
+                        self.path.extend(cpn_obj.get_downstream())
+                    continue
+
             async def invoke():
                 nonlocal last_cpn, cpn_obj
                 await cpn_obj.invoke(**last_cpn.output())
@@ -0,0 +1,83 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import json
+
+import trio
+
+from rag.flow.chunker.chunker import Chunker
+from rag.flow.pipeline import Pipeline
+
+ROWS = [f"<tr><td>item {i}</td><td>price {i}</td></tr>" for i in range(40)]
+
+# What the Parser outputs for a spreadsheet, html being its default output format.
+PARSED = {
+    "name": "prices.csv",
+    "blob": b"item,price\n",
+    "output_format": "html",
+    "html": [f"<table>{row}</table>" for row in ROWS],
+}
+
+
+def _pipeline():
+    dsl = {
+        "components": {
+            "Parser:0": {"obj": {"component_name": "Parser", "params": {}}, "downstream": ["Chunker:0"], "upstream": []},
+            "Chunker:0": {
+                "obj": {"component_name": "Chunker", "params": {"method": "general", "chunk_token_size": 8}},
+                "downstream": ["Tokenizer:0"],
+                "upstream": ["Parser:0"],
+            },
+            "Tokenizer:0": {"obj": {"component_name": "Tokenizer", "params": {"search_method": ["full_text"]}}, "downstream": [], "upstream": ["Chunker:0"]},
+        },
+        "path": [],
+        "history": [],
+        "retrieval": [],
+        "globals": {},
+    }
+    return Pipeline(json.dumps(dsl), tenant_id="test_tenant")
+
+
+def test_stream_html_through_chunker_and_tokenizer(monkeypatch):
+    monkeypatch.setattr("rag.flow.base.PIPELINE_STREAM_BATCH_SIZE", 4)
+    pipeline = _pipeline()
+    trio.run(pipeline._run_stream, ["Chunker:0", "Tokenizer:0"], dict(PARSED))
+
+    chunker, tokenizer = pipeline.get_component_obj("Chunker:0"), pipeline.get_component_obj("Tokenizer:0")
+    assert not chunker.error()
+    assert not tokenizer.error()
+    chunks = tokenizer.output("chunks")
+    assert len(chunks) > 4
+    assert all(ck.get("content_ltks") for ck in chunks)
+
+
+def test_upstream_failure_cancels_downstream(monkeypatch):
+    monkeypatch.setattr("rag.flow.base.PIPELINE_STREAM_BATCH_SIZE", 4)
+    enrich, calls = Chunker._enrich, []
+
+    async def failing_enrich(self, chunks):
+        calls.append(len(chunks))
+        if len(calls) == 3:
+            raise RuntimeError("enrichment failed")
+        await enrich(self, chunks)
+
+    monkeypatch.setattr(Chunker, "_enrich", failing_enrich)
+    pipeline = _pipeline()
+    trio.run(pipeline._run_stream, ["Chunker:0", "Tokenizer:0"], dict(PARSED))
+
+    chunker, tokenizer = pipeline.get_component_obj("Chunker:0"), pipeline.get_component_obj("Tokenizer:0")
+    assert "enrichment failed" in chunker.error()
+    assert "Chunker" in tokenizer.error()
+    assert not tokenizer.output("chunks")
@@ -14,7 +14,7 @@
 #  limitations under the License.
 from typing import Any, Literal
 
-from pydantic import BaseModel, ConfigDict, Field, model_validator
+from pydantic import BaseModel, ConfigDict, Field, ValidationInfo, model_validator
 
 
 class TokenizerFromUpstream(BaseModel):
@@ -36,8 +36,9 @@ class TokenizerFromUpstream(BaseModel):
     model_config = ConfigDict(populate_by_name=True, extra="forbid")
 
     @model_validator(mode="after")
-    def _check_payloads(self) -> "TokenizerFromUpstream":
-        if self.chunks:
+    def _check_payloads(self, info: ValidationInfo) -> "TokenizerFromUpstream":
+        # Streamed chunks come through a channel, not in the payload.
+        if self.chunks or (info.context or {}).get("streamed"):
             return self
 
         if self.output_format in {"markdown", "text"}:
@@ -48,26 +48,33 @@ class TokenizerParam(ProcessParamBase):
 
 class Tokenizer(ProcessBase):
     component_name = "Tokenizer"
+    stream_capable = True
 
-    async def _embedding(self, name, chunks):
-        parts = sum(["full_text" in self._param.search_method, "embedding" in self._param.search_method])
-        token_count = 0
+    def _get_embedding_model(self):
         if self._canvas._kb_id:
             e, kb = KnowledgebaseService.get_by_id(self._canvas._kb_id)
             embedding_id = kb.embd_id
         else:
             e, ten = TenantService.get_by_id(self._canvas._tenant_id)
             embedding_id = ten.embd_id
-        embedding_model = LLMBundle(self._canvas._tenant_id, LLMType.EMBEDDING, llm_name=embedding_id)
+        return LLMBundle(self._canvas._tenant_id, LLMType.EMBEDDING, llm_name=embedding_id)
+
+    async def _embedding(self, name, chunks, embedding_model=None, name_vts=None, progress=True):
+        parts = sum(["full_text" in self._param.search_method, "embedding" in self._param.search_method])
+        token_count = 0
+        if embedding_model is None:
+            embedding_model = self._get_embedding_model()
         texts = []
         for c in chunks:
             if c.get("questions"):
                 texts.append("\n".join(c["questions"]))
             else:
                 texts.append(re.sub(r"</?(table|td|caption|tr|th)( [^<>]{0,12})?>", " ", c["text"]))
-        vts, c = embedding_model.encode([name])
-        token_count += c
-        tts = np.concatenate([vts[0] for _ in range(len(texts))], axis=0)
+        if name_vts is None:
+            vts, c = embedding_model.encode([name])
+            token_count += c
+            name_vts = vts[0]
+        tts = np.concatenate([name_vts for _ in range(len(texts))], axis=0)
 
         @timeout(60)
         def batch_encode(txts):
@@ -83,7 +90,7 @@ class Tokenizer(ProcessBase):
             else:
                 cnts_ = np.concatenate((cnts_, vts), axis=0)
             token_count += c
-            if i % 33 == 32:
+            if progress and i % 33 == 32:
                 self.callback(i * 1.0 / len(texts) / parts / EMBEDDING_BATCH_SIZE + 0.5 * (parts - 1))
 
         cnts = cnts_
@@ -96,6 +103,33 @@ class Tokenizer(ProcessBase):
             ck["q_%d_vec" % len(v)] = v
         return chunks, token_count
 
+    def _tokenize(self, chunks, parts=None):
+        for i, ck in enumerate(chunks):
+            if ck.get("questions"):
+                ck["question_tks"] = rag_tokenizer.tokenize("\n".join(ck["questions"]))
+            if ck.get("keywords"):
+                ck["important_tks"] = rag_tokenizer.tokenize("\n".join(ck["keywords"]))
+            ck["content_ltks"] = rag_tokenizer.tokenize(ck["text"])
+            ck["content_sm_ltks"] = rag_tokenizer.fine_grained_tokenize(ck["content_ltks"])
+            if parts and i % 100 == 99:
+                self.callback(i * 1.0 / len(chunks) / parts)
+
+    @staticmethod
+    def _upstream_chunks(from_upstream: TokenizerFromUpstream):
+        if from_upstream.chunks:
+            return from_upstream.chunks
+        if from_upstream.output_format in ["markdown", "text", "html"]:
+            if from_upstream.output_format == "markdown":
+                payload = from_upstream.markdown_result
+            elif from_upstream.output_format == "text":
+                payload = from_upstream.text_result
+            else:  # == "html"
+                payload = from_upstream.html_result
+            if not payload:
+                return None
+            return [{"text": payload}]
+        return from_upstream.json_result
+
     async def _invoke(self, **kwargs):
         try:
             from_upstream = TokenizerFromUpstream.model_validate(kwargs)
@@ -103,44 +137,14 @@ class Tokenizer(ProcessBase):
             self.set_output("_ERROR", f"Input error: {str(e)}")
             return
 
+        chunks = self._upstream_chunks(from_upstream)
+        if chunks is None:
+            return ""
+
         parts = sum(["full_text" in self._param.search_method, "embedding" in self._param.search_method])
         if "full_text" in self._param.search_method:
             self.callback(random.randint(1, 5) / 100.0, "Start to tokenize.")
-            if from_upstream.chunks:
-                chunks = from_upstream.chunks
-                for i, ck in enumerate(chunks):
-                    if ck.get("questions"):
-                        ck["question_tks"] = rag_tokenizer.tokenize("\n".join(ck["questions"]))
-                    if ck.get("keywords"):
-                        ck["important_tks"] = rag_tokenizer.tokenize("\n".join(ck["keywords"]))
-                    ck["content_ltks"] = rag_tokenizer.tokenize(ck["text"])
-                    ck["content_sm_ltks"] = rag_tokenizer.fine_grained_tokenize(ck["content_ltks"])
-                    if i % 100 == 99:
-                        self.callback(i * 1.0 / len(chunks) / parts)
-            elif from_upstream.output_format in ["markdown", "text", "html"]:
-                if from_upstream.output_format == "markdown":
-                    payload = from_upstream.markdown_result
-                elif from_upstream.output_format == "text":
-                    payload = from_upstream.text_result
-                else:  # == "html"
-                    payload = from_upstream.html_result
-
-                if not payload:
-                    return ""
-
-                ck = {"text": payload}
-                if "full_text" in self._param.search_method:
-                    ck["content_ltks"] = rag_tokenizer.tokenize(kwargs.get(kwargs["output_format"], ""))
-                    ck["content_sm_ltks"] = rag_tokenizer.fine_grained_tokenize(ck["content_ltks"])
-                chunks = [ck]
-            else:
-                chunks = from_upstream.json_result
-                for i, ck in enumerate(chunks):
-                    ck["content_ltks"] = rag_tokenizer.tokenize(ck["text"])
-                    ck["content_sm_ltks"] = rag_tokenizer.fine_grained_tokenize(ck["content_ltks"])
-                    if i % 100 == 99:
-                        self.callback(i * 1.0 / len(chunks) / parts)
-
+            self._tokenize(chunks, parts)
             self.callback(1.0 / parts, "Finish tokenizing.")
 
         if "embedding" in self._param.search_method:
@@ -155,3 +159,37 @@ class Tokenizer(ProcessBase):
             self.callback(1.0, "Finish embedding.")
 
         self.set_output("chunks", chunks)
+
+    async def _stream(self, upstream, **kwargs):
+        try:
+            from_upstream = TokenizerFromUpstream.model_validate(kwargs, context={"streamed": upstream is not None})
+        except Exception as e:
+            raise ValueError(f"Input error: {str(e)}")
+
+        chunks = None
+        if upstream is None:
+            chunks = self._upstream_chunks(from_upstream)
+            if chunks is None:
+                return
+
+        embedding_model, name_vts, token_count = None, None, 0
+        if "embedding" in self._param.search_method:
+            if from_upstream.name.strip() == "":
+                logging.warning("Tokenizer: empty name provided from upstream, embedding may be not accurate.")
+            embedding_model = self._get_embedding_model()
+            vts, c = await trio.to_thread.run_sync(lambda: embedding_model.encode([from_upstream.name]))
+            name_vts = vts[0]
+            token_count += c
+
+        self.callback(random.randint(1, 5) / 100.0, "Start to tokenize in streaming mode.")
+        done = 0
+        async for batch in self._batches(upstream, chunks):
+            if "full_text" in self._param.search_method:
+                self._tokenize(batch)
+            if embedding_model:
+                batch, c = await self._embedding(from_upstream.name, batch, embedding_model, name_vts, progress=False)
+                token_count += c
+                self.set_output("embedding_token_consumption", token_count)
+            done += len(batch)
+            self.callback(message=f"{done} chunks tokenized.")
+            yield batch
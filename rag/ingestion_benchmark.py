@@ -0,0 +1,435 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+"""
+Offline ingestion benchmark: runs the task executor's `do_handle_task` over a directory of sample files with a
+hashing embedding, an in-memory doc store and in-memory object storage, so parse -> chunk -> tokenize -> embed -> index
+can be measured on any machine without MySQL, Redis, MinIO, a doc engine or a model service.
+
+    python rag/ingestion_benchmark.py <corpus_dir> [--parser_id naive] [--warmup] [--profile] [--flame]
+"""
+
+import argparse
+import cProfile
+import json
+import logging
+import os
+import pstats
+import sys
+import threading
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+from timeit import default_timer as timer
+
+import trio
+
+from api import settings
+from api.utils import get_uuid
+from api.utils.api_utils import get_parser_config
+from deepdoc.parser import PdfParser
+from rag.benchmark import HashEmbedding, StageTimer, git_revision, peak_rss_mb
+from rag.nlp import search
+from rag.svr import task_executor
+from rag.utils.memory_conn import MemoryConnection
+from rag.utils.storage_stream import StreamingStorage
+
+SAMPLE_EXTENSIONS = [".pdf", ".docx", ".xlsx", ".xls", ".csv", ".html", ".htm", ".md", ".markdown", ".txt"]
+# Functions of the parser modules timed as "tokenize", the rest of a parser's `chunk` counts as "parse".
+TOKENIZE_FUNCS = ["tokenize_chunks", "tokenize_chunks_with_images", "tokenize_table"]
+BENCHMARK_BUCKET = "ingestion_benchmark"
+
+
+class MemoryStorage(StreamingStorage):
+    """
+    Object storage kept in a dict, standing in for MinIO and the other connectors.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._objects: dict[tuple[str, str], bytes] = {}
+
+    def health(self):
+        return True
+
+    def put(self, bucket, fnm, binary):
+        with self._lock:
+            self._objects[(bucket, fnm)] = binary
+
+    def get(self, bucket, fnm):
+        with self._lock:
+            return self._objects.get((bucket, fnm))
+
+    def rm(self, bucket, fnm):
+        with self._lock:
+            self._objects.pop((bucket, fnm), None)
+
+    delete = rm
+
+    def obj_exist(self, bucket, fnm):
+        with self._lock:
+            return (bucket, fnm) in self._objects
+
+
+class TaskRecorder:
+    """
+    Stands in for the task, document and file services the executor reports to, keeping what it reports in memory.
+    """
+
+    def __init__(self):
+        self.progress = defaultdict(list)
+        self.chunk_ids = {}
+
+    def update_progress(self, id, info):
+        self.progress[id].append(info)
+
+    def update_chunk_ids(self, id, chunk_ids):
+        self.chunk_ids[id] = chunk_ids.split()
+
+    def increment_chunk_num(self, *args, **kwargs):
+        pass
+
+    @staticmethod
+    def get_storage_address(doc_id=None, file_id=None):
+        return BENCHMARK_BUCKET, doc_id
+
+    def errors(self, task_id) -> list[str]:
+        return [p.get("progress_msg", "") for p in self.progress[task_id] if p.get("progress", 0) < 0]
+
+
+class StackSampler:
+    """
+    Samples the stacks of the threads running a parser every `interval` seconds, and writes them per parser in the
+    collapsed format flame graph tools (flamegraph.pl, speedscope, inferno) read, like `py-spy record -f raw`.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.stacks = defaultdict(Counter)
+        self._threads = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    @contextmanager
+    def track(self, name: str):
+        ident = threading.get_ident()
+        self._threads[ident] = name
+        try:
+            yield
+        finally:
+            self._threads.pop(ident, None)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            for ident, name in list(self._threads.items()):
+                frame = frames.get(ident)
+                stack = []
+                while frame is not None:
+                    stack.append(f"{frame.f_code.co_name} ({os.path.basename(frame.f_code.co_filename)})")
+                    frame = frame.f_back
+                if stack:
+                    self.stacks[name][";".join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="stack_sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def dump(self, out_dir: str) -> list[str]:
+        paths = []
+        for name, stacks in self.stacks.items():
+            path = os.path.join(out_dir, f"{name}.folded")
+            with open(path, "w", encoding="utf-8") as f:
+                f.writelines(f"{stack} {n}\n" for stack, n in stacks.most_common())
+            paths.append(path)
+        return paths
+
+
+class IngestionBenchmark:
+    def __init__(self, parser_id="", embedding_dim=256, embedding_latency=0.0, profile=False, flame=False):
+        self.parser_id = parser_id
+        self.embd_mdl = HashEmbedding(embedding_dim, embedding_latency)
+        self.doc_store = MemoryConnection()
+        self.storage = MemoryStorage()
+        self.recorder = TaskRecorder()
+        self.stages = StageTimer()
+        self.tenant_id = "benchmark_ingestion"
+        self.kb_id = get_uuid()
+        self.profiles = {} if profile else None
+        self.sampler = StackSampler() if flame else None
+
+    def _parser_id(self, fnm: str) -> str:
+        if self.parser_id:
+            return self.parser_id
+        return "table" if os.path.splitext(fnm)[1].lower() == ".csv" else "naive"
+
+    def _chunk(self, module, *args, **kwargs):
+        parser = module.__name__.rsplit(".", 1)[-1]
+        chunk = self.stages.wrap("parse", module.chunk)
+        if self.sampler:
+            with self.sampler.track(parser):
+                return self._run_chunk(parser, chunk, *args, **kwargs)
+        return self._run_chunk(parser, chunk, *args, **kwargs)
+
+    def _run_chunk(self, parser, chunk, *args, **kwargs):
+        if self.profiles is None:
+            return chunk(*args, **kwargs)
+        return self.profiles.setdefault(parser, cProfile.Profile()).runcall(chunk, *args, **kwargs)
+
+    @contextmanager
+    def offline_executor(self):
+        """
+        Point the task executor at the in-memory services and wrap its stages with timers for the duration.
+        """
+        te = task_executor
+        factory = dict(te.FACTORY)
+        patches = [
+            (te, "LLMBundle", lambda *args, **kwargs: self.embd_mdl),
+            (te, "TaskService", self.recorder),
+            (te, "DocumentService", self.recorder),
+            (te, "File2DocumentService", self.recorder),
+            (te, "has_canceled", lambda task_id: False),
+            (te, "close_connection", lambda: None),
+            (te, "STORAGE_IMPL", self.storage),
+            (te, "FILE_CACHE", None),
+            (te, "embedding", self.stages.wrap_async("embed", te.embedding)),
+            (te, "upload_chunk_images", self.stages.wrap_async("images", te.upload_chunk_images)),
+            (settings, "docStoreConn", self.doc_store),
+            (settings, "retrievaler", search.Dealer(self.doc_store)),
+            (settings, "DOC_ENGINE", self.doc_store.dbType()),
+            (self.doc_store, "insert", self.stages.wrap("index", self.doc_store.insert)),
+        ]
+        for module in set(factory.values()):
+            for name in TOKENIZE_FUNCS:
+                if hasattr(module, name):
+                    patches.append((module, name, self.stages.wrap("tokenize", getattr(module, name))))
+
+        def timed_parser(module):
+            return type(module.__name__, (), {"chunk": staticmethod(lambda *args, **kwargs: self._chunk(module, *args, **kwargs))})
+
+        saved = [(obj, name, getattr(obj, name)) for obj, name, _ in patches]
+        for obj, name, value in patches:
+            setattr(obj, name, value)
+        te.FACTORY.update({k: timed_parser(m) for k, m in factory.items()})
+        if self.sampler:
+            self.sampler.start()
+        try:
+            yield
+        finally:
+            if self.sampler:
+                self.sampler.stop()
+            te.FACTORY.clear()
+            te.FACTORY.update(factory)
+            for obj, name, value in reversed(saved):
+                setattr(obj, name, value)
+
+    def _task(self, fnm: str, binary: bytes) -> dict:
+        doc_id = get_uuid()
+        self.storage.put(BENCHMARK_BUCKET, doc_id, binary)
+        parser_id = self._parser_id(fnm)
+        return {
+            "id": get_uuid(),
+            "doc_id": doc_id,
+            "name": os.path.basename(fnm),
+            "location": os.path.basename(fnm),
+            "size": len(binary),
+            "from_page": 0,
+            "to_page": 100000000,
+            "tenant_id": self.tenant_id,
+            "kb_id": self.kb_id,
+            "embd_id": self.embd_mdl.llm_name,
+            "llm_id": "",
+            "language": "English",
+            "parser_id": parser_id,
+            "parser_config": get_parser_config(parser_id, None) or {},
+            "kb_parser_config": {},
+            "pagerank": 0,
+            "task_type": "",
+        }
+
+    async def run_file(self, fnm: str) -> dict:
+        binary = await trio.Path(fnm).read_bytes()
+        task = self._task(fnm, binary)
+        ext = os.path.splitext(fnm)[1].lower()
+        res = {"file": os.path.basename(fnm), "format": ext.lstrip("."), "parser": task["parser_id"], "bytes": len(binary), "pages": None}
+        if ext == ".pdf":
+            res["pages"] = PdfParser.total_page_number(fnm, binary)
+
+        self.stages.take()
+        st = timer()
+        try:
+            await task_executor.do_handle_task(task)
+        except Exception as e:
+            logging.exception(f"IngestionBenchmark {fnm} failed")
+            res["error"] = str(e)
+        res["seconds"] = round(timer() - st, 3)
+        res["stages"] = {stage: round(seconds, 3) for stage, seconds in self.stages.take().items()}
+        res["chunks"] = len(self.recorder.chunk_ids.get(task["id"], []))
+        errors = self.recorder.errors(task["id"])
+        if errors and "error" not in res:
+            res["error"] = errors[-1]
+        res["peak_rss_mb"] = round(peak_rss_mb(), 1)
+        return res
+
+    async def run(self, files: list[str], warmup=False) -> list[dict]:
+        if warmup:
+            # Model loading (OCR, layout, tokenizer dictionaries) happens on the first file of a format, not per file.
+            firsts = {}
+            for fnm in files:
+                firsts.setdefault(os.path.splitext(fnm)[1].lower(), fnm)
+            for fnm in firsts.values():
+                await self.run_file(fnm)
+            self.stages.take()
+            if self.profiles:
+                self.profiles.clear()
+            if self.sampler:
+                self.sampler.stacks.clear()
+        results = []
+        for fnm in files:
+            res = await self.run_file(fnm)
+            logging.info(f"IngestionBenchmark {json.dumps(res)}")
+            results.append(res)
+        return results
+
+    def dump_profiles(self, out_dir: str) -> list[str]:
+        paths = []
+        for parser, prof in (self.profiles or {}).items():
+            path = os.path.join(out_dir, f"{parser}.prof")
+            prof.dump_stats(path)
+            paths.append(path)
+            print(f"== {parser} ==")
+            pstats.Stats(prof).sort_stats("cumulative").print_stats(20)
+        if self.sampler:
+            paths.extend(self.sampler.dump(out_dir))
+        return paths
+
+
+def summarize(results: list[dict]) -> dict:
+    """
+    Totals and throughput of the files by format, and of all of them.
+    """
+
+    def total(rows):
+        seconds = sum(r["seconds"] for r in rows)
+        pages = sum(r["pages"] or 0 for r in rows)
+        chunks = sum(r["chunks"] for r in rows)
+        stages = Counter()
+        for r in rows:
+            stages.update(r["stages"])
+        return {
+            "files": len(rows),
+            "failed": sum(1 for r in rows if r.get("error")),
+            "bytes": sum(r["bytes"] for r in rows),
+            "pages": pages,
+            "chunks": chunks,
+            "seconds": round(seconds, 3),
+            "pages_per_second": round(pages / seconds, 3) if seconds and pages else None,
+            "chunks_per_second": round(chunks / seconds, 3) if seconds else 0.0,
+            "mb_per_second": round(sum(r["bytes"] for r in rows) / 1024**2 / seconds, 3) if seconds else 0.0,
+            "stages": {stage: round(s, 3) for stage, s in stages.items()},
+        }
+
+    formats = defaultdict(list)
+    for r in results:
+        formats[r["format"]].append(r)
+    return {"formats": {fmt: total(rows) for fmt, rows in sorted(formats.items())}, "total": total(results)}
+
+
+def compare_reports(baseline: dict, current: dict, tolerance: float = 0.1) -> list[str]:
+    """
+    Formats whose throughput dropped, or whose time in a stage grew, by more than `tolerance` (a ratio).
+    """
+    regressions = []
+    for fmt, cur in current.get("formats", {}).items():
+        base = baseline.get("formats", {}).get(fmt)
+        if not base:
+            continue
+        for metric in ["pages_per_second", "chunks_per_second", "mb_per_second"]:
+            if base.get(metric) and cur.get(metric) is not None and cur[metric] < base[metric] * (1 - tolerance):
+                regressions.append(f"{fmt} {metric}: {base[metric]} -> {cur[metric]}")
+        for stage, seconds in cur.get("stages", {}).items():
+            old = base.get("stages", {}).get(stage)
+            # Compare per file, the corpus may have changed size.
+            if old and base["files"] and cur["files"] and seconds / cur["files"] > old / base["files"] * (1 + tolerance):
+                regressions.append(f"{fmt} {stage} per file: {old / base['files']:.3f}s -> {seconds / cur['files']:.3f}s")
+    return regressions
+
+
+def corpus_files(corpus: str) -> list[str]:
+    files = []
+    for dirpath, _, filenames in os.walk(corpus):
+        for fnm in sorted(filenames):
+            if os.path.splitext(fnm)[1].lower() in SAMPLE_EXTENSIONS:
+                files.append(os.path.join(dirpath, fnm))
+    return sorted(files)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="RAGFlow ingestion benchmark")
+    parser.add_argument("corpus", help="directory of sample files (" + ", ".join(SAMPLE_EXTENSIONS) + ")")
+    parser.add_argument("--parser_id", default="", help="chunk method of every file, naive (table for CSV) by default")
+    parser.add_argument("--embedding_dim", type=int, default=256, help="dimension of the hashing embedding")
+    parser.add_argument("--embedding_latency_ms", type=float, default=0.0, help="latency added to every embedding call")
+    parser.add_argument("--warmup", action="store_true", help="ingest the first file of every format once before measuring")
+    parser.add_argument("--profile", action="store_true", help="write a cProfile dump of every parser")
+    parser.add_argument("--flame", action="store_true", help="write sampled stacks of every parser in collapsed flame graph format")
+    parser.add_argument("--output", default="", help="directory of the report and profiles, the corpus directory by default")
+    parser.add_argument("--baseline", default="", help="JSON report of an earlier run to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="relative change against the baseline reported as a regression")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+    files = corpus_files(args.corpus)
+    if not files:
+        print(f"No sample files found in {args.corpus}")
+        sys.exit(1)
+    out_dir = args.output or args.corpus
+    os.makedirs(out_dir, exist_ok=True)
+
+    bench = IngestionBenchmark(args.parser_id, args.embedding_dim, args.embedding_latency_ms / 1000, args.profile, args.flame)
+    with bench.offline_executor():
+        results = trio.run(bench.run, files, args.warmup)
+
+    report = {
+        "revision": git_revision(),
+        "time": datetime.now().isoformat(timespec="seconds"),
+        "embedding": bench.embd_mdl.llm_name,
+        "files": results,
+        **summarize(results),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "doc_store": bench.doc_store.health(),
+        "images": dict(task_executor.IMAGE_STATS),
+    }
+    print(json.dumps({k: report[k] for k in ["formats", "total", "peak_rss_mb"]}, indent=2))
+    output = os.path.join(out_dir, "ingestion.bench.json")
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(output, "Saved!")
+    for path in bench.dump_profiles(out_dir):
+        print(path, "Saved!")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare_reports(json.load(f), report, args.tolerance)
+        for r in regressions:
+            print("REGRESSION", r)
+        if regressions:
+            sys.exit(1)
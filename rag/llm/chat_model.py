@@ -65,6 +65,12 @@ LENGTH_NOTIFICATION_CN = "······\n由于大模型的上下文窗口大小
 LENGTH_NOTIFICATION_EN = "...\nThe answer is truncated by your chosen LLM due to its limitation on context length."
 
 
+def _log_history(tag: str, history: list):
+    # Serializing the whole conversation on every call is not free, only pay for it when debugging.
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        logging.debug(tag + json.dumps(history, ensure_ascii=False, indent=2))
+
+
 class ToolCallSession(Protocol):
     def tool_call(self, name: str, arguments: dict[str, Any]) -> str: ...
 
@@ -140,7 +146,7 @@ class Base(ABC):
         return gen_conf
 
     def _chat(self, history, gen_conf, **kwargs):
-        logging.info("[HISTORY]" + json.dumps(history, ensure_ascii=False, indent=2))
+        _log_history("[HISTORY]", history)
         if self.model_name.lower().find("qwen3") >= 0:
             kwargs["extra_body"] = {"enable_thinking": False}
 
@@ -154,7 +160,7 @@ class Base(ABC):
         return ans, self.total_token_count(response)
 
     def _chat_streamly(self, history, gen_conf, **kwargs):
-        logging.info("[HISTORY STREAMLY]" + json.dumps(history, ensure_ascii=False, indent=4))
+        _log_history("[HISTORY STREAMLY]", history)
         reasoning_start = False
 
         if kwargs.get("stop") or "stop" in gen_conf:
@@ -663,7 +669,7 @@ class ZhipuChat(Base):
         ans = ""
         tk_count = 0
         try:
-            logging.info(json.dumps(history, ensure_ascii=False, indent=2))
+            _log_history("[HISTORY STREAMLY]", history)
             response = self.client.chat.completions.create(model=self.model_name, messages=history, stream=True, **gen_conf)
             for resp in response:
                 if not resp.choices[0].delta.content:
@@ -1358,7 +1364,7 @@ class LiteLLMBase(ABC):
         return gen_conf
 
     def _chat(self, history, gen_conf, **kwargs):
-        logging.info("[HISTORY]" + json.dumps(history, ensure_ascii=False, indent=2))
+        _log_history("[HISTORY]", history)
         if self.model_name.lower().find("qwen3") >= 0:
             kwargs["extra_body"] = {"enable_thinking": False}
 
@@ -1379,7 +1385,7 @@ class LiteLLMBase(ABC):
         return ans, self.total_token_count(response)
 
     def _chat_streamly(self, history, gen_conf, **kwargs):
-        logging.info("[HISTORY STREAMLY]" + json.dumps(history, ensure_ascii=False, indent=4))
+        _log_history("[HISTORY STREAMLY]", history)
         reasoning_start = False
 
         completion_args = self._construct_completion_args(history=history, stream=True, tools=False, **gen_conf)
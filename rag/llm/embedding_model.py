@@ -24,7 +24,7 @@ from urllib.parse import urljoin
 import dashscope
 import google.generativeai as genai
 import numpy as np
-import requests
+import trio
 from huggingface_hub import snapshot_download
 from ollama import Client
 from openai import OpenAI
@@ -34,6 +34,7 @@ from api import settings
 from api.utils.file_utils import get_home_cache_dir
 from api.utils.log_utils import log_exception
 from rag.utils import num_tokens_from_string, truncate, total_token_count_from_response
+from rag.utils.http_client import async_http_post, http_post
 
 
 class Base(ABC):
@@ -51,6 +52,12 @@ class Base(ABC):
     def encode_queries(self, text: str):
         raise NotImplementedError("Please implement encode method!")
 
+    async def async_encode(self, texts: list):
+        """
+        Providers with a native async client override this, the others encode on a worker thread.
+        """
+        return await trio.to_thread.run_sync(self.encode, texts)
+
     def total_token_count(self, resp):
         return total_token_count_from_response(resp)
 
@@ -439,7 +446,23 @@ class JinaEmbed(Base):
         token_count = 0
         for i in range(0, len(texts), batch_size):
             data = {"model": self.model_name, "input": texts[i : i + batch_size], "encoding_type": "float"}
-            response = requests.post(self.base_url, headers=self.headers, json=data)
+            response = http_post(self.base_url, headers=self.headers, json=data)
+            try:
+                res = response.json()
+                ress.extend([d["embedding"] for d in res["data"]])
+                token_count += self.total_token_count(res)
+            except Exception as _e:
+                log_exception(_e, response)
+        return np.array(ress), token_count
+
+    async def async_encode(self, texts: list):
+        texts = [truncate(t, 8196) for t in texts]
+        batch_size = 16
+        ress = []
+        token_count = 0
+        for i in range(0, len(texts), batch_size):
+            data = {"model": self.model_name, "input": texts[i : i + batch_size], "encoding_type": "float"}
+            response = await async_http_post(self.base_url, headers=self.headers, json=data)
             try:
                 res = response.json()
                 ress.extend([d["embedding"] for d in res["data"]])
@@ -623,13 +646,34 @@ class NvidiaEmbed(Base):
                 "encoding_format": "float",
                 "truncate": "END",
             }
-            response = requests.post(self.base_url, headers=self.headers, json=payload)
+            response = http_post(self.base_url, headers=self.headers, json=payload)
+            try:
+                res = response.json()
+                ress.extend([d["embedding"] for d in res["data"]])
+                token_count += self.total_token_count(res)
+            except Exception as _e:
+                log_exception(_e, response)
+        return np.array(ress), token_count
+
+    async def async_encode(self, texts: list):
+        batch_size = 16
+        ress = []
+        token_count = 0
+        for i in range(0, len(texts), batch_size):
+            payload = {
+                "input": texts[i : i + batch_size],
+                "input_type": "query",
+                "model": self.model_name,
+                "encoding_format": "float",
+                "truncate": "END",
+            }
+            response = await async_http_post(self.base_url, headers=self.headers, json=payload)
             try:
                 res = response.json()
+                ress.extend([d["embedding"] for d in res["data"]])
+                token_count += self.total_token_count(res)
             except Exception as _e:
                 log_exception(_e, response)
-            ress.extend([d["embedding"] for d in res["data"]])
-            token_count += self.total_token_count(res)
         return np.array(ress), token_count
 
     def encode_queries(self, text):
@@ -745,19 +789,22 @@ class SILICONFLOWEmbed(Base):
         ress = []
         token_count = 0
         for i in range(0, len(texts), batch_size):
-            texts_batch = texts[i : i + batch_size]
-            if self.model_name in ["BAAI/bge-large-zh-v1.5", "BAAI/bge-large-en-v1.5"]:
-                # limit 512, 340 is almost safe
-                texts_batch = [" " if not text.strip() else truncate(text, 340) for text in texts_batch]
-            else:
-                texts_batch = [" " if not text.strip() else text for text in texts_batch]
+            response = http_post(self.base_url, json=self._batch_payload(texts[i : i + batch_size]), headers=self.headers)
+            try:
+                res = response.json()
+                ress.extend([d["embedding"] for d in res["data"]])
+                token_count += self.total_token_count(res)
+            except Exception as _e:
+                log_exception(_e, response)
 
-            payload = {
-                "model": self.model_name,
-                "input": texts_batch,
-                "encoding_format": "float",
-            }
-            response = requests.post(self.base_url, json=payload, headers=self.headers)
+        return np.array(ress), token_count
+
+    async def async_encode(self, texts: list):
+        batch_size = 16
+        ress = []
+        token_count = 0
+        for i in range(0, len(texts), batch_size):
+            response = await async_http_post(self.base_url, json=self._batch_payload(texts[i : i + batch_size]), headers=self.headers)
             try:
                 res = response.json()
                 ress.extend([d["embedding"] for d in res["data"]])
@@ -767,13 +814,25 @@ class SILICONFLOWEmbed(Base):
 
         return np.array(ress), token_count
 
+    def _batch_payload(self, texts_batch: list):
+        if self.model_name in ["BAAI/bge-large-zh-v1.5", "BAAI/bge-large-en-v1.5"]:
+            # limit 512, 340 is almost safe
+            texts_batch = [" " if not text.strip() else truncate(text, 340) for text in texts_batch]
+        else:
+            texts_batch = [" " if not text.strip() else text for text in texts_batch]
+        return {
+            "model": self.model_name,
+            "input": texts_batch,
+            "encoding_format": "float",
+        }
+
     def encode_queries(self, text):
         payload = {
             "model": self.model_name,
             "input": text,
             "encoding_format": "float",
         }
-        response = requests.post(self.base_url, json=payload, headers=self.headers)
+        response = http_post(self.base_url, json=payload, headers=self.headers)
         try:
             res = response.json()
             return np.array(res["data"][0]["embedding"]), self.total_token_count(res)
@@ -880,7 +939,7 @@ class HuggingFaceEmbed(Base):
     def encode(self, texts: list):
         embeddings = []
         for text in texts:
-            response = requests.post(f"{self.base_url}/embed", json={"inputs": text}, headers={"Content-Type": "application/json"})
+            response = http_post(f"{self.base_url}/embed", json={"inputs": text}, headers={"Content-Type": "application/json"})
             if response.status_code == 200:
                 embedding = response.json()
                 embeddings.append(embedding[0])
@@ -889,7 +948,7 @@ class HuggingFaceEmbed(Base):
         return np.array(embeddings), sum([num_tokens_from_string(text) for text in texts])
 
     def encode_queries(self, text):
-        response = requests.post(f"{self.base_url}/embed", json={"inputs": text}, headers={"Content-Type": "application/json"})
+        response = http_post(f"{self.base_url}/embed", json={"inputs": text}, headers={"Content-Type": "application/json"})
         if response.status_code == 200:
             embedding = response.json()
             return np.array(embedding[0]), num_tokens_from_string(text)
@@ -25,6 +25,7 @@ from openai import OpenAI
 from openai.lib.azure import AzureOpenAI
 
 from rag.utils import num_tokens_from_string
+from rag.utils.http_client import http_post
 
 
 class Base(ABC):
@@ -126,7 +127,7 @@ class XinferenceSeq2txt(Base):
         files = {"file": (audio_file_name, audio_data, "audio/wav")}
 
         try:
-            response = requests.post(f"{self.base_url}/v1/audio/transcriptions", files=files, data=payload)
+            response = http_post(f"{self.base_url}/v1/audio/transcriptions", files=files, data=payload)
             response.raise_for_status()
             result = response.json()
 
@@ -32,11 +32,11 @@ from wsgiref.handlers import format_date_time
 
 import httpx
 import ormsgpack
-import requests
 import websocket
 from pydantic import BaseModel, conint
 
 from rag.utils import num_tokens_from_string
+from rag.utils.http_client import http_post
 
 
 class ServeReferenceAudio(BaseModel):
@@ -191,7 +191,7 @@ class OpenAITTS(Base):
         text = self.normalize_text(text)
         payload = {"model": self.model_name, "voice": voice, "input": text}
 
-        response = requests.post(f"{self.base_url}/audio/speech", headers=self.headers, json=payload, stream=True)
+        response = http_post(f"{self.base_url}/audio/speech", headers=self.headers, json=payload, stream=True)
 
         if response.status_code != 200:
             raise Exception(f"**Error**: {response.status_code}, {response.text}")
@@ -300,7 +300,7 @@ class XinferenceTTS(Base):
     def tts(self, text, voice="中文女", stream=True):
         payload = {"model": self.model_name, "input": text, "voice": voice}
 
-        response = requests.post(f"{self.base_url}/v1/audio/speech", headers=self.headers, json=payload, stream=stream)
+        response = http_post(f"{self.base_url}/v1/audio/speech", headers=self.headers, json=payload, stream=stream)
 
         if response.status_code != 200:
             raise Exception(f"**Error**: {response.status_code}, {response.text}")
@@ -323,7 +323,7 @@ class OllamaTTS(Base):
     def tts(self, text, voice="standard-voice"):
         payload = {"model": self.model_name, "voice": voice, "input": text}
 
-        response = requests.post(f"{self.base_url}/audio/tts", headers=self.headers, json=payload, stream=True)
+        response = http_post(f"{self.base_url}/audio/tts", headers=self.headers, json=payload, stream=True)
 
         if response.status_code != 200:
             raise Exception(f"**Error**: {response.status_code}, {response.text}")
@@ -345,7 +345,7 @@ class GPUStackTTS(Base):
     def tts(self, text, voice="Chinese Female", stream=True):
         payload = {"model": self.model_name, "input": text, "voice": voice}
 
-        response = requests.post(f"{self.base_url}/v1/audio/speech", headers=self.headers, json=payload, stream=stream)
+        response = http_post(f"{self.base_url}/v1/audio/speech", headers=self.headers, json=payload, stream=stream)
 
         if response.status_code != 200:
             raise Exception(f"**Error**: {response.status_code}, {response.text}")
@@ -379,7 +379,7 @@ class SILICONFLOWTTS(Base):
             "gain": 0,
         }
 
-        response = requests.post(f"{self.base_url}/audio/speech", headers=self.headers, json=payload)
+        response = http_post(f"{self.base_url}/audio/speech", headers=self.headers, json=payload)
 
         if response.status_code != 200:
             raise Exception(f"**Error**: {response.status_code}, {response.text}")
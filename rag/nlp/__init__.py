@@ -671,9 +671,10 @@ def naive_merge(sections: str | list, chunk_token_num=128, delimiter="\n。；
     cks = [""]
     tk_nums = [0]
 
-    def add_chunk(t, pos):
+    def add_chunk(t, pos, tnum=None):
         nonlocal cks, tk_nums, delimiter
-        tnum = num_tokens_from_string(t)
+        if tnum is None:
+            tnum = num_tokens_from_string(t)
         if not pos:
             pos = ""
         if tnum < 8:
@@ -695,8 +696,9 @@ def naive_merge(sections: str | list, chunk_token_num=128, delimiter="\n。；
 
     dels = get_delimiters(delimiter)
     for sec, pos in sections:
-        if num_tokens_from_string(sec) < chunk_token_num:
-            add_chunk(sec, pos)
+        tnum = num_tokens_from_string(sec)
+        if tnum < chunk_token_num:
+            add_chunk(sec, pos, tnum)
             continue
         split_sec = re.split(r"(%s)" % dels, sec, flags=re.DOTALL)
         for sub_sec in split_sec:
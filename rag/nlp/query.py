@@ -213,19 +213,38 @@ class FulltextQueryer:
         return np.array(sims[0]) * vtweight + np.array(tksim) * tkweight, tksim, sims[0]
 
     def token_similarity(self, atks, btkss):
-        def toDict(tks):
-            if isinstance(tks, str):
-                tks = tks.split()
+        def toDict(wts):
             d = defaultdict(int)
-            wts = self.tw.weights(tks, preprocess=False)
-            for i, (t, c) in enumerate(wts):
+            for t, c in wts:
                 d[t] += c
             return d
 
-        atks = toDict(atks)
-        btkss = [toDict(tks) for tks in btkss]
+        tkss = [tks.split() if isinstance(tks, str) else tks for tks in [atks] + list(btkss)]
+        atks, *btkss = [toDict(wts) for wts in self.tw.weights_batch(tkss)]
         return [self.similarity(atks, btks) for btks in btkss]
 
+    def token_similarity_matrix(self, atkss, btkss):
+        """
+        `token_similarity` of every token list in `atkss` against every one in `btkss` in one pass:
+        the weight share of each a's tokens which b contains, as a len(atkss) x len(btkss) array.
+        """
+        import numpy as np
+
+        atkss = [tks.split() if isinstance(tks, str) else tks for tks in atkss]
+        vocab = {}
+        for tks in atkss:
+            for t in tks:
+                vocab.setdefault(t, len(vocab))
+        A = np.zeros((len(atkss), len(vocab)))
+        for i, wts in enumerate(self.tw.weights_batch(atkss)):
+            for t, w in wts:
+                A[i, vocab[t]] += w
+        B = np.zeros((len(btkss), len(vocab)))
+        for j, tks in enumerate(btkss):
+            cols = [vocab[t] for t in set(tks.split() if isinstance(tks, str) else tks) if t in vocab]
+            B[j, cols] = 1
+        return (A @ B.T + 1e-9) / (A.sum(axis=1, keepdims=True) + 1e-9)
+
     def similarity(self, qtwt, dtwt):
         if isinstance(dtwt, type("")):
             dtwt = {t: w for t, w in self.tw.weights(self.tw.split(dtwt), preprocess=False)}
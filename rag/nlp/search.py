@@ -16,14 +16,24 @@
 import logging
 import re
 import math
+import threading
 from collections import OrderedDict
+from contextlib import contextmanager
 from dataclasses import dataclass
+from functools import partial
 
-from rag.settings import TAG_FLD, PAGERANK_FLD
+import trio
+
+from rag.settings import TAG_FLD, PAGERANK_FLD, MAX_CONCURRENT_RETRIEVALS_PER_TENANT, RETRIEVAL_STORE_SCORES
 from rag.utils import rmSpace, get_float
 from rag.nlp import rag_tokenizer, query
 import numpy as np
 from rag.utils.doc_store_conn import DocStoreConnection, MatchDenseExpr, FusionExpr, OrderByExpr
+from rag.utils.metrics import RETRIEVAL_SECONDS
+
+
+# Trio callers' limiters, one map per run of an event loop: trio primitives belong to the loop they are used in.
+_TENANT_LIMITERS = trio.lowlevel.RunVar("tenant_retrieval_limiters")
 
 
 def index_name(uid):
@@ -31,9 +41,49 @@ def index_name(uid):
 
 
 class Dealer:
+    MAX_TENANT_GATES = 1024
+
     def __init__(self, dataStore: DocStoreConnection):
         self.qryr = query.FulltextQueryer()
         self.dataStore = dataStore
+        # Per-tenant bounds on concurrent retrievals: tenant to [semaphore, holders], most recently used last.
+        # Only gates nobody holds or waits on are dropped past MAX_TENANT_GATES.
+        self._tenant_gates = OrderedDict()
+        self._gates_lock = threading.Lock()
+
+    @contextmanager
+    def _tenant_gate(self, tenant_id: str):
+        with self._gates_lock:
+            gate = self._tenant_gates.get(tenant_id)
+            if gate is None:
+                gate = self._tenant_gates[tenant_id] = [threading.BoundedSemaphore(MAX_CONCURRENT_RETRIEVALS_PER_TENANT), 0]
+                idle = [tid for tid, (_, holders) in self._tenant_gates.items() if holders == 0 and tid != tenant_id]
+                for tid in idle[: max(0, len(self._tenant_gates) - self.MAX_TENANT_GATES)]:
+                    del self._tenant_gates[tid]
+            else:
+                self._tenant_gates.move_to_end(tenant_id)
+            gate[1] += 1
+        try:
+            with gate[0]:
+                yield
+        finally:
+            with self._gates_lock:
+                gate[1] -= 1
+
+    def _tenant_limiter(self, tenant_id: str) -> trio.CapacityLimiter:
+        limiters = _TENANT_LIMITERS.get(None)
+        if limiters is None:
+            limiters = OrderedDict()
+            _TENANT_LIMITERS.set(limiters)
+        limiter = limiters.get(tenant_id)
+        if limiter is None:
+            limiter = limiters[tenant_id] = trio.CapacityLimiter(MAX_CONCURRENT_RETRIEVALS_PER_TENANT)
+            idle = [tid for tid, lmt in limiters.items() if not lmt.borrowed_tokens and not lmt.statistics().tasks_waiting and tid != tenant_id]
+            for tid in idle[: max(0, len(limiters) - self.MAX_TENANT_GATES)]:
+                del limiters[tid]
+        else:
+            limiters.move_to_end(tenant_id)
+        return limiter
 
     @dataclass
     class SearchResult:
@@ -95,6 +145,7 @@ class Dealer:
                 "doc_type_kwd",
                 "available_int",
                 "content_with_weight",
+                "token_num_int",
                 PAGERANK_FLD,
                 TAG_FLD,
             ],
@@ -122,7 +173,9 @@ class Dealer:
             else:
                 matchDense = self.get_vector(qst, emb_mdl, topk, req.get("similarity", 0.1))
                 q_vec = matchDense.embedding_data
-                src.append(f"q_{len(q_vec)}_vec")
+                # Without "vector", the chunk vectors stay in the store, see `rerank_by_store_score`.
+                if req.get("vector", True):
+                    src.append(f"q_{len(q_vec)}_vec")
 
                 fusionExpr = FusionExpr("weighted_sum", topk, {"weights": "0.05,0.95"})
                 matchExprs = [matchText, matchDense, fusionExpr]
@@ -163,10 +216,12 @@ class Dealer:
     def trans2floats(txt):
         return [get_float(t) for t in txt.split("\t")]
 
-    def insert_citations(self, answer, chunks, chunk_v, embd_mdl, tkweight=0.1, vtweight=0.9):
-        assert len(chunks) == len(chunk_v)
-        if not chunks:
-            return answer, set([])
+    @staticmethod
+    def citation_pieces(answer):
+        """
+        Split an answer into the pieces citations are inserted after.
+        Returns all the pieces, the positions of those long enough to be cited and their texts.
+        """
         pieces = re.split(r"(```)", answer)
         if len(pieces) >= 3:
             i = 0
@@ -197,11 +252,28 @@ class Dealer:
                 continue
             idx.append(i)
             pieces_.append(t)
+        return pieces, idx, pieces_
+
+    def insert_citations(self, answer, chunks, chunk_v, embd_mdl, tkweight=0.1, vtweight=0.9, piece_vectors=None):
+        """
+        `chunks` are the chunks' `content_ltks`, already tokenized at indexing.
+        `piece_vectors` maps answer pieces to embeddings computed ahead, e.g. while the answer was streamed,
+        only the other pieces are encoded here.
+        """
+        assert len(chunks) == len(chunk_v)
+        if not chunks:
+            return answer, set([])
+        pieces, idx, pieces_ = self.citation_pieces(answer)
         logging.debug("{} => {}".format(answer, pieces_))
         if not pieces_:
             return answer, set([])
 
-        ans_v, _ = embd_mdl.encode(pieces_)
+        piece_vectors = dict(piece_vectors or {})
+        missing = list(dict.fromkeys(p for p in pieces_ if p not in piece_vectors))
+        if missing:
+            vts, _ = embd_mdl.encode(missing)
+            piece_vectors.update(zip(missing, vts))
+        ans_v = np.array([piece_vectors[p] for p in pieces_], dtype=float)
         for i in range(len(chunk_v)):
             if len(ans_v[0]) != len(chunk_v[i]):
                 chunk_v[i] = [0.0] * len(ans_v[0])
@@ -209,17 +281,25 @@ class Dealer:
 
         assert len(ans_v[0]) == len(chunk_v[0]), "The dimension of query and chunk do not match: {} vs. {}".format(len(ans_v[0]), len(chunk_v[0]))
 
-        chunks_tks = [rag_tokenizer.tokenize(self.qryr.rmWWW(ck)).split() for ck in chunks]
+        # Every piece against every chunk at once, then only the threshold is relaxed.
+        def normalize(m):
+            norm = np.linalg.norm(m, axis=1, keepdims=True)
+            norm[norm == 0] = 1
+            return m / norm
+
+        vtsim = normalize(ans_v) @ normalize(np.array(chunk_v, dtype=float)).T
+        chunks_tks = [self.qryr.rmWWW(ck).split() for ck in chunks]
+        pieces_tks = [rag_tokenizer.tokenize(self.qryr.rmWWW(p)).split() for p in pieces_]
+        tksim = self.qryr.token_similarity_matrix(pieces_tks, chunks_tks)
+        sim = np.where(vtsim.sum(axis=1, keepdims=True) == 0, tksim, vtsim * vtweight + tksim * tkweight)
+        mx = np.max(sim, axis=1) * 0.99
+
         cites = {}
         thr = 0.63
-        while thr > 0.3 and len(cites.keys()) == 0 and pieces_ and chunks_tks:
-            for i, a in enumerate(pieces_):
-                sim, tksim, vtsim = self.qryr.hybrid_similarity(ans_v[i], chunk_v, rag_tokenizer.tokenize(self.qryr.rmWWW(pieces_[i])).split(), chunks_tks, tkweight, vtweight)
-                mx = np.max(sim) * 0.99
-                logging.debug("{} SIM: {}".format(pieces_[i], mx))
-                if mx < thr:
-                    continue
-                cites[idx[i]] = list(set([str(ii) for ii in range(len(chunk_v)) if sim[ii] > mx]))[:4]
+        while thr > 0.3 and len(cites.keys()) == 0:
+            for i in np.nonzero(mx >= thr)[0]:
+                logging.debug("{} SIM: {}".format(pieces_[i], mx[i]))
+                cites[idx[i]] = list(set([str(ii) for ii in np.nonzero(sim[i] > mx[i])[0]]))[:4]
             thr *= 0.8
 
         res = ""
@@ -321,9 +401,66 @@ class Dealer:
 
         return tkweight * (np.array(tksim) + rank_fea) + vtweight * vtsim, tksim, vtsim
 
+    def rerank_by_store_score(self, sres, query, idx_names, kb_ids, tkweight=0.3, vtweight=0.7, cfield="content_ltks", rank_feature: dict | None = None):
+        """
+        Like `rerank`, but the cosine similarity of each chunk to the query vector is computed by the doc store
+        instead of fetching the chunk vectors. The store's own hybrid score is not used: it already includes the
+        full-text match and is not on the cosine scale. Scores therefore mean the same as with `rerank`, and so
+        does `similarity_threshold`.
+        """
+        _, keywords = self.qryr.question(query)
+        if not sres.ids:
+            return [], [], []
+
+        for i in sres.ids:
+            if isinstance(sres.field[i].get("important_kwd", []), str):
+                sres.field[i]["important_kwd"] = [sres.field[i]["important_kwd"]]
+        ins_tw = []
+        for i in sres.ids:
+            content_ltks = list(OrderedDict.fromkeys(sres.field[i][cfield].split()))
+            title_tks = [t for t in sres.field[i].get("title_tks", "").split() if t]
+            question_tks = [t for t in sres.field[i].get("question_tks", "").split() if t]
+            important_kwd = sres.field[i].get("important_kwd", [])
+            tks = content_ltks + title_tks * 2 + important_kwd * 5 + question_tks * 6
+            ins_tw.append(tks)
+
+        ## For rank feature(tag_fea) scores.
+        rank_fea = self._rank_feature_scores(rank_feature, sres)
+
+        tksim = np.array(self.qryr.token_similarity(keywords, ins_tw))
+        vtsim = np.zeros(len(sres.ids))
+        if sres.query_vector:
+            q_vec = sres.query_vector
+            cos = self.dataStore.vectorSimilarity(sres.ids, MatchDenseExpr(f"q_{len(q_vec)}_vec", q_vec, "float", "cosine", len(sres.ids)), idx_names, kb_ids)
+            vtsim = np.array([cos.get(i, 0.0) for i in sres.ids])
+        return vtsim * vtweight + tksim * tkweight + rank_fea, tksim, vtsim
+
+    def fetch_fields(self, chunk_ids: list[str], fields: list[str], idx_names: str | list[str], kb_ids: list[str]) -> dict[str, dict]:
+        """
+        Fetch the given fields of just the given chunks, by chunk id.
+        """
+        if not chunk_ids:
+            return {}
+        res = self.dataStore.search(fields, [], {"id": chunk_ids}, [], OrderByExpr(), 0, len(chunk_ids), idx_names, kb_ids)
+        return self.dataStore.getFields(res, fields)
+
+    def fetch_vectors(self, chunk_ids: list[str], vector_column: str, idx_names: str | list[str], kb_ids: list[str]) -> dict[str, list[float]]:
+        """
+        Fetch the embedding of just the given chunks, e.g. the final page of a store-scored retrieval.
+        """
+        vectors = {}
+        for chunk_id, fields in self.fetch_fields(chunk_ids, [vector_column], idx_names, kb_ids).items():
+            vector = fields.get(vector_column)
+            if isinstance(vector, str):
+                vector = self.trans2floats(vector)
+            if vector is not None:
+                vectors[chunk_id] = vector
+        return vectors
+
     def hybrid_similarity(self, ans_embd, ins_embd, ans, inst):
         return self.qryr.hybrid_similarity(ans_embd, ins_embd, rag_tokenizer.tokenize(ans).split(), rag_tokenizer.tokenize(inst).split())
 
+    @RETRIEVAL_SECONDS.time()
     def retrieval(
         self,
         question,
@@ -340,6 +477,7 @@ class Dealer:
         rerank_mdl=None,
         highlight=False,
         rank_feature: dict | None = {PAGERANK_FLD: 10},
+        with_vector=True,
     ):
         ranks = {"total": 0, "chunks": [], "doc_aggs": {}}
         if not question:
@@ -355,7 +493,7 @@ class Dealer:
             "page": math.ceil(page_size * page / RERANK_LIMIT),
             "size": RERANK_LIMIT,
             "question": question,
-            "vector": True,
+            "vector": not RETRIEVAL_STORE_SCORES,
             "topk": top,
             "similarity": similarity_threshold,
             "available_int": 1,
@@ -363,13 +501,17 @@ class Dealer:
 
         if isinstance(tenant_ids, str):
             tenant_ids = tenant_ids.split(",")
+        idx_names = [index_name(tid) for tid in tenant_ids]
 
-        sres = self.search(req, [index_name(tid) for tid in tenant_ids], kb_ids, embd_mdl, highlight, rank_feature=rank_feature)
+        with self._tenant_gate(tenant_ids[0] if tenant_ids else ""):
+            sres = self.search(req, idx_names, kb_ids, embd_mdl, highlight, rank_feature=rank_feature)
 
-        if rerank_mdl and sres.total > 0:
-            sim, tsim, vsim = self.rerank_by_model(rerank_mdl, sres, question, 1 - vector_similarity_weight, vector_similarity_weight, rank_feature=rank_feature)
-        else:
-            sim, tsim, vsim = self.rerank(sres, question, 1 - vector_similarity_weight, vector_similarity_weight, rank_feature=rank_feature)
+            if rerank_mdl and sres.total > 0:
+                sim, tsim, vsim = self.rerank_by_model(rerank_mdl, sres, question, 1 - vector_similarity_weight, vector_similarity_weight, rank_feature=rank_feature)
+            elif RETRIEVAL_STORE_SCORES:
+                sim, tsim, vsim = self.rerank_by_store_score(sres, question, idx_names, kb_ids, 1 - vector_similarity_weight, vector_similarity_weight, rank_feature=rank_feature)
+            else:
+                sim, tsim, vsim = self.rerank(sres, question, 1 - vector_similarity_weight, vector_similarity_weight, rank_feature=rank_feature)
         # Already paginated in search function
         idx = np.argsort(sim * -1)[(page - 1) * page_size : page * page_size]
         dim = len(sres.query_vector)
@@ -411,6 +553,7 @@ class Dealer:
                 "vector": chunk.get(vector_column, zero_vector),
                 "positions": position_int,
                 "doc_type_kwd": chunk.get("doc_type_kwd", ""),
+                "token_num_int": chunk.get("token_num_int", 0),
             }
             if highlight and sres.highlight:
                 if id in sres.highlight:
@@ -423,9 +566,26 @@ class Dealer:
             ranks["doc_aggs"][dnm]["count"] += 1
         ranks["doc_aggs"] = [{"doc_name": k, "doc_id": v["doc_id"], "count": v["count"]} for k, v in sorted(ranks["doc_aggs"].items(), key=lambda x: x[1]["count"] * -1)]
         ranks["chunks"] = ranks["chunks"][:page_size]
+        if RETRIEVAL_STORE_SCORES and with_vector and dim and ranks["chunks"]:
+            vectors = self.fetch_vectors([ck["chunk_id"] for ck in ranks["chunks"]], vector_column, idx_names, kb_ids)
+            for ck in ranks["chunks"]:
+                ck["vector"] = vectors.get(ck["chunk_id"], zero_vector)
 
         return ranks
 
+    async def search_async(self, req, idx_names: str | list[str], kb_ids: list[str], emb_mdl=None, highlight=False, rank_feature: dict | None = None, tenant_id: str = ""):
+        """
+        Awaitable `search` for trio callers (task executor, agent tools).
+        The blocking doc store and embedding calls run on a worker thread, taken only once the tenant has a turn.
+        """
+        return await trio.to_thread.run_sync(partial(self.search, req, idx_names, kb_ids, emb_mdl, highlight, rank_feature=rank_feature), limiter=self._tenant_limiter(tenant_id))
+
+    async def retrieval_async(self, *args, tenant_id: str = "", **kwargs):
+        """
+        Awaitable `retrieval` (also for `KGSearch.retrieval`), see `search_async`.
+        """
+        return await trio.to_thread.run_sync(partial(self.retrieval, *args, **kwargs), limiter=self._tenant_limiter(tenant_id))
+
     def sql_retrieval(self, sql, fetch_size=128, format="json"):
         tbl = self.dataStore.sql(sql, fetch_size, format)
         return tbl
@@ -457,6 +617,11 @@ class Dealer:
         total = np.sum([c for _, c in res])
         return {t: (c + 1) / (total + S) for t, c in res}
 
+    @staticmethod
+    def _tag_features(aggs, all_tags, topn_tags=3, S=1000):
+        cnt = np.sum([c for _, c in aggs])
+        return sorted([(a, round(0.1 * (c + 1) / (cnt + S) / max(1e-6, all_tags.get(a, 0.0001)))) for a, c in aggs], key=lambda x: x[1] * -1)[:topn_tags]
+
     def tag_content(self, tenant_id: str, kb_ids: list[str], doc, all_tags, topn_tags=3, keywords_topn=30, S=1000):
         idx_nm = index_name(tenant_id)
         match_txt = self.qryr.paragraph(doc["title_tks"] + " " + doc["content_ltks"], doc.get("important_kwd", []), keywords_topn)
@@ -464,11 +629,43 @@ class Dealer:
         aggs = self.dataStore.getAggregation(res, "tag_kwd")
         if not aggs:
             return False
-        cnt = np.sum([c for _, c in aggs])
-        tag_fea = sorted([(a, round(0.1 * (c + 1) / (cnt + S) / max(1e-6, all_tags.get(a, 0.0001)))) for a, c in aggs], key=lambda x: x[1] * -1)[:topn_tags]
-        doc[TAG_FLD] = {a.replace(".", "_"): c for a, c in tag_fea if c > 0}
+        doc[TAG_FLD] = {a.replace(".", "_"): c for a, c in self._tag_features(aggs, all_tags, topn_tags, S) if c > 0}
         return True
 
+    def tag_contents(self, tenant_id: str, kb_ids: list[str], docs: list[dict], all_tags, topn_tags=3, keywords_topn=30, S=1000, batch_size=64) -> list[bool]:
+        """
+        Batched `tag_content`: the tag aggregation queries of `batch_size` chunks go to the doc store as one multi-search.
+        """
+        idx_nm = index_name(tenant_id)
+        tagged = []
+        for b in range(0, len(docs), batch_size):
+            batch = docs[b : b + batch_size]
+            searches = []
+            for doc in batch:
+                match_txt = self.qryr.paragraph(doc["title_tks"] + " " + doc["content_ltks"], doc.get("important_kwd", []), keywords_topn)
+                searches.append(
+                    dict(
+                        selectFields=[],
+                        highlightFields=[],
+                        condition={},
+                        matchExprs=[match_txt],
+                        orderBy=OrderByExpr(),
+                        offset=0,
+                        limit=0,
+                        indexNames=idx_nm,
+                        knowledgebaseIds=kb_ids,
+                        aggFields=["tag_kwd"],
+                    )
+                )
+            for doc, res in zip(batch, self.dataStore.msearch(searches)):
+                aggs = self.dataStore.getAggregation(res, "tag_kwd")
+                if not aggs:
+                    tagged.append(False)
+                    continue
+                doc[TAG_FLD] = {a.replace(".", "_"): c for a, c in self._tag_features(aggs, all_tags, topn_tags, S) if c > 0}
+                tagged.append(True)
+        return tagged
+
     def tag_query(self, question: str, tenant_ids: str | list[str], kb_ids: list[str], all_tags, topn_tags=3, S=1000):
         if isinstance(tenant_ids, str):
             idx_nms = index_name(tenant_ids)
@@ -479,6 +676,4 @@ class Dealer:
         aggs = self.dataStore.getAggregation(res, "tag_kwd")
         if not aggs:
             return {}
-        cnt = np.sum([c for _, c in aggs])
-        tag_fea = sorted([(a, round(0.1 * (c + 1) / (cnt + S) / max(1e-6, all_tags.get(a, 0.0001)))) for a, c in aggs], key=lambda x: x[1] * -1)[:topn_tags]
-        return {a.replace(".", "_"): max(1, c) for a, c in tag_fea}
+        return {a.replace(".", "_"): max(1, c) for a, c in self._tag_features(aggs, all_tags, topn_tags, S)}
@@ -19,10 +19,21 @@ import math
 import json
 import re
 import os
+from functools import lru_cache
 import numpy as np
 from rag.nlp import rag_tokenizer
 from api.utils.file_utils import get_project_base_directory
 
+# Bound of the memoized token -> raw weight table.
+TERM_WEIGHT_CACHE_SIZE = int(os.environ.get("TERM_WEIGHT_CACHE_SIZE", 200000))
+
+NUM_PATTERN = re.compile(r"[0-9,.]{2,}$")
+SHORT_LETTER_PATTERN = re.compile(r"[a-z]{1,2}$")
+NUM_SPACE_PATTERN = re.compile(r"[0-9. -]{2,}$")
+LETTER_PATTERN = re.compile(r"[a-z. -]+$")
+NUM_TAG_PATTERN = re.compile(r"[0-9-]+")
+NER_WEIGHTS = {"toxic": 2, "func": 1, "corp": 3, "loca": 3, "sch": 3, "stock": 3, "firstnm": 1}
+
 
 class Dealer:
     def __init__(self):
@@ -93,6 +104,9 @@ class Dealer:
         except Exception:
             logging.warning("Load term.freq FAIL!")
 
+        # A token's raw weight depends only on the token and the static dictionaries, so it's computed once.
+        self.token_weight = lru_cache(maxsize=TERM_WEIGHT_CACHE_SIZE)(self._token_weight)
+
     def pretoken(self, txt, num=False, stpwd=True):
         patt = [r"[~—\t @#%!<>,\.\?\":;'\{\}\[\]_=\(\)\|，。？》•●○↓《；‘’：“”【¥ 】…￥！、·（）×`&\\/「」\\]"]
         rewt = []
@@ -156,39 +170,33 @@ class Dealer:
                 tks.append(t)
         return tks
 
-    def weights(self, tks, preprocess=True):
-        num_pattern = re.compile(r"[0-9,.]{2,}$")
-        short_letter_pattern = re.compile(r"[a-z]{1,2}$")
-        num_space_pattern = re.compile(r"[0-9. -]{2,}$")
-        letter_pattern = re.compile(r"[a-z. -]+$")
-
+    def _token_weight(self, t):
         def ner(t):
-            if num_pattern.match(t):
+            if NUM_PATTERN.match(t):
                 return 2
-            if short_letter_pattern.match(t):
+            if SHORT_LETTER_PATTERN.match(t):
                 return 0.01
             if not self.ne or t not in self.ne:
                 return 1
-            m = {"toxic": 2, "func": 1, "corp": 3, "loca": 3, "sch": 3, "stock": 3, "firstnm": 1}
-            return m[self.ne[t]]
+            return NER_WEIGHTS[self.ne[t]]
 
         def postag(t):
             t = rag_tokenizer.tag(t)
-            if t in set(["r", "c", "d"]):
+            if t in ("r", "c", "d"):
                 return 0.3
-            if t in set(["ns", "nt"]):
+            if t in ("ns", "nt"):
                 return 3
-            if t in set(["n"]):
+            if t == "n":
                 return 2
-            if re.match(r"[0-9-]+", t):
+            if NUM_TAG_PATTERN.match(t):
                 return 2
             return 1
 
         def freq(t):
-            if num_space_pattern.match(t):
+            if NUM_SPACE_PATTERN.match(t):
                 return 3
             s = rag_tokenizer.freq(t)
-            if not s and letter_pattern.match(t):
+            if not s and LETTER_PATTERN.match(t):
                 return 300
             if not s:
                 s = 0
@@ -203,11 +211,11 @@ class Dealer:
             return max(s, 10)
 
         def df(t):
-            if num_space_pattern.match(t):
+            if NUM_SPACE_PATTERN.match(t):
                 return 5
             if t in self.df:
                 return self.df[t] + 3
-            elif letter_pattern.match(t):
+            elif LETTER_PATTERN.match(t):
                 return 300
             elif len(t) >= 4:
                 s = [tt for tt in rag_tokenizer.fine_grained_tokenize(t).split() if len(tt) > 1]
@@ -219,21 +227,134 @@ class Dealer:
         def idf(s, N):
             return math.log10(10 + ((N - s + 0.5) / (s + 0.5)))
 
-        tw = []
+        return (0.3 * idf(freq(t), 10000000) + 0.7 * idf(df(t), 1000000000)) * ner(t) * postag(t)
+
+    def token_weights(self, tks) -> np.ndarray:
+        """
+        Unnormalized weights of already split tokens, read from the memoized table.
+        """
+        return np.fromiter((self.token_weight(t) for t in tks), dtype=float, count=len(tks))
+
+    def weights(self, tks, preprocess=True):
         if not preprocess:
-            idf1 = np.array([idf(freq(t), 10000000) for t in tks])
-            idf2 = np.array([idf(df(t), 1000000000) for t in tks])
-            wts = (0.3 * idf1 + 0.7 * idf2) * np.array([ner(t) * postag(t) for t in tks])
-            wts = [s for s in wts]
-            tw = list(zip(tks, wts))
+            tw = list(zip(tks, self.token_weights(tks)))
         else:
+            tw = []
             for tk in tks:
                 tt = self.tokenMerge(self.pretoken(tk, True))
-                idf1 = np.array([idf(freq(t), 10000000) for t in tt])
-                idf2 = np.array([idf(df(t), 1000000000) for t in tt])
-                wts = (0.3 * idf1 + 0.7 * idf2) * np.array([ner(t) * postag(t) for t in tt])
-                wts = [s for s in wts]
-                tw.extend(zip(tt, wts))
+                tw.extend(zip(tt, self.token_weights(tt)))
 
         S = np.sum([s for _, s in tw])
         return [(t, s / S) for t, s in tw]
+
+    def weights_batch(self, tkss) -> list[list[tuple[str, float]]]:
+        """
+        `weights(tks, preprocess=False)` for many token lists at once, e.g. every candidate chunk of a rerank.
+        """
+        flat = [t for tks in tkss for t in tks]
+        wts = self.token_weights(flat)
+        res, i = [], 0
+        for tks in tkss:
+            w = wts[i : i + len(tks)]
+            i += len(tks)
+            res.append(list(zip(tks, w / np.sum(w))))
+        return res
+
+
+def _reference_weights(dealer, tks):
+    """
+    `weights(tks, preprocess=False)` as it was before the memoized table: every token's weight
+    recomputed on each call. Kept to check weights_batch against.
+    """
+    num_pattern = re.compile(r"[0-9,.]{2,}$")
+    short_letter_pattern = re.compile(r"[a-z]{1,2}$")
+    num_space_pattern = re.compile(r"[0-9. -]{2,}$")
+    letter_pattern = re.compile(r"[a-z. -]+$")
+
+    def ner(t):
+        if num_pattern.match(t):
+            return 2
+        if short_letter_pattern.match(t):
+            return 0.01
+        if not dealer.ne or t not in dealer.ne:
+            return 1
+        m = {"toxic": 2, "func": 1, "corp": 3, "loca": 3, "sch": 3, "stock": 3, "firstnm": 1}
+        return m[dealer.ne[t]]
+
+    def postag(t):
+        t = rag_tokenizer.tag(t)
+        if t in set(["r", "c", "d"]):
+            return 0.3
+        if t in set(["ns", "nt"]):
+            return 3
+        if t in set(["n"]):
+            return 2
+        if re.match(r"[0-9-]+", t):
+            return 2
+        return 1
+
+    def freq(t):
+        if num_space_pattern.match(t):
+            return 3
+        s = rag_tokenizer.freq(t)
+        if not s and letter_pattern.match(t):
+            return 300
+        if not s:
+            s = 0
+
+        if not s and len(t) >= 4:
+            s = [tt for tt in rag_tokenizer.fine_grained_tokenize(t).split() if len(tt) > 1]
+            if len(s) > 1:
+                s = np.min([freq(tt) for tt in s]) / 6.0
+            else:
+                s = 0
+
+        return max(s, 10)
+
+    def df(t):
+        if num_space_pattern.match(t):
+            return 5
+        if t in dealer.df:
+            return dealer.df[t] + 3
+        elif letter_pattern.match(t):
+            return 300
+        elif len(t) >= 4:
+            s = [tt for tt in rag_tokenizer.fine_grained_tokenize(t).split() if len(tt) > 1]
+            if len(s) > 1:
+                return max(3, np.min([df(tt) for tt in s]) / 6.0)
+
+        return 3
+
+    def idf(s, N):
+        return math.log10(10 + ((N - s + 0.5) / (s + 0.5)))
+
+    idf1 = np.array([idf(freq(t), 10000000) for t in tks])
+    idf2 = np.array([idf(df(t), 1000000000) for t in tks])
+    wts = (0.3 * idf1 + 0.7 * idf2) * np.array([ner(t) * postag(t) for t in tks])
+    wts = [s for s in wts]
+    tw = list(zip(tks, wts))
+
+    S = np.sum([s for _, s in tw])
+    return [(t, s / S) for t, s in tw]
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+
+    # Parity and speed of the memoized batch weights against the per-call computation: python term_weight.py [text file]
+    logging.basicConfig(level=logging.INFO)
+    txt = open(sys.argv[1]).read() if len(sys.argv) > 1 else "多校划片就是一个小区对应多个小学初中，让买了学区房的家庭也不确定到底能上哪个学校。Scripts are compiled and cached."
+    dealer = Dealer()
+    tkss = [rag_tokenizer.tokenize(line).split() for line in txt.split("\n") if line.strip()] * 20
+
+    st = time.perf_counter()
+    ref = [_reference_weights(dealer, tks) for tks in tkss]
+    ref_elapsed = time.perf_counter() - st
+    st = time.perf_counter()
+    new = dealer.weights_batch(tkss)
+    new_elapsed = time.perf_counter() - st
+
+    diff = max((abs(a[1] - b[1]) for r, n in zip(ref, new) for a, b in zip(r, n)), default=0.0)
+    logging.info(f"{sum(len(tks) for tks in tkss)} tokens: per call {ref_elapsed:.4f}s, memoized batch {new_elapsed:.4f}s, max abs diff {diff:.3e}, {dealer.token_weight.cache_info()}")
+    assert diff < 1e-9, f"weights_batch differs from the per-call weights by {diff}"
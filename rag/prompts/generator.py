@@ -24,7 +24,7 @@ import json_repair
 from api.utils import hash_str2int
 from rag.prompts.template import load_prompt
 from rag.settings import TAG_FLD
-from rag.utils import encoder, num_tokens_from_string
+from rag.utils import cached_num_tokens, encoder, num_tokens_from_string
 
 
 STOP_TOKEN = "<|STOP|>"
@@ -56,30 +56,24 @@ def chunks_format(reference):
 
 
 def message_fit_in(msg, max_length=4000):
-    def count():
-        nonlocal msg
-        tks_cnts = []
-        for m in msg:
-            tks_cnts.append({"role": m["role"], "count": num_tokens_from_string(m["content"])})
-        total = 0
-        for m in tks_cnts:
-            total += m["count"]
-        return total
-
-    c = count()
+    # Each message is counted once, the history of a conversation mostly hits the cache.
+    cnts = [cached_num_tokens(m["content"]) for m in msg]
+    c = sum(cnts)
     if c < max_length:
         return c, msg
 
-    msg_ = [m for m in msg if m["role"] == "system"]
+    kept = [i for i, m in enumerate(msg) if m["role"] == "system"]
     if len(msg) > 1:
-        msg_.append(msg[-1])
+        kept.append(len(msg) - 1)
+    msg_ = [msg[i] for i in kept]
+    cnts = [cnts[i] for i in kept]
     msg = msg_
-    c = count()
+    c = sum(cnts)
     if c < max_length:
         return c, msg
 
-    ll = num_tokens_from_string(msg_[0]["content"])
-    ll2 = num_tokens_from_string(msg_[-1]["content"])
+    ll = cnts[0]
+    ll2 = cnts[-1]
     if ll / (ll + ll2) > 0.8:
         m = msg_[0]["content"]
         m = encoder.decode(encoder.encode(m)[: max_length - ll2])
@@ -102,7 +96,7 @@ def kb_prompt(kbinfos, max_tokens, hash_id=False):
     for i, c in enumerate(knowledges):
         if not c:
             continue
-        used_token_count += num_tokens_from_string(c)
+        used_token_count += kbinfos["chunks"][i].get("token_num_int") or cached_num_tokens(c)
         chunks_num += 1
         if max_tokens * 0.97 < used_token_count:
             knowledges = knowledges[:i]
@@ -172,7 +166,7 @@ def keyword_extraction(chat_mdl, content, topn=3):
 
     msg = [{"role": "system", "content": rendered_prompt}, {"role": "user", "content": "Output: "}]
     _, msg = message_fit_in(msg, chat_mdl.max_length)
-    kwd = chat_mdl.chat(rendered_prompt, msg[1:], {"temperature": 0.2})
+    kwd = chat_mdl.chat(rendered_prompt, msg[1:], {"temperature": 0.2}, cache=True)
     if isinstance(kwd, tuple):
         kwd = kwd[0]
     kwd = re.sub(r"^.*</think>", "", kwd, flags=re.DOTALL)
@@ -225,7 +219,7 @@ def full_question(tenant_id=None, llm_id=None, messages=[], language=None, chat_
         language=language,
     )
 
-    ans = chat_mdl.chat(rendered_prompt, [{"role": "user", "content": "Output: "}])
+    ans = chat_mdl.chat(rendered_prompt, [{"role": "user", "content": "Output: "}], cache=True)
     ans = re.sub(r"^.*</think>", "", ans, flags=re.DOTALL)
     return ans if ans.find("**ERROR**") < 0 else messages[-1]["content"]
 
@@ -243,7 +237,7 @@ def cross_languages(tenant_id, llm_id, query, languages=[]):
     rendered_sys_prompt = PROMPT_JINJA_ENV.from_string(CROSS_LANGUAGES_SYS_PROMPT_TEMPLATE).render()
     rendered_user_prompt = PROMPT_JINJA_ENV.from_string(CROSS_LANGUAGES_USER_PROMPT_TEMPLATE).render(query=query, languages=languages)
 
-    ans = chat_mdl.chat(rendered_sys_prompt, [{"role": "user", "content": rendered_user_prompt}], {"temperature": 0.2})
+    ans = chat_mdl.chat(rendered_sys_prompt, [{"role": "user", "content": rendered_user_prompt}], {"temperature": 0.2}, cache=True)
     ans = re.sub(r"^.*</think>", "", ans, flags=re.DOTALL)
     if ans.find("**ERROR**") >= 0:
         return query
@@ -416,7 +410,7 @@ def rank_memories(chat_mdl, goal: str, sub_goal: str, tool_call_summaries: list[
 def gen_meta_filter(chat_mdl, meta_data: dict, query: str) -> list:
     sys_prompt = PROMPT_JINJA_ENV.from_string(META_FILTER).render(current_date=datetime.datetime.today().strftime("%Y-%m-%d"), metadata_keys=json.dumps(meta_data), user_question=query)
     user_prompt = "Generate filters:"
-    ans = chat_mdl.chat(sys_prompt, [{"role": "user", "content": user_prompt}])
+    ans = chat_mdl.chat(sys_prompt, [{"role": "user", "content": user_prompt}], cache=True)
     ans = re.sub(r"(^.*</think>|```json\n|```\n*$)", "", ans, flags=re.DOTALL)
     try:
         ans = json_repair.loads(ans)
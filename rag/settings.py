@@ -58,6 +58,26 @@ except Exception:
 DOC_MAXIMUM_SIZE = int(os.environ.get("MAX_CONTENT_LENGTH", 128 * 1024 * 1024))
 DOC_BULK_SIZE = int(os.environ.get("DOC_BULK_SIZE", 4))
 EMBEDDING_BATCH_SIZE = int(os.environ.get("EMBEDDING_BATCH_SIZE", 16))
+PIPELINE_STREAMING = os.environ.get("PIPELINE_STREAMING", "false").lower() in ["1", "true", "yes"]
+PIPELINE_STREAM_BATCH_SIZE = int(os.environ.get("PIPELINE_STREAM_BATCH_SIZE", 64))
+PIPELINE_STREAM_BUFFER = int(os.environ.get("PIPELINE_STREAM_BUFFER", 4))
+MAX_CONCURRENT_RETRIEVALS_PER_TENANT = int(os.environ.get("MAX_CONCURRENT_RETRIEVALS_PER_TENANT", 8))
+# Have the doc store compute the cosine similarity of the retrieved chunks instead of sending their vectors back.
+# Ranks and similarity thresholds behave as with the client-side cosine.
+RETRIEVAL_STORE_SCORES = os.environ.get("RETRIEVAL_STORE_SCORES", "false").lower() in ["1", "true", "yes"]
+FILE_CACHE_DIR = os.environ.get("FILE_CACHE_DIR", os.path.join(get_project_base_directory(), "cache", "files"))
+FILE_CACHE_MAX_BYTES = int(os.environ.get("FILE_CACHE_MAX_BYTES", 2 * 1024 * 1024 * 1024))
+LLM_CACHE_ENABLED = os.environ.get("LLM_CACHE_ENABLED", "true").lower() in ["1", "true", "yes"]
+LLM_CACHE_SIZE = int(os.environ.get("LLM_CACHE_SIZE", 4096))
+LLM_CACHE_TTL = int(os.environ.get("LLM_CACHE_TTL", 24 * 3600))
+# Seconds a local cache miss waits on Redis before calling the model anyway.
+LLM_CACHE_REDIS_TIMEOUT = float(os.environ.get("LLM_CACHE_REDIS_TIMEOUT", 0.05))
+TASK_FAIR_SCHEDULING = os.environ.get("TASK_FAIR_SCHEDULING", "true").lower() in ["1", "true", "yes"]
+# "lane:weight,..." and "tenant_id:weight,..." shares of the task queue, 1 for tenants not listed.
+TASK_LANE_WEIGHTS = os.environ.get("TASK_LANE_WEIGHTS", "interactive:6,bulk:3,background:1")
+TASK_TENANT_WEIGHTS = os.environ.get("TASK_TENANT_WEIGHTS", "")
+TASK_BULK_DOCUMENTS = int(os.environ.get("TASK_BULK_DOCUMENTS", 10))
+MAX_CONCURRENT_TASKS_PER_TENANT = int(os.environ.get("MAX_CONCURRENT_TASKS_PER_TENANT", 0))
 SVR_QUEUE_NAME = "rag_flow_svr_queue"
 SVR_CONSUMER_GROUP_NAME = "rag_flow_svr_task_broker"
 PAGERANK_FLD = "pagerank_fea"
@@ -22,10 +22,10 @@ import threading
 import time
 
 from api.utils import get_uuid
-from api.utils.api_utils import timeout
+from api.utils.api_utils import timeout, timeout_stats
 from api.utils.log_utils import init_root_logger, get_project_base_directory
 from graphrag.general.index import run_graphrag
-from graphrag.utils import get_llm_cache, set_llm_cache, get_tags_from_cache, set_tags_to_cache
+from graphrag.utils import get_llm_cache, set_llm_cache, get_tags_from_cache, set_tags_to_cache, get_tags_version
 from rag.flow.pipeline import Pipeline
 from rag.prompts.generator import keyword_extraction, question_proposal, content_tagging
 
@@ -63,7 +63,10 @@ from rag.raptor import RecursiveAbstractiveProcessing4TreeOrganizedRetrieval as
 from rag.settings import DOC_MAXIMUM_SIZE, DOC_BULK_SIZE, EMBEDDING_BATCH_SIZE, SVR_CONSUMER_GROUP_NAME, get_svr_queue_name, get_svr_queue_names, print_rag_settings, TAG_FLD, PAGERANK_FLD
 from rag.utils import num_tokens_from_string, truncate
 from rag.utils.redis_conn import REDIS_CONN, RedisDistributedLock
+from rag.utils.task_scheduler import FairScheduler, is_flow_queue, lane_depths
 from rag.utils.storage_factory import STORAGE_IMPL
+from rag.utils.file_cache import FILE_CACHE
+from rag.utils.metrics import REGISTRY, TASK_STAGE_SECONDS, counter_family, gauge_family, limiter_families, serve_metrics, stats_families
 from graphrag.utils import chat_limiter
 
 BATCH_SIZE = 64
@@ -91,11 +94,13 @@ UNACKED_ITERATOR = None
 
 CONSUMER_NO = "0" if len(sys.argv) < 2 else sys.argv[1]
 CONSUMER_NAME = "task_executor_" + CONSUMER_NO
+TASK_SCHEDULER = FairScheduler(SVR_CONSUMER_GROUP_NAME, CONSUMER_NAME)
 BOOT_AT = datetime.now().astimezone().isoformat(timespec="milliseconds")
 PENDING_TASKS = 0
 LAG_TASKS = 0
 DONE_TASKS = 0
 FAILED_TASKS = 0
+LANE_DEPTHS = {}
 
 CURRENT_TASKS = {}
 
@@ -106,8 +111,17 @@ task_limiter = trio.Semaphore(MAX_CONCURRENT_TASKS)
 chunk_limiter = trio.CapacityLimiter(MAX_CONCURRENT_CHUNK_BUILDERS)
 embed_limiter = trio.CapacityLimiter(MAX_CONCURRENT_CHUNK_BUILDERS)
 minio_limiter = trio.CapacityLimiter(MAX_CONCURRENT_MINIO)
+# Chunk images: encoder threads, objects per batched upload, output format and optional cap on the longest side.
+MAX_CONCURRENT_IMAGE_ENCODERS = int(os.environ.get("MAX_CONCURRENT_IMAGE_ENCODERS", "4"))
+CHUNK_IMAGE_UPLOAD_BATCH = int(os.environ.get("CHUNK_IMAGE_UPLOAD_BATCH", "32"))
+CHUNK_IMAGE_FORMAT = os.environ.get("CHUNK_IMAGE_FORMAT", "JPEG").upper()
+CHUNK_IMAGE_MAX_SIDE = int(os.environ.get("CHUNK_IMAGE_MAX_SIDE", "0"))
+image_limiter = trio.CapacityLimiter(MAX_CONCURRENT_IMAGE_ENCODERS)
+IMAGE_STATS = {"images": 0, "uploaded": 0, "bytes": 0, "encode_seconds": 0.0, "upload_seconds": 0.0}
 kg_limiter = trio.CapacityLimiter(2)
 WORKER_HEARTBEAT_TIMEOUT = int(os.environ.get("WORKER_HEARTBEAT_TIMEOUT", "120"))
+# Base port of the /metrics endpoint, offset by the consumer number. 0 disables it.
+TASK_EXECUTOR_METRICS_PORT = int(os.environ.get("TASK_EXECUTOR_METRICS_PORT", "0"))
 stop_event = threading.Event()
 
 
@@ -198,14 +212,21 @@ async def collect():
     svr_queue_names = get_svr_queue_names()
     try:
         if not UNACKED_ITERATOR:
-            UNACKED_ITERATOR = REDIS_CONN.get_unacked_iterator(svr_queue_names, SVR_CONSUMER_GROUP_NAME, CONSUMER_NAME)
+            UNACKED_ITERATOR = REDIS_CONN.get_unacked_iterator(svr_queue_names + TASK_SCHEDULER.queue_names(), SVR_CONSUMER_GROUP_NAME, CONSUMER_NAME)
         try:
             redis_msg = next(UNACKED_ITERATOR)
+            redis_msg.delete_on_ack = is_flow_queue(redis_msg.get_queue_name())
         except StopIteration:
+            # Whatever is left in the shared queues first, then the flows in turn.
             for svr_queue_name in svr_queue_names:
                 redis_msg = REDIS_CONN.queue_consumer(svr_queue_name, SVR_CONSUMER_GROUP_NAME, CONSUMER_NAME)
                 if redis_msg:
                     break
+            else:
+                running = {}
+                for t in list(CURRENT_TASKS.values()):
+                    running[t.get("tenant_id", "")] = running.get(t.get("tenant_id", ""), 0) + 1
+                redis_msg = TASK_SCHEDULER.next(running)
     except Exception:
         logging.exception("collect got exception")
         return None, None
@@ -239,8 +260,95 @@ async def collect():
     return redis_msg, task
 
 
-async def get_storage_binary(bucket, name):
-    return await trio.to_thread.run_sync(lambda: STORAGE_IMPL.get(bucket, name))
+async def get_storage_binary(bucket, name, version=""):
+    if FILE_CACHE is None:
+        return await trio.to_thread.run_sync(lambda: STORAGE_IMPL.get(bucket, name))
+    # Page-range tasks of one document share a single download through the node-local cache.
+    return await trio.to_thread.run_sync(lambda: FILE_CACHE.get(bucket, name, lambda: STORAGE_IMPL.get(bucket, name), version))
+
+
+def encode_chunk_image(image):
+    """
+    Returns (digest of the crop, encoded bytes). Runs on a worker thread.
+    """
+    if isinstance(image, bytes):
+        return xxhash.xxh64(image).hexdigest(), image
+    digest = xxhash.xxh64(f"{image.mode}{image.size}".encode("utf-8") + image.tobytes()).hexdigest()
+    img = image
+    # If the image is in RGBA mode, convert it to RGB mode before saving it in JPEG format.
+    if img.mode in ("RGBA", "P"):
+        img = img.convert("RGB")
+    if CHUNK_IMAGE_MAX_SIDE > 0 and max(img.size) > CHUNK_IMAGE_MAX_SIDE:
+        img = img.copy() if img is image else img
+        img.thumbnail((CHUNK_IMAGE_MAX_SIDE, CHUNK_IMAGE_MAX_SIDE))
+    with BytesIO() as output_buffer:
+        try:
+            img.save(output_buffer, format=CHUNK_IMAGE_FORMAT)
+        except OSError as e:
+            logging.warning("Encoding chunk image got exception, ignore: {}".format(str(e)))
+        data = output_buffer.getvalue()
+    if img is not image:
+        img.close()
+    image.close()
+    return digest, data
+
+
+async def upload_chunk_images(task, docs):
+    """
+    Encode the chunk images on worker threads, store identical crops once and upload them in parallel batches.
+    A crop shared by several chunks is stored under a document scoped digest instead of a chunk id,
+    so deleting one of those chunks doesn't take the image away from the others.
+    """
+    with_image = []
+    for d in docs:
+        if d.get("image"):
+            with_image.append(d)
+        else:
+            d.pop("image", None)
+            d["img_id"] = ""
+    if not with_image:
+        return
+
+    st = timer()
+    # Parsers may hand the same image object to several chunks: encode (and close) each object once.
+    images = {id(d["image"]): d["image"] for d in with_image}
+    results = {}
+
+    async def encode(key, image):
+        results[key] = await trio.to_thread.run_sync(lambda: encode_chunk_image(image), limiter=image_limiter)
+
+    async with trio.open_nursery() as nursery:
+        for key, image in images.items():
+            nursery.start_soon(encode, key, image)
+    encoded = [results[id(d["image"])] for d in with_image]
+    encode_elapsed = timer() - st
+
+    groups = {}
+    for d, (digest, _) in zip(with_image, encoded):
+        groups.setdefault(digest, []).append(d)
+    objects = {}
+    for d, (digest, data) in zip(with_image, encoded):
+        name = d["id"] if len(groups[digest]) == 1 else "{}_{}".format(task["doc_id"], digest)
+        objects[name] = data
+        d["img_id"] = "{}-{}".format(task["kb_id"], name)
+        del d["image"]  # Remove image reference
+
+    st = timer()
+    items = [(task["kb_id"], name, data) for name, data in objects.items()]
+    for b in range(0, len(items), CHUNK_IMAGE_UPLOAD_BATCH):
+        async with minio_limiter:
+            await trio.to_thread.run_sync(lambda: STORAGE_IMPL.put_many(items[b : b + CHUNK_IMAGE_UPLOAD_BATCH]))
+    upload_elapsed = timer() - st
+
+    nbytes = sum(len(data) for data in objects.values())
+    IMAGE_STATS["images"] += len(with_image)
+    IMAGE_STATS["uploaded"] += len(items)
+    IMAGE_STATS["bytes"] += nbytes
+    IMAGE_STATS["encode_seconds"] += encode_elapsed
+    IMAGE_STATS["upload_seconds"] += upload_elapsed
+    logging.info(
+        "Chunk images of {}: {} images, {} unique, {} bytes, encode {:.3f}s, upload {:.3f}s".format(task["name"], len(with_image), len(items), nbytes, encode_elapsed, upload_elapsed)
+    )
 
 
 @timeout(60 * 80, 1)
@@ -253,7 +361,8 @@ async def build_chunks(task, progress_callback):
     try:
         st = timer()
         bucket, name = File2DocumentService.get_storage_address(doc_id=task["doc_id"])
-        binary = await get_storage_binary(bucket, name)
+        # Stored objects are never rewritten: a document re-uploaded, even to the same location, is another document.
+        binary = await get_storage_binary(bucket, name, f"{task['doc_id']}@{task.get('doc_create_time')}")
         logging.info("From minio({}) {}/{}".format(timer() - st, task["location"], task["name"]))
     except TimeoutError:
         progress_callback(-1, "Internal server error: Fetch file from minio timeout. Could you try it again.")
@@ -296,49 +405,19 @@ async def build_chunks(task, progress_callback):
         doc[PAGERANK_FLD] = int(task["pagerank"])
     st = timer()
 
-    @timeout(60)
-    async def upload_to_minio(document, chunk):
-        try:
-            d = copy.deepcopy(document)
-            d.update(chunk)
-            d["id"] = xxhash.xxh64((chunk["content_with_weight"] + str(d["doc_id"])).encode("utf-8", "surrogatepass")).hexdigest()
-            d["create_time"] = str(datetime.now()).replace("T", " ")[:19]
-            d["create_timestamp_flt"] = datetime.now().timestamp()
-            if not d.get("image"):
-                _ = d.pop("image", None)
-                d["img_id"] = ""
-                docs.append(d)
-                return
-
-            with BytesIO() as output_buffer:
-                if isinstance(d["image"], bytes):
-                    output_buffer.write(d["image"])
-                    output_buffer.seek(0)
-                else:
-                    # If the image is in RGBA mode, convert it to RGB mode before saving it in JPEG format.
-                    if d["image"].mode in ("RGBA", "P"):
-                        converted_image = d["image"].convert("RGB")
-                        # d["image"].close()  # Close original image
-                        d["image"] = converted_image
-                    try:
-                        d["image"].save(output_buffer, format="JPEG")
-                    except OSError as e:
-                        logging.warning("Saving image of chunk {}/{}/{} got exception, ignore: {}".format(task["location"], task["name"], d["id"], str(e)))
-
-                async with minio_limiter:
-                    await trio.to_thread.run_sync(lambda: STORAGE_IMPL.put(task["kb_id"], d["id"], output_buffer.getvalue()))
-                d["img_id"] = "{}-{}".format(task["kb_id"], d["id"])
-                if not isinstance(d["image"], bytes):
-                    d["image"].close()
-                del d["image"]  # Remove image reference
-                docs.append(d)
-        except Exception:
-            logging.exception("Saving image of chunk {}/{}/{} got exception".format(task["location"], task["name"], d["id"]))
-            raise
-
-    async with trio.open_nursery() as nursery:
-        for ck in cks:
-            nursery.start_soon(upload_to_minio, doc, ck)
+    for ck in cks:
+        d = copy.deepcopy(doc)
+        d.update(ck)
+        d["id"] = xxhash.xxh64((ck["content_with_weight"] + str(d["doc_id"])).encode("utf-8", "surrogatepass")).hexdigest()
+        d["create_time"] = str(datetime.now()).replace("T", " ")[:19]
+        d["create_timestamp_flt"] = datetime.now().timestamp()
+        d["token_num_int"] = num_tokens_from_string(ck["content_with_weight"])
+        docs.append(d)
+    try:
+        await upload_chunk_images(task, docs)
+    except Exception:
+        logging.exception("Saving images of chunks {}/{} got exception".format(task["location"], task["name"]))
+        raise
 
     el = timer() - st
     logging.info("MINIO PUT({}) cost {:.3f} s".format(task["name"], el))
@@ -392,25 +471,30 @@ async def build_chunks(task, progress_callback):
         S = 1000
         st = timer()
         examples = []
-        all_tags = get_tags_from_cache(kb_ids)
+        tags_version = get_tags_version(kb_ids)
+        all_tags = get_tags_from_cache(kb_ids, tags_version)
         if not all_tags:
             all_tags = settings.retrievaler.all_tags_in_portion(tenant_id, kb_ids, S)
-            set_tags_to_cache(kb_ids, all_tags)
+            set_tags_to_cache(kb_ids, all_tags, tags_version)
         else:
             all_tags = json.loads(all_tags)
 
         chat_mdl = LLMBundle(task["tenant_id"], LLMType.CHAT, llm_name=task["llm_id"], lang=task["language"])
 
         docs_to_tag = []
-        for d in docs:
+        TAG_BATCH_SIZE = 64
+        for b in range(0, len(docs), TAG_BATCH_SIZE):
             task_canceled = has_canceled(task["id"])
             if task_canceled:
                 progress_callback(-1, msg="Task has been canceled.")
                 return
-            if settings.retrievaler.tag_content(tenant_id, kb_ids, d, all_tags, topn_tags=topn_tags, S=S) and len(d[TAG_FLD]) > 0:
-                examples.append({"content": d["content_with_weight"], TAG_FLD: d[TAG_FLD]})
-            else:
-                docs_to_tag.append(d)
+            batch = docs[b : b + TAG_BATCH_SIZE]
+            tagged = await trio.to_thread.run_sync(lambda: settings.retrievaler.tag_contents(tenant_id, kb_ids, batch, all_tags, topn_tags=topn_tags, S=S, batch_size=TAG_BATCH_SIZE))
+            for d, ok in zip(batch, tagged):
+                if ok and len(d[TAG_FLD]) > 0:
+                    examples.append({"content": d["content_with_weight"], TAG_FLD: d[TAG_FLD]})
+                else:
+                    docs_to_tag.append(d)
 
         async def doc_content_tagging(chat_mdl, d, topn_tags):
             cached = get_llm_cache(chat_mdl.llm_name, d["content_with_weight"], all_tags, {"topn": topn_tags})
@@ -455,19 +539,19 @@ async def embedding(docs, mdl, parser_config=None, callback=None):
 
     tk_count = 0
     if len(tts) == len(cnts):
-        vts, c = await trio.to_thread.run_sync(lambda: mdl.encode(tts[0:1]))
+        vts, c = await mdl.async_encode(tts[0:1])
         tts = np.concatenate([vts for _ in range(len(tts))], axis=0)
         tk_count += c
 
     @timeout(60)
-    def batch_encode(txts):
+    async def batch_encode(txts):
         nonlocal mdl
-        return mdl.encode([truncate(c, mdl.max_length - 10) for c in txts])
+        return await mdl.async_encode([truncate(c, mdl.max_length - 10) for c in txts])
 
     cnts_ = np.array([])
     for i in range(0, len(cnts), EMBEDDING_BATCH_SIZE):
         async with embed_limiter:
-            vts, c = await trio.to_thread.run_sync(lambda: batch_encode(cnts[i : i + EMBEDDING_BATCH_SIZE]))
+            vts, c = await batch_encode(cnts[i : i + EMBEDDING_BATCH_SIZE])
         if len(cnts_) == 0:
             cnts_ = vts
         else:
@@ -530,8 +614,9 @@ async def run_raptor(row, chat_mdl, embd_mdl, vector_size, callback=None):
         d["content_with_weight"] = content
         d["content_ltks"] = rag_tokenizer.tokenize(content)
         d["content_sm_ltks"] = rag_tokenizer.fine_grained_tokenize(d["content_ltks"])
+        d["token_num_int"] = num_tokens_from_string(content)
         res.append(d)
-        tk_count += num_tokens_from_string(content)
+        tk_count += d["token_num_int"]
     return res, tk_count
 
 
@@ -588,8 +673,10 @@ async def do_handle_task(task):
         # bind LLM for raptor
         chat_model = LLMBundle(task_tenant_id, LLMType.CHAT, llm_name=task_llm_id, lang=task_language)
         # run RAPTOR
+        start_ts = timer()
         async with kg_limiter:
             chunks, token_count = await run_raptor(task, chat_model, embedding_model, vector_size, progress_callback)
+        TASK_STAGE_SECONDS.observe(timer() - start_ts, stage="raptor")
     # Either using graphrag or Standard chunking methods
     elif task_type == "graphrag":
         if not task_parser_config.get("graphrag", {}).get("use_graphrag", False):
@@ -602,12 +689,14 @@ async def do_handle_task(task):
         with_community = graphrag_conf.get("community", False)
         async with kg_limiter:
             await run_graphrag(task, task_language, with_resolution, with_community, chat_model, embedding_model, progress_callback)
+        TASK_STAGE_SECONDS.observe(timer() - start_ts, stage="graphrag")
         progress_callback(prog=1.0, msg="Knowledge Graph done ({:.2f}s)".format(timer() - start_ts))
         return
     else:
         # Standard chunking methods
         start_ts = timer()
         chunks = await build_chunks(task, progress_callback)
+        TASK_STAGE_SECONDS.observe(timer() - start_ts, stage="chunk")
         logging.info("Build document {}: {:.2f}s".format(task_document_name, timer() - start_ts))
         if not chunks:
             progress_callback(1.0, msg=f"No chunk built from {task_document_name}")
@@ -624,6 +713,7 @@ async def do_handle_task(task):
             logging.exception(error_message)
             token_count = 0
             raise
+        TASK_STAGE_SECONDS.observe(timer() - start_ts, stage="embed")
         progress_message = "Embedding chunks ({:.2f}s)".format(timer() - start_ts)
         logging.info(progress_message)
         progress_callback(msg=progress_message)
@@ -671,6 +761,8 @@ async def do_handle_task(task):
 
     time_cost = timer() - start_ts
     task_time_cost = timer() - task_start_ts
+    TASK_STAGE_SECONDS.observe(time_cost, stage="index")
+    TASK_STAGE_SECONDS.observe(task_time_cost, stage="total")
     progress_callback(prog=1.0, msg="Indexing done ({:.2f}s). Task done ({:.2f}s)".format(time_cost, task_time_cost))
     logging.info("Chunk doc({}), page({}-{}), chunks({}), token({}), elapsed:{:.2f}".format(task_document_name, task_from_page, task_to_page, len(chunks), token_count, task_time_cost))
 
@@ -703,8 +795,29 @@ async def handle_task():
     redis_msg.ack()
 
 
+def executor_metrics():
+    return [
+        gauge_family("ragflow_task_slots_in_use", "Tasks being collected or handled by this executor.", [({}, MAX_CONCURRENT_TASKS - task_limiter.value)]),
+        gauge_family("ragflow_task_slots", "MAX_CONCURRENT_TASKS of this executor.", [({}, MAX_CONCURRENT_TASKS)]),
+        gauge_family("ragflow_task_current", "Tasks being handled by this executor.", [({}, len(CURRENT_TASKS))]),
+        gauge_family("ragflow_task_queue_pending", "Delivered but unacknowledged tasks of the consumer group.", [({}, PENDING_TASKS)]),
+        gauge_family("ragflow_task_queue_lag", "Tasks of the queue not delivered yet to the consumer group.", [({}, LAG_TASKS)]),
+        counter_family("ragflow_task_done_total", "Tasks handled by this executor.", [({}, DONE_TASKS)]),
+        counter_family("ragflow_task_failed_total", "Tasks failed on this executor.", [({}, FAILED_TASKS)]),
+        *[
+            gauge_family(f"ragflow_task_lane_{field}", f"{doc} of the lane, as of the last status report.", [({"lane": lane}, st[field]) for lane, st in LANE_DEPTHS.items()])
+            for field, doc in [("tasks", "Tasks queued or in progress"), ("flows", "Knowledge bases with tasks"), ("tenants", "Tenants with tasks")]
+        ],
+        *limiter_families({"chunk": chunk_limiter, "embed": embed_limiter, "minio": minio_limiter, "image": image_limiter, "kg": kg_limiter, "chat": chat_limiter}),
+        *stats_families("ragflow_chunk_images", "Chunk images encoded and uploaded", IMAGE_STATS),
+    ]
+
+
+REGISTRY.register_collector(executor_metrics)
+
+
 async def report_status():
-    global CONSUMER_NAME, BOOT_AT, PENDING_TASKS, LAG_TASKS, DONE_TASKS, FAILED_TASKS
+    global CONSUMER_NAME, BOOT_AT, PENDING_TASKS, LAG_TASKS, DONE_TASKS, FAILED_TASKS, LANE_DEPTHS
     REDIS_CONN.sadd("TASKEXE", CONSUMER_NAME)
     redis_lock = RedisDistributedLock("clean_task_executor", lock_value=CONSUMER_NAME, timeout=60)
     while True:
@@ -714,6 +827,7 @@ async def report_status():
             if group_info is not None:
                 PENDING_TASKS = int(group_info.get("pending", 0))
                 LAG_TASKS = int(group_info.get("lag", 0))
+            LANE_DEPTHS = lane_depths()
 
             current = copy.deepcopy(CURRENT_TASKS)
             heartbeat = json.dumps(
@@ -725,7 +839,10 @@ async def report_status():
                     "lag": LAG_TASKS,
                     "done": DONE_TASKS,
                     "failed": FAILED_TASKS,
+                    "lanes": LANE_DEPTHS,
                     "current": current,
+                    "timeouts": timeout_stats(),
+                    "images": IMAGE_STATS,
                 }
             )
             REDIS_CONN.zadd(CONSUMER_NAME, heartbeat, now.timestamp())
@@ -782,6 +899,8 @@ async def main():
 
     signal.signal(signal.SIGINT, signal_handler)
     signal.signal(signal.SIGTERM, signal_handler)
+    if TASK_EXECUTOR_METRICS_PORT > 0 and CONSUMER_NO.isdigit():
+        serve_metrics(TASK_EXECUTOR_METRICS_PORT + int(CONSUMER_NO))
 
     async with trio.open_nursery() as nursery:
         nursery.start_soon(report_status)
@@ -16,10 +16,14 @@
 
 import os
 import re
+import threading
 
 import tiktoken
+import xxhash
+from cachetools import LRUCache
 
 from api.utils.file_utils import get_project_base_directory
+from rag.utils.metrics import CACHE_REQUESTS
 
 
 def singleton(cls, *args, **kw):
@@ -89,6 +93,29 @@ def num_tokens_from_string(string: str) -> int:
         return 0
 
 
+TOKEN_COUNT_CACHE_SIZE = int(os.environ.get("TOKEN_COUNT_CACHE_SIZE", 100000))
+_token_count_cache = LRUCache(maxsize=TOKEN_COUNT_CACHE_SIZE)
+_token_count_lock = threading.Lock()
+
+
+def cached_num_tokens(string: str) -> int:
+    """
+    `num_tokens_from_string` memoized by a digest of the text, for texts counted over and over
+    such as retrieved chunks and conversation history.
+    """
+    if not string:
+        return 0
+    key = xxhash.xxh64_intdigest(string.encode("utf-8", "surrogatepass"))
+    with _token_count_lock:
+        cnt = _token_count_cache.get(key)
+    CACHE_REQUESTS.inc(cache="token_count", result="miss" if cnt is None else "hit")
+    if cnt is None:
+        cnt = num_tokens_from_string(string)
+        with _token_count_lock:
+            _token_count_cache[key] = cnt
+    return cnt
+
+
 def total_token_count_from_response(resp):
     if hasattr(resp, "usage") and hasattr(resp.usage, "total_tokens"):
         try:
@@ -20,11 +20,12 @@ import time
 from io import BytesIO
 from rag import settings
 from rag.utils import singleton
+from rag.utils.storage_stream import StreamingStorage
 from azure.storage.blob import ContainerClient
 
 
 @singleton
-class RAGFlowAzureSasBlob:
+class RAGFlowAzureSasBlob(StreamingStorage):
     def __init__(self):
         self.conn = None
         self.container_url = os.getenv("CONTAINER_URL", settings.AZURE["container_url"])
@@ -60,6 +61,10 @@ class RAGFlowAzureSasBlob:
                 self.__open__()
                 time.sleep(1)
 
+    def put_stream(self, bucket, fnm, stream, length=-1):
+        # upload_blob stages blocks concurrently for large or unsized streams.
+        return self.conn.upload_blob(name=fnm, data=stream, length=None if length < 0 else length)
+
     def rm(self, bucket, fnm):
         try:
             self.conn.delete_blob(fnm)
@@ -77,6 +82,12 @@ class RAGFlowAzureSasBlob:
                 time.sleep(1)
         return
 
+    def get_range(self, bucket, fnm, offset, length):
+        try:
+            return self.conn.download_blob(fnm, offset=offset, length=length).read()
+        except Exception:
+            logging.exception(f"fail get {bucket}/{fnm} [{offset}:{offset + length}]")
+
     def obj_exist(self, bucket, fnm):
         try:
             return self.conn.get_blob_client(fnm).exists()
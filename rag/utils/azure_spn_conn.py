@@ -19,12 +19,13 @@ import os
 import time
 from rag import settings
 from rag.utils import singleton
+from rag.utils.storage_stream import StreamingStorage
 from azure.identity import ClientSecretCredential, AzureAuthorityHosts
 from azure.storage.filedatalake import FileSystemClient
 
 
 @singleton
-class RAGFlowAzureSpnBlob:
+class RAGFlowAzureSpnBlob(StreamingStorage):
     def __init__(self):
         self.conn = None
         self.account_url = os.getenv("ACCOUNT_URL", settings.AZURE["account_url"])
@@ -68,6 +69,9 @@ class RAGFlowAzureSpnBlob:
                 self.__open__()
                 time.sleep(1)
 
+    def put_stream(self, bucket, fnm, stream, length=-1):
+        return self.conn.get_file_client(fnm).upload_data(stream, length=None if length < 0 else length, overwrite=True)
+
     def rm(self, bucket, fnm):
         try:
             self.conn.delete_file(fnm)
@@ -86,6 +90,12 @@ class RAGFlowAzureSpnBlob:
                 time.sleep(1)
         return
 
+    def get_range(self, bucket, fnm, offset, length):
+        try:
+            return self.conn.get_file_client(fnm).download_file(offset=offset, length=length).read()
+        except Exception:
+            logging.exception(f"fail get {bucket}/{fnm} [{offset}:{offset + length}]")
+
     def obj_exist(self, bucket, fnm):
         try:
             client = self.conn.get_file_client(fnm)
@@ -214,6 +214,20 @@ class DocStoreConnection(ABC):
         """
         raise NotImplementedError("Not implemented")
 
+    def msearch(self, searches: list[dict]) -> list:
+        """
+        Run a batch of searches, each given as the keyword arguments of `search`, and return their results in order.
+        Backends override this to send the whole batch in one round trip or concurrently.
+        """
+        return [self.search(**kwargs) for kwargs in searches]
+
+    def vectorSimilarity(self, chunkIds: list[str], matchDense: MatchDenseExpr, indexNames: str | list[str], knowledgebaseIds: list[str]) -> dict[str, float]:
+        """
+        Cosine similarity between the query vector of `matchDense` and the vectors of just the given chunks,
+        computed in the store so that the vectors are not sent back.
+        """
+        raise NotImplementedError("Not implemented")
+
     @abstractmethod
     def get(self, chunkId: str, indexName: str, knowledgebaseIds: list[str]) -> dict | None:
         """
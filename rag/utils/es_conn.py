@@ -136,7 +136,7 @@ class ESConnection(DocStoreConnection):
     CRUD operations
     """
 
-    def search(
+    def _search_body(
         self,
         selectFields: list[str],
         highlightFields: list[str],
@@ -150,9 +150,6 @@ class ESConnection(DocStoreConnection):
         aggFields: list[str] = [],
         rank_feature: dict | None = None,
     ):
-        """
-        Refers to https://www.elastic.co/guide/en/elasticsearch/reference/current/query-dsl.html
-        """
         if isinstance(indexNames, str):
             indexNames = indexNames.split(",")
         assert isinstance(indexNames, list) and len(indexNames) > 0
@@ -169,6 +166,9 @@ class ESConnection(DocStoreConnection):
                 continue
             if not v:
                 continue
+            if k == "id":
+                bqry.filter.append(Q("ids", values=v if isinstance(v, list) else [v]))
+                continue
             if isinstance(v, list):
                 bqry.filter.append(Q("terms", **{k: v}))
             elif isinstance(v, str) or isinstance(v, int):
@@ -237,6 +237,27 @@ class ESConnection(DocStoreConnection):
         q = s.to_dict()
         logger.debug(f"ESConnection.search {str(indexNames)} query: " + json.dumps(q))
 
+        return indexNames, q
+
+    def search(
+        self,
+        selectFields: list[str],
+        highlightFields: list[str],
+        condition: dict,
+        matchExprs: list[MatchExpr],
+        orderBy: OrderByExpr,
+        offset: int,
+        limit: int,
+        indexNames: str | list[str],
+        knowledgebaseIds: list[str],
+        aggFields: list[str] = [],
+        rank_feature: dict | None = None,
+    ):
+        """
+        Refers to https://www.elastic.co/guide/en/elasticsearch/reference/current/query-dsl.html
+        """
+        indexNames, q = self._search_body(selectFields, highlightFields, condition, matchExprs, orderBy, offset, limit, indexNames, knowledgebaseIds, aggFields, rank_feature)
+
         for i in range(ATTEMPT_TIME):
             try:
                 # print(json.dumps(q, ensure_ascii=False))
@@ -263,6 +284,67 @@ class ESConnection(DocStoreConnection):
         logger.error(f"ESConnection.search timeout for {ATTEMPT_TIME} times!")
         raise Exception("ESConnection.search timeout.")
 
+    def msearch(self, searches: list[dict]) -> list:
+        """
+        Send a batch of searches in one `_msearch` request.
+        """
+        if not searches:
+            return []
+        body = []
+        for kwargs in searches:
+            indexNames, q = self._search_body(**kwargs)
+            q["track_total_hits"] = True
+            body.append({"index": ",".join(indexNames)})
+            body.append(q)
+
+        for i in range(ATTEMPT_TIME):
+            try:
+                res = self.es.msearch(body=body, max_concurrent_searches=len(searches))
+                results = []
+                for r in res["responses"]:
+                    if "error" in r:
+                        logger.warning(f"ESConnection.msearch sub-search failed: {r['error']}")
+                        r = {"hits": {"total": {"value": 0}, "hits": []}}
+                    results.append(r)
+                return results
+            except ConnectionTimeout:
+                logger.exception("ES request timeout")
+                self._connect()
+                continue
+            except Exception as e:
+                logger.exception(f"ESConnection.msearch {len(searches)} searches: " + str(e))
+                raise e
+
+        logger.error(f"ESConnection.msearch timeout for {ATTEMPT_TIME} times!")
+        raise Exception("ESConnection.msearch timeout.")
+
+    def vectorSimilarity(self, chunkIds: list[str], matchDense: MatchDenseExpr, indexNames: str | list[str], knowledgebaseIds: list[str]) -> dict[str, float]:
+        if not chunkIds:
+            return {}
+        if isinstance(indexNames, str):
+            indexNames = indexNames.split(",")
+        bqry = Q("bool", filter=[Q("ids", values=chunkIds), Q("terms", kb_id=knowledgebaseIds), Q("exists", field=matchDense.vector_column_name)])
+        q = {
+            # Exact cosine over the given chunks only. Script scores can't be negative, hence the shift by one.
+            "query": {"script_score": {"query": bqry.to_dict(), "script": {"source": "cosineSimilarity(params.query_vector, params.field) + 1.0", "params": {"field": matchDense.vector_column_name, "query_vector": list(matchDense.embedding_data)}}}},
+            "size": len(chunkIds),
+            "_source": False,
+        }
+        for i in range(ATTEMPT_TIME):
+            try:
+                res = self.es.search(index=indexNames, body=q, timeout="600s")
+                return {d["_id"]: d["_score"] - 1.0 for d in res["hits"]["hits"]}
+            except ConnectionTimeout:
+                logger.exception("ES request timeout")
+                self._connect()
+                continue
+            except Exception as e:
+                logger.exception(f"ESConnection.vectorSimilarity {str(indexNames)}: " + str(e))
+                raise e
+
+        logger.error(f"ESConnection.vectorSimilarity timeout for {ATTEMPT_TIME} times!")
+        raise Exception("ESConnection.vectorSimilarity timeout.")
+
     def get(self, chunkId: str, indexName: str, knowledgebaseIds: list[str]) -> dict | None:
         for i in range(ATTEMPT_TIME):
             try:
@@ -0,0 +1,148 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from typing import Callable
+
+try:
+    import fcntl
+except ImportError:  # Not on POSIX: no cross process locking, concurrent misses just fetch twice.
+    fcntl = None
+
+from rag.settings import FILE_CACHE_DIR, FILE_CACHE_MAX_BYTES
+from rag.utils.metrics import CACHE_REQUESTS
+
+
+class _FileLock:
+    def __init__(self, path: str):
+        self.path = path
+        self.fd = None
+
+    def __enter__(self):
+        self.fd = os.open(self.path, os.O_CREAT | os.O_RDWR, 0o644)
+        if fcntl:
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if fcntl:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+        os.close(self.fd)
+
+
+class LocalFileCache:
+    """
+    Read-through cache of object storage blobs on local disk, shared by every task executor process of a node.
+    Entries are addressed by a digest of (bucket, name, version) and evicted least recently used first
+    (by mtime, refreshed on every hit) once the directory grows past `max_bytes`, down to `EVICT_RATIO` of it.
+    """
+
+    EVICT_RATIO = 0.9
+
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(self.root, exist_ok=True)
+        self._evict_lock = threading.Lock()
+        # Bytes in the directory as of the last scan, plus those this process stored since.
+        self._total = None
+
+    def _path(self, bucket: str, name: str, version: str) -> str:
+        digest = hashlib.sha256(f"{bucket}/{name}@{version}".encode("utf-8")).hexdigest()
+        return os.path.join(self.root, digest[:2], digest)
+
+    @staticmethod
+    def _read(path: str) -> bytes | None:
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)
+            return data
+        except FileNotFoundError:
+            return None
+
+    def get(self, bucket: str, name: str, fetch: Callable[[], bytes], version: str = "") -> bytes:
+        path = self._path(bucket, name, version)
+        data = self._read(path)
+        CACHE_REQUESTS.inc(cache="file", result="miss" if data is None else "hit")
+        if data is not None:
+            return data
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Only one process fetches a given object, the others wait and read the file it leaves.
+        # Locks are striped by the subdirectory of the entry, a fixed set of files rather than one per entry.
+        with _FileLock(os.path.join(os.path.dirname(path), ".lock")):
+            data = self._read(path)
+            if data is not None:
+                return data
+            data = fetch()
+            if data is None or len(data) > self.max_bytes:
+                return data
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(data)
+                os.replace(tmp, path)
+            except Exception:
+                logging.exception(f"LocalFileCache failed to store {bucket}/{name}")
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+                return data
+        self._evict(len(data))
+        return data
+
+    def _scan(self) -> tuple[list[tuple[float, int, str]], int]:
+        entries = []
+        total = 0
+        for dirpath, _, filenames in os.walk(self.root):
+            for fnm in filenames:
+                if fnm.startswith(".") or fnm.endswith(".lock") or fnm.startswith("tmp"):
+                    continue
+                fpath = os.path.join(dirpath, fnm)
+                try:
+                    st = os.stat(fpath)
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, fpath))
+                total += st.st_size
+        return entries, total
+
+    def _evict(self, stored: int):
+        with self._evict_lock:
+            # The directory is only walked when the count says it is full, or on the first store of this process.
+            if self._total is not None:
+                self._total += stored
+                if self._total <= self.max_bytes:
+                    return
+            with _FileLock(os.path.join(self.root, ".evict.lock")):
+                entries, total = self._scan()
+                if total > self.max_bytes:
+                    entries.sort()
+                    for _, size, fpath in entries:
+                        if total <= self.max_bytes * self.EVICT_RATIO:
+                            break
+                        try:
+                            os.remove(fpath)
+                            total -= size
+                        except FileNotFoundError:
+                            pass
+                self._total = total
+
+
+FILE_CACHE = LocalFileCache(FILE_CACHE_DIR, FILE_CACHE_MAX_BYTES) if FILE_CACHE_MAX_BYTES > 0 else None
@@ -0,0 +1,140 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import http.cookiejar
+import logging
+import os
+import random
+import threading
+from urllib.parse import urlsplit
+
+import httpx
+import requests
+import trio
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+LLM_HTTP_POOL_SIZE = int(os.environ.get("LLM_HTTP_POOL_SIZE", 32))
+LLM_HTTP_MAX_RETRIES = int(os.environ.get("LLM_HTTP_MAX_RETRIES", 3))
+LLM_HTTP_BACKOFF = float(os.environ.get("LLM_HTTP_BACKOFF", 0.5))
+LLM_HTTP_TIMEOUT = float(os.environ.get("LLM_HTTP_TIMEOUT", 600))
+LLM_HTTP_KEEPALIVE = float(os.environ.get("LLM_HTTP_KEEPALIVE", 60))
+LLM_HTTP2 = os.environ.get("LLM_HTTP2", "1").lower() in ["1", "true", "yes"]
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+try:
+    import h2  # noqa: F401
+
+    _HTTP2_AVAILABLE = True
+except ImportError:  # httpx only speaks HTTP/2 with the h2 extra installed.
+    _HTTP2_AVAILABLE = False
+
+_lock = threading.Lock()
+_sessions: dict[tuple, requests.Session] = {}
+_async_clients: dict[tuple, httpx.AsyncClient] = {}
+
+
+def _origin(url: str) -> str:
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def _retry() -> Retry:
+    kwargs = dict(
+        total=LLM_HTTP_MAX_RETRIES,
+        backoff_factor=LLM_HTTP_BACKOFF,
+        status_forcelist=RETRY_STATUS,
+        allowed_methods=None,
+        raise_on_status=False,
+        respect_retry_after_header=True,
+    )
+    try:
+        return Retry(backoff_jitter=LLM_HTTP_BACKOFF, **kwargs)
+    except TypeError:  # urllib3 < 2 has no jitter.
+        return Retry(**kwargs)
+
+
+def _no_cookies() -> http.cookiejar.CookiePolicy:
+    # Sessions are shared by every tenant and API key of a provider, so none may carry cookies set for another.
+    return http.cookiejar.DefaultCookiePolicy(allowed_domains=[])
+
+
+def get_session(url: str) -> requests.Session:
+    """
+    The keep-alive session shared by every provider talking to the origin of `url` in this process.
+    """
+    key = (os.getpid(), _origin(url))
+    session = _sessions.get(key)
+    if session is not None:
+        return session
+    with _lock:
+        session = _sessions.get(key)
+        if session is None:
+            session = requests.Session()
+            session.cookies.set_policy(_no_cookies())
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=LLM_HTTP_POOL_SIZE, max_retries=_retry())
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _sessions[key] = session
+    return session
+
+
+def http_post(url: str, **kwargs) -> requests.Response:
+    """
+    Drop-in for `requests.post` over the pooled session of the url's origin.
+    """
+    kwargs.setdefault("timeout", LLM_HTTP_TIMEOUT)
+    return get_session(url).post(url, **kwargs)
+
+
+def get_async_client(url: str) -> httpx.AsyncClient:
+    """
+    The pooled async client of the origin of `url`, HTTP/2 when the h2 package is installed.
+    Clients hold connections of the event loop that first used them, so they are meant for the long-lived trio loop
+    of the task executor.
+    """
+    key = (os.getpid(), _origin(url))
+    client = _async_clients.get(key)
+    if client is None:
+        transport = httpx.AsyncHTTPTransport(
+            http2=LLM_HTTP2 and _HTTP2_AVAILABLE,
+            limits=httpx.Limits(
+                max_connections=LLM_HTTP_POOL_SIZE,
+                max_keepalive_connections=LLM_HTTP_POOL_SIZE,
+                keepalive_expiry=LLM_HTTP_KEEPALIVE,
+            ),
+        )
+        client = httpx.AsyncClient(transport=transport, timeout=LLM_HTTP_TIMEOUT)
+        client.cookies.jar.set_policy(_no_cookies())
+        _async_clients[key] = client
+    return client
+
+
+async def async_http_post(url: str, **kwargs) -> httpx.Response:
+    """
+    POST over the pooled async client, retrying throttled and failed responses with jittered exponential backoff.
+    """
+    client = get_async_client(url)
+    for attempt in range(LLM_HTTP_MAX_RETRIES + 1):
+        try:
+            response = await client.post(url, **kwargs)
+            if response.status_code not in RETRY_STATUS or attempt == LLM_HTTP_MAX_RETRIES:
+                return response
+            logging.warning(f"POST {url} got {response.status_code}, retrying")
+        except httpx.TransportError:
+            if attempt == LLM_HTTP_MAX_RETRIES:
+                raise
+            logging.warning(f"POST {url} failed, retrying", exc_info=True)
+        await trio.sleep(LLM_HTTP_BACKOFF * (2**attempt) * random.uniform(0.5, 1.5))
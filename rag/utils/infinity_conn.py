@@ -20,6 +20,9 @@ import re
 import json
 import time
 import copy
+import heapq
+import itertools
+from concurrent.futures import ThreadPoolExecutor
 import infinity
 from infinity.common import ConflictType, InfinityException, SortType
 from infinity.index import IndexInfo, IndexType
@@ -43,6 +46,9 @@ from rag.utils.doc_store_conn import (
 
 logger = logging.getLogger("ragflow.infinity_conn")
 
+# Max number of tables queried concurrently by `InfinityConnection.search`.
+SEARCH_FANOUT = int(os.environ.get("INFINITY_SEARCH_FANOUT", 8))
+
 
 def field_keyword(field_name: str):
     # The "docnm_kwd" field is always a string, not list.
@@ -127,6 +133,39 @@ def concat_dataframes(df_list: list[pd.DataFrame], selectFields: list[str]) -> p
     return pd.DataFrame(columns=schema)
 
 
+def merge_sorted_dataframes(df_list: list[pd.DataFrame], selectFields: list[str], sortFields: list[tuple[str, bool]], limit: int) -> pd.DataFrame:
+    """
+    K-way merge of per-table results which are each already sorted by `sortFields` ((column, descending) pairs).
+    Stops as soon as `limit` rows are taken instead of concatenating and re-sorting everything.
+    """
+    df_list = [df.reset_index(drop=True) for df in df_list if not df.empty]
+    if not df_list:
+        return concat_dataframes(df_list, selectFields)
+    if any(c not in df.columns for df in df_list for c, _ in sortFields):
+        return concat_dataframes(df_list, selectFields)
+    if len(df_list) == 1:
+        return df_list[0].head(limit)
+    if any(not pd.api.types.is_numeric_dtype(df[c]) for df in df_list for c, _ in sortFields):
+        res = pd.concat(df_list, axis=0).reset_index(drop=True)
+        res = res.sort_values(by=[c for c, _ in sortFields], ascending=[not desc for _, desc in sortFields])
+        return res.head(limit).reset_index(drop=True)
+
+    def rows(t, df):
+        cols = [df[c].fillna(0).tolist() for c, _ in sortFields]
+        for i in range(len(df)):
+            yield tuple(-col[i] if desc else col[i] for col, (_, desc) in zip(cols, sortFields)), t, i
+
+    picked = {}
+    for pos, (_, t, i) in enumerate(itertools.islice(heapq.merge(*[rows(t, df) for t, df in enumerate(df_list)]), limit)):
+        picked.setdefault(t, []).append((pos, i))
+    parts = []
+    for t, items in picked.items():
+        part = df_list[t].iloc[[i for _, i in items]].copy()
+        part["_merge_pos"] = [pos for pos, _ in items]
+        parts.append(part)
+    return pd.concat(parts, axis=0).sort_values(by="_merge_pos").drop(columns=["_merge_pos"]).reset_index(drop=True)
+
+
 @singleton
 class InfinityConnection(DocStoreConnection):
     def __init__(self):
@@ -157,6 +196,9 @@ class InfinityConnection(DocStoreConnection):
             msg = f"Infinity {infinity_uri} is unhealthy in 120s."
             logger.error(msg)
             raise Exception(msg)
+        self.searchExecutor = ThreadPoolExecutor(max_workers=SEARCH_FANOUT, thread_name_prefix="infinity_search")
+        # Separate pool: each batched search fans out on searchExecutor and must not wait behind its own batch.
+        self.msearchExecutor = ThreadPoolExecutor(max_workers=SEARCH_FANOUT, thread_name_prefix="infinity_msearch")
         logger.info(f"Infinity {infinity_uri} is healthy.")
 
     def _migrate_db(self, inf_conn):
@@ -347,6 +389,7 @@ class InfinityConnection(DocStoreConnection):
                     break
             if not table_found:
                 logger.error(f"No valid tables found for indexNames {indexNames} and knowledgebaseIds {knowledgebaseIds}")
+                self.connPool.release_conn(inf_conn)
                 return pd.DataFrame(), 0
 
         for matchExpr in matchExprs:
@@ -399,58 +442,98 @@ class InfinityConnection(DocStoreConnection):
                 else:
                     order_by_expr_list.append((order_field[0], SortType.Desc))
 
-        total_hits_count = 0
-        # Scatter search tables and gather the results
-        for indexName in indexNames:
-            for knowledgebaseId in knowledgebaseIds:
-                table_name = f"{indexName}_{knowledgebaseId}"
-                try:
-                    table_instance = db_instance.get_table(table_name)
-                except Exception:
-                    continue
-                table_list.append(table_name)
-                builder = table_instance.output(output)
-                if len(matchExprs) > 0:
-                    for matchExpr in matchExprs:
-                        if isinstance(matchExpr, MatchTextExpr):
-                            fields = ",".join(matchExpr.fields)
-                            builder = builder.match_text(
-                                fields,
-                                matchExpr.matching_text,
-                                matchExpr.topn,
-                                matchExpr.extra_options.copy(),
-                            )
-                        elif isinstance(matchExpr, MatchDenseExpr):
-                            builder = builder.match_dense(
-                                matchExpr.vector_column_name,
-                                matchExpr.embedding_data,
-                                matchExpr.embedding_data_type,
-                                matchExpr.distance_type,
-                                matchExpr.topn,
-                                matchExpr.extra_options.copy(),
-                            )
-                        elif isinstance(matchExpr, FusionExpr):
-                            builder = builder.fusion(matchExpr.method, matchExpr.topn, matchExpr.fusion_params)
-                else:
-                    if filter_cond and len(filter_cond) > 0:
-                        builder.filter(filter_cond)
-                if orderBy.fields:
-                    builder.sort(order_by_expr_list)
-                builder.offset(offset).limit(limit)
-                kb_res, extra_result = builder.option({"total_hits_count": True}).to_df()
-                if extra_result:
-                    total_hits_count += int(extra_result["total_hits_count"])
-                logger.debug(f"INFINITY search table: {str(table_name)}, result: {str(kb_res)}")
-                df_list.append(kb_res)
         self.connPool.release_conn(inf_conn)
-        res = concat_dataframes(df_list, output)
+
+        # Scatter search tables concurrently, each on its own pooled connection, and gather the results
+        table_names = [f"{indexName}_{knowledgebaseId}" for indexName in indexNames for knowledgebaseId in knowledgebaseIds]
+        args = (output, matchExprs, filter_cond, order_by_expr_list, offset, limit)
+        if len(table_names) == 1:
+            results = [self._search_table(table_names[0], *args)]
+        else:
+            results = list(self.searchExecutor.map(lambda tbl: self._search_table(tbl, *args), table_names))
+
+        total_hits_count = 0
+        for table_name, (kb_res, hits) in zip(table_names, results):
+            if kb_res is None:
+                continue
+            table_list.append(table_name)
+            total_hits_count += hits
+            df_list.append(kb_res)
+
         if matchExprs:
-            res["Sum"] = res[score_column] + res[PAGERANK_FLD]
-            res = res.sort_values(by="Sum", ascending=False).reset_index(drop=True).drop(columns=["Sum"])
-            res = res.head(limit)
+            for i, df in enumerate(df_list):
+                df["Sum"] = df[score_column] + df[PAGERANK_FLD]
+                df_list[i] = df.sort_values(by="Sum", ascending=False)
+            res = merge_sorted_dataframes(df_list, output, [("Sum", True)], limit)
+            if "Sum" in res.columns:
+                res = res.drop(columns=["Sum"])
+            if "_score" in selectFields and score_column in res.columns:
+                res["_score"] = res[score_column]
+        elif orderBy.fields:
+            res = merge_sorted_dataframes(df_list, output, [(f, d == 1) for f, d in orderBy.fields], limit)
+        else:
+            res = concat_dataframes(df_list, output)
         logger.debug(f"INFINITY search final result: {str(res)}")
         return res, total_hits_count
 
+    def msearch(self, searches: list[dict]) -> list:
+        """
+        Infinity has no multi-search endpoint, run the batch concurrently on pooled connections instead.
+        """
+        if len(searches) <= 1:
+            return [self.search(**kwargs) for kwargs in searches]
+        return list(self.msearchExecutor.map(lambda kwargs: self.search(**kwargs), searches))
+
+    def _search_table(self, table_name: str, output: list[str], matchExprs: list[MatchExpr], filter_cond: str | None, order_by_expr_list: list, offset: int, limit: int) -> tuple[pd.DataFrame | None, int]:
+        inf_conn = self.connPool.get_conn()
+        try:
+            db_instance = inf_conn.get_database(self.dbName)
+            try:
+                table_instance = db_instance.get_table(table_name)
+            except Exception:
+                return None, 0
+            builder = table_instance.output(output)
+            if len(matchExprs) > 0:
+                for matchExpr in matchExprs:
+                    if isinstance(matchExpr, MatchTextExpr):
+                        fields = ",".join(matchExpr.fields)
+                        builder = builder.match_text(
+                            fields,
+                            matchExpr.matching_text,
+                            matchExpr.topn,
+                            matchExpr.extra_options.copy(),
+                        )
+                    elif isinstance(matchExpr, MatchDenseExpr):
+                        builder = builder.match_dense(
+                            matchExpr.vector_column_name,
+                            matchExpr.embedding_data,
+                            matchExpr.embedding_data_type,
+                            matchExpr.distance_type,
+                            matchExpr.topn,
+                            matchExpr.extra_options.copy(),
+                        )
+                    elif isinstance(matchExpr, FusionExpr):
+                        builder = builder.fusion(matchExpr.method, matchExpr.topn, matchExpr.fusion_params)
+            else:
+                if filter_cond and len(filter_cond) > 0:
+                    builder.filter(filter_cond)
+            if order_by_expr_list:
+                builder.sort(order_by_expr_list)
+            builder.offset(offset).limit(limit)
+            kb_res, extra_result = builder.option({"total_hits_count": True}).to_df()
+            logger.debug(f"INFINITY search table: {str(table_name)}, result: {str(kb_res)}")
+            return kb_res, int(extra_result["total_hits_count"]) if extra_result else 0
+        finally:
+            self.connPool.release_conn(inf_conn)
+
+    def vectorSimilarity(self, chunkIds: list[str], matchDense: MatchDenseExpr, indexNames: str | list[str], knowledgebaseIds: list[str]) -> dict[str, float]:
+        if not chunkIds:
+            return {}
+        # A dense match alone scores by similarity(), the cosine for the "cosine" distance the chunks are indexed with.
+        matchDense = MatchDenseExpr(matchDense.vector_column_name, matchDense.embedding_data, matchDense.embedding_data_type, matchDense.distance_type, len(chunkIds), {})
+        res = self.search(["_score"], [], {"id": chunkIds}, [matchDense], OrderByExpr(), 0, len(chunkIds), indexNames, knowledgebaseIds)
+        return {chunk_id: float(fields["_score"]) for chunk_id, fields in self.getFields(res, ["_score"]).items() if fields.get("_score") is not None}
+
     def get(self, chunkId: str, indexName: str, knowledgebaseIds: list[str]) -> dict | None:
         inf_conn = self.connPool.get_conn()
         db_instance = inf_conn.get_database(self.dbName)
@@ -0,0 +1,124 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import base64
+import json
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+import xxhash
+
+from rag.settings import LLM_CACHE_ENABLED, LLM_CACHE_REDIS_TIMEOUT, LLM_CACHE_SIZE, LLM_CACHE_TTL
+from rag.utils.metrics import CACHE_REQUESTS
+from rag.utils.redis_conn import REDIS_CONN
+
+_COMPRESS_THRESHOLD = 1024
+
+
+class LLMCallCache:
+    """
+    Two level cache of LLM responses: a bounded in-process LRU with TTL in front of Redis.
+    Redis writes are done by a background thread so callers never wait on them, and a lookup waits on Redis
+    for LLM_CACHE_REDIS_TIMEOUT at most: a late answer only fills the local cache for the next call.
+    """
+
+    def __init__(self, capacity: int = LLM_CACHE_SIZE, ttl: int = LLM_CACHE_TTL):
+        self._capacity = capacity
+        self._ttl = ttl
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="llm_cache")
+        self._reader = ThreadPoolExecutor(max_workers=4, thread_name_prefix="llm_cache_get")
+        self.hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(llm_name: str, system: str, history: list, gen_conf: dict, **kwargs) -> str:
+        hasher = xxhash.xxh64()
+        hasher.update(json.dumps([llm_name, system, history, gen_conf, kwargs], sort_keys=True, ensure_ascii=False, default=str).encode("utf-8"))
+        return "llm_call:" + hasher.hexdigest()
+
+    @staticmethod
+    def _encode(value: str) -> str:
+        if len(value) < _COMPRESS_THRESHOLD:
+            return "s:" + value
+        return "z:" + base64.b64encode(zlib.compress(value.encode("utf-8"))).decode("ascii")
+
+    @staticmethod
+    def _decode(value: str) -> str | None:
+        if value.startswith("s:"):
+            return value[2:]
+        if value.startswith("z:"):
+            return zlib.decompress(base64.b64decode(value[2:])).decode("utf-8")
+        return None
+
+    def _put_local(self, key: str, value: str):
+        with self._lock:
+            self._local[key] = (time.time() + self._ttl, value)
+            self._local.move_to_end(key)
+            while len(self._local) > self._capacity:
+                self._local.popitem(last=False)
+
+    def get(self, key: str) -> str | None:
+        with self._lock:
+            item = self._local.get(key)
+            if item and item[0] > time.time():
+                self._local.move_to_end(key)
+                self.hits += 1
+                CACHE_REQUESTS.inc(cache="llm_call", result="hit")
+                return item[1]
+            if item:
+                del self._local[key]
+
+        future = self._reader.submit(self._get_redis, key)
+        try:
+            value = future.result(timeout=LLM_CACHE_REDIS_TIMEOUT)
+        except FutureTimeoutError:
+            value = None
+        if value is None:
+            self.misses += 1
+            CACHE_REQUESTS.inc(cache="llm_call", result="miss")
+            return None
+        self.redis_hits += 1
+        CACHE_REQUESTS.inc(cache="llm_call", result="redis_hit")
+        return value
+
+    def _get_redis(self, key: str) -> str | None:
+        bin = REDIS_CONN.get(key)
+        value = self._decode(bin) if bin else None
+        if value is not None:
+            self._put_local(key, value)
+        return value
+
+    def set(self, key: str, value: str):
+        self._put_local(key, value)
+        self._writer.submit(REDIS_CONN.set, key, self._encode(value), self._ttl)
+
+    def stats(self) -> dict:
+        total = self.hits + self.redis_hits + self.misses
+        return {
+            "size": len(self._local),
+            "hits": self.hits,
+            "redis_hits": self.redis_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.redis_hits) / total if total else 0.0,
+        }
+
+
+LLM_CALL_CACHE = LLMCallCache() if LLM_CACHE_ENABLED else None
@@ -0,0 +1,345 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import copy
+import logging
+import re
+import threading
+from collections import Counter
+
+import numpy as np
+
+from rag.settings import PAGERANK_FLD, TAG_FLD
+from rag.utils import get_float
+from rag.utils.doc_store_conn import DocStoreConnection, FusionExpr, MatchDenseExpr, MatchExpr, MatchTextExpr, OrderByExpr
+
+logger = logging.getLogger("ragflow.memory_conn")
+
+
+class MemoryConnection(DocStoreConnection):
+    """
+    In-process doc store keeping every chunk in a dict, for benchmarks and offline runs without a doc engine.
+    Full-text matching is a weighted term overlap over the `MatchTextExpr` fields and dense matching a brute-force
+    cosine, so scores follow the same shape as Elasticsearch's but not its values. Results use the Elasticsearch
+    response layout.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        # index name -> chunk id -> chunk
+        self._indices: dict[str, dict[str, dict]] = {}
+
+    """
+    Database operations
+    """
+
+    def dbType(self) -> str:
+        return "memory"
+
+    def health(self) -> dict:
+        with self._lock:
+            return {"type": "memory", "status": "green", "indices": len(self._indices), "chunks": sum(len(idx) for idx in self._indices.values())}
+
+    """
+    Table operations
+    """
+
+    def createIdx(self, indexName: str, knowledgebaseId: str, vectorSize: int):
+        with self._lock:
+            self._indices.setdefault(indexName, {})
+        return True
+
+    def deleteIdx(self, indexName: str, knowledgebaseId: str):
+        with self._lock:
+            if not knowledgebaseId:
+                self._indices.pop(indexName, None)
+                return
+            idx = self._indices.get(indexName, {})
+            for chunk_id in [i for i, ck in idx.items() if ck.get("kb_id") == knowledgebaseId]:
+                del idx[chunk_id]
+
+    def indexExist(self, indexName: str, knowledgebaseId: str) -> bool:
+        with self._lock:
+            return indexName in self._indices
+
+    """
+    CRUD operations
+    """
+
+    @staticmethod
+    def _match_condition(chunk: dict, condition: dict) -> bool:
+        for k, v in condition.items():
+            if k == "available_int":
+                if (int(chunk.get(k, 1)) < 1) != (v == 0):
+                    return False
+                continue
+            if k == "exists":
+                if chunk.get(v) is None:
+                    return False
+                continue
+            if k == "must_not":
+                if isinstance(v, dict) and any(chunk.get(vv) is not None for kk, vv in v.items() if kk == "exists"):
+                    return False
+                continue
+            if not v:
+                continue
+            values = v if isinstance(v, list) else [v]
+            field = chunk.get(k)
+            if isinstance(field, list):
+                if not set(values) & set(field):
+                    return False
+            elif field not in values:
+                return False
+        return True
+
+    @staticmethod
+    def _query_terms(matching_text: str) -> dict[str, float]:
+        terms = {}
+        for tk, w in re.findall(r"([^\s()\"^]+)(?:\^([0-9.]+))?", matching_text):
+            if tk in ("OR", "AND", "NOT"):
+                continue
+            terms[tk] = max(terms.get(tk, 0.0), get_float(w) if w else 1.0)
+        return terms
+
+    @staticmethod
+    def _field_tokens(chunk: dict, field: str) -> set:
+        v = chunk.get(field)
+        if isinstance(v, list):
+            return set(tk for s in v for tk in str(s).split())
+        return set(str(v).split()) if v else set()
+
+    def _text_scores(self, chunks: list[dict], m: MatchTextExpr) -> np.ndarray:
+        terms = self._query_terms(m.matching_text)
+        total = sum(terms.values())
+        fields = []
+        for f in m.fields:
+            name, _, boost = f.partition("^")
+            fields.append((name, get_float(boost) if boost else 1.0))
+        top_boost = max([b for _, b in fields] or [1.0])
+        minimum_should_match = m.extra_options.get("minimum_should_match", 0.0)
+        if isinstance(minimum_should_match, str):
+            minimum_should_match = get_float(minimum_should_match.rstrip("%")) / 100
+        # An int is a number of terms, a float a share of them.
+        min_matched = minimum_should_match if isinstance(minimum_should_match, int) else minimum_should_match * len(terms)
+
+        scores = np.zeros(len(chunks))
+        if not total:
+            return scores
+        for i, chunk in enumerate(chunks):
+            tokens = [(self._field_tokens(chunk, name), boost) for name, boost in fields]
+            matched, score = 0, 0.0
+            for tk, w in terms.items():
+                boost = max([b for tks, b in tokens if tk in tks] or [0.0])
+                if boost:
+                    matched += 1
+                    score += w * boost
+            if matched and matched >= min_matched:
+                scores[i] = score / (total * top_boost)
+        return scores
+
+    @staticmethod
+    def _dense_scores(chunks: list[dict], m: MatchDenseExpr) -> np.ndarray:
+        q = np.array(m.embedding_data, dtype=np.float32)
+        q /= np.linalg.norm(q) or 1.0
+        scores = np.zeros(len(chunks))
+        for i, chunk in enumerate(chunks):
+            v = chunk.get(m.vector_column_name)
+            if v is None:
+                continue
+            v = np.array(v, dtype=np.float32)
+            scores[i] = float(np.dot(q, v) / (np.linalg.norm(v) or 1.0))
+        return scores
+
+    def _search(self, condition: dict, matchExprs: list[MatchExpr], orderBy: OrderByExpr, indexNames: list[str], knowledgebaseIds: list[str], rank_feature: dict | None):
+        condition = dict(condition)
+        condition["kb_id"] = knowledgebaseIds
+        with self._lock:
+            chunks = [ck for nm in indexNames for ck in self._indices.get(nm, {}).values() if self._match_condition(ck, condition)]
+
+        text, dense, fusion = None, None, None
+        for m in matchExprs:
+            if isinstance(m, MatchTextExpr):
+                text = m
+            elif isinstance(m, MatchDenseExpr):
+                dense = m
+            elif isinstance(m, FusionExpr):
+                fusion = m
+        if text is None and dense is None:
+            if orderBy and orderBy.fields:
+                for field, order in reversed(orderBy.fields):
+                    chunks.sort(key=lambda ck: get_float(ck.get(field, 0)) if field.endswith(("_int", "_flt")) else str(ck.get(field, "")), reverse=order == 1)
+            return chunks, np.ones(len(chunks))
+
+        vector_similarity_weight = 0.5
+        if fusion and fusion.fusion_params and "weights" in fusion.fusion_params:
+            vector_similarity_weight = get_float(fusion.fusion_params["weights"].split(",")[1])
+        scores = np.zeros(len(chunks))
+        keep = np.zeros(len(chunks), dtype=bool)
+        if text is not None:
+            tscores = self._text_scores(chunks, text)
+            keep |= tscores > 0
+            scores += tscores * (1.0 - vector_similarity_weight if dense is not None else 1.0)
+        if dense is not None:
+            dscores = self._dense_scores(chunks, dense)
+            knn = dscores >= get_float(dense.extra_options.get("similarity", 0.0))
+            # Like the kNN clause, only the `topn` nearest chunks take part.
+            if dense.topn and knn.sum() > dense.topn:
+                knn &= dscores >= np.sort(dscores)[-dense.topn]
+            keep |= knn
+            scores += np.where(knn, dscores, 0.0) * vector_similarity_weight
+        if rank_feature:
+            for fld, sc in rank_feature.items():
+                for i, chunk in enumerate(chunks):
+                    tags = chunk.get(TAG_FLD)
+                    v = chunk.get(fld) if fld == PAGERANK_FLD else tags.get(fld) if isinstance(tags, dict) else None
+                    if v:
+                        scores[i] += get_float(v) * sc / 100.0
+        order = [i for i in np.argsort(-scores, kind="stable") if keep[i]]
+        return [chunks[i] for i in order], scores[order]
+
+    def search(
+        self,
+        selectFields: list[str],
+        highlightFields: list[str],
+        condition: dict,
+        matchExprs: list[MatchExpr],
+        orderBy: OrderByExpr,
+        offset: int,
+        limit: int,
+        indexNames: str | list[str],
+        knowledgebaseIds: list[str],
+        aggFields: list[str] = [],
+        rank_feature: dict | None = None,
+    ):
+        if isinstance(indexNames, str):
+            indexNames = indexNames.split(",")
+        chunks, scores = self._search(condition, matchExprs, orderBy, indexNames, knowledgebaseIds, rank_feature)
+
+        aggregations = {}
+        for fld in set(aggFields) | {"docnm_kwd"}:
+            cnt = Counter()
+            for ck in chunks:
+                v = ck.get(fld)
+                for vv in v if isinstance(v, list) else [v]:
+                    if vv is not None:
+                        cnt[vv] += 1
+            aggregations[f"aggs_{fld}"] = {"buckets": [{"key": k, "doc_count": n} for k, n in cnt.most_common()]}
+
+        page = range(offset, offset + limit) if limit > 0 else range(0)
+        hits = []
+        for i in page:
+            if i >= len(chunks):
+                break
+            source = {k: v for k, v in chunks[i].items() if k != "id" and (not selectFields or k in selectFields)}
+            hits.append({"_id": chunks[i]["id"], "_score": float(scores[i]), "_source": copy.deepcopy(source)})
+        return {"hits": {"total": {"value": len(chunks)}, "hits": hits}, "aggregations": aggregations}
+
+    def vectorSimilarity(self, chunkIds: list[str], matchDense: MatchDenseExpr, indexNames: str | list[str], knowledgebaseIds: list[str]) -> dict[str, float]:
+        if isinstance(indexNames, str):
+            indexNames = indexNames.split(",")
+        with self._lock:
+            chunks = [ck for nm in indexNames for ck in self._indices.get(nm, {}).values() if ck["id"] in chunkIds and ck.get("kb_id") in knowledgebaseIds and ck.get(matchDense.vector_column_name) is not None]
+        return dict(zip([ck["id"] for ck in chunks], self._dense_scores(chunks, matchDense).tolist()))
+
+    def get(self, chunkId: str, indexName: str, knowledgebaseIds: list[str]) -> dict | None:
+        with self._lock:
+            chunk = self._indices.get(indexName, {}).get(chunkId)
+            if chunk is None or (knowledgebaseIds and chunk.get("kb_id") not in knowledgebaseIds):
+                return None
+            return copy.deepcopy(chunk)
+
+    def insert(self, rows: list[dict], indexName: str, knowledgebaseId: str = None) -> list[str]:
+        with self._lock:
+            idx = self._indices.setdefault(indexName, {})
+            for d in rows:
+                assert "id" in d
+                d = copy.deepcopy(d)
+                d["kb_id"] = knowledgebaseId
+                idx[d["id"]] = d
+        return []
+
+    def update(self, condition: dict, newValue: dict, indexName: str, knowledgebaseId: str) -> bool:
+        condition = dict(condition)
+        condition["kb_id"] = knowledgebaseId
+        with self._lock:
+            for chunk in self._indices.get(indexName, {}).values():
+                if not self._match_condition(chunk, condition):
+                    continue
+                for k, v in newValue.items():
+                    if k == "id":
+                        continue
+                    if k == "remove":
+                        if isinstance(v, str):
+                            chunk.pop(v, None)
+                        elif isinstance(v, dict):
+                            for kk, vv in v.items():
+                                if vv in chunk.get(kk, []):
+                                    chunk[kk].remove(vv)
+                        continue
+                    if k == "add":
+                        for kk, vv in v.items():
+                            chunk.setdefault(kk, []).append(vv.strip())
+                        continue
+                    chunk[k] = copy.deepcopy(v)
+        return True
+
+    def delete(self, condition: dict, indexName: str, knowledgebaseId: str) -> int:
+        condition = dict(condition)
+        condition["kb_id"] = knowledgebaseId
+        with self._lock:
+            idx = self._indices.get(indexName, {})
+            chunk_ids = [i for i, ck in idx.items() if self._match_condition(ck, condition)]
+            for chunk_id in chunk_ids:
+                del idx[chunk_id]
+        return len(chunk_ids)
+
+    """
+    Helper functions for search result
+    """
+
+    def getTotal(self, res):
+        return res["hits"]["total"]["value"]
+
+    def getChunkIds(self, res):
+        return [d["_id"] for d in res["hits"]["hits"]]
+
+    def getFields(self, res, fields: list[str]) -> dict[str, dict]:
+        res_fields = {}
+        if not fields:
+            return {}
+        for d in res["hits"]["hits"]:
+            m = {n: d["_source"].get(n) for n in fields if d["_source"].get(n) is not None}
+            if "_score" in fields:
+                m["_score"] = d["_score"]
+            if m:
+                res_fields[d["_id"]] = m
+        return res_fields
+
+    def getHighlight(self, res, keywords: list[str], fieldnm: str):
+        return {}
+
+    def getAggregation(self, res, fieldnm: str):
+        agg_field = "aggs_" + fieldnm
+        if agg_field not in res.get("aggregations", {}):
+            return list()
+        return [(b["key"], b["doc_count"]) for b in res["aggregations"][agg_field]["buckets"]]
+
+    """
+    SQL
+    """
+
+    def sql(self, sql: str, fetch_size: int, format: str):
+        logger.warning("MemoryConnection doesn't support SQL")
+        return None
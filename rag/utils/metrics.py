@@ -0,0 +1,321 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+"""
+Process-local metrics rendered in the Prometheus text exposition format.
+
+Hot paths update counters and histograms in place; gauges of state owned elsewhere (limiters, queues, caches)
+are read by collectors only when the metrics are scraped.
+"""
+
+import logging
+import os
+import threading
+from bisect import bisect_left
+from collections.abc import Callable, Iterable
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from timeit import default_timer as timer
+
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "1").lower() in ["1", "true", "yes"]
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# A sample: its labels and value. A family: name, type, help and samples.
+Sample = tuple[dict, float]
+Family = tuple[str, str, str, list[Sample]]
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics: dict[str, "_Metric"] = {}
+        self._collectors: list[Callable[[], Iterable[Family]]] = []
+
+    def register(self, metric: "_Metric"):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+
+    def register_collector(self, collector: Callable[[], Iterable[Family]]):
+        """
+        `collector` is called at every scrape and returns the families of gauges and counters it reads.
+        """
+        with self._lock:
+            self._collectors.append(collector)
+
+    def collect(self) -> list[Family]:
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors)
+        families = [m.collect() for m in metrics]
+        for collector in collectors:
+            try:
+                families.extend(collector())
+            except Exception:
+                logging.exception(f"Metrics collector {getattr(collector, '__qualname__', collector)} failed")
+        return families
+
+    def render(self) -> str:
+        """
+        Every series is labelled with the pid: each process keeps its own registry, and pre-forked HTTP workers
+        have to be scraped one by one.
+        """
+        lines = []
+        pid = str(os.getpid())
+        for name, type_, documentation, samples in self.collect():
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} {type_}")
+            for labels, value in samples:
+                # Histogram series carry their suffix in a reserved label.
+                labels = {"pid": pid, **labels}
+                suffix = labels.pop("__suffix__", "")
+                lines.append(f"{name}{suffix}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (), registry: Registry = REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        registry.register(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def _labels(self, key: tuple) -> dict:
+        return dict(zip(self.labelnames, key))
+
+    def collect(self) -> Family:
+        raise NotImplementedError("Not implemented")
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def collect(self) -> Family:
+        with self._lock:
+            samples = [(self._labels(k), v) for k, v in self._values.items()]
+        return self.name, self.type, self.documentation, samples
+
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def collect(self) -> Family:
+        with self._lock:
+            samples = [(self._labels(k), v) for k, v in self._values.items()]
+        return self.name, self.type, self.documentation, samples
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (), buckets: Iterable[float] = DEFAULT_BUCKETS, registry: Registry = REGISTRY):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            st = self._values.get(key)
+            if st is None:
+                # Per bucket counts (the last one for +Inf), sum and count.
+                st = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            st[0][i] += 1
+            st[1] += value
+            st[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        st = timer()
+        try:
+            yield
+        finally:
+            self.observe(timer() - st, **labels)
+
+    def collect(self) -> Family:
+        with self._lock:
+            values = [(k, list(st[0]), st[1], st[2]) for k, st in self._values.items()]
+        samples = []
+        for key, counts, total, count in values:
+            labels = self._labels(key)
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                samples.append(({**labels, "le": _format_value(bound), "__suffix__": "_bucket"}, cumulative))
+            samples.append(({**labels, "__suffix__": "_sum"}, total))
+            samples.append(({**labels, "__suffix__": "_count"}, count))
+        return self.name, self.type, self.documentation, samples
+
+
+CHAT_SECONDS = Histogram("ragflow_chat_seconds", "Phases of a chat answered by the chat service.", ["phase"])
+RETRIEVAL_SECONDS = Histogram("ragflow_retrieval_seconds", "Latency of Dealer.retrieval, search plus rerank.")
+DOC_STORE_SECONDS = Histogram("ragflow_doc_store_seconds", "Latency of doc store calls.", ["engine", "op"])
+EMBEDDING_SECONDS = Histogram("ragflow_embedding_seconds", "Latency of embedding model calls.", ["op"])
+RERANK_SECONDS = Histogram("ragflow_rerank_seconds", "Latency of rerank model calls.")
+LLM_SECONDS = Histogram("ragflow_llm_seconds", "Latency of whole chat model calls.", ["op"])
+LLM_FIRST_TOKEN_SECONDS = Histogram("ragflow_llm_first_token_seconds", "Time to the first streamed piece of a chat model answer.")
+OCR_SECONDS = Histogram("ragflow_ocr_seconds", "Latency of OCR on one page image.", ["op"])
+TASK_STAGE_SECONDS = Histogram("ragflow_task_stage_seconds", "Time of the stages of a document parsing task.", ["stage"], buckets=DEFAULT_BUCKETS + (600.0, 1800.0, 3600.0))
+CACHE_REQUESTS = Counter("ragflow_cache_requests_total", "Lookups of the in-process and Redis caches.", ["cache", "result"])
+SPECULATIVE_RETRIEVALS = Counter("ragflow_speculative_refine_total", "Speculative retrievals on the raw question, by whether the refined question kept them.", ["result"])
+
+
+def gauge_family(name: str, documentation: str, samples: list[Sample]) -> Family:
+    return name, "gauge", documentation, samples
+
+
+def counter_family(name: str, documentation: str, samples: list[Sample]) -> Family:
+    return name, "counter", documentation, samples
+
+
+def limiter_families(limiters: dict) -> list[Family]:
+    """
+    Occupancy of trio `CapacityLimiter`s by name.
+    """
+    borrowed, total, waiting = [], [], []
+    for name, limiter in limiters.items():
+        st = limiter.statistics()
+        borrowed.append(({"limiter": name}, st.borrowed_tokens))
+        total.append(({"limiter": name}, st.total_tokens))
+        waiting.append(({"limiter": name}, st.tasks_waiting))
+    return [
+        gauge_family("ragflow_limiter_borrowed", "Tokens of the limiter in use.", borrowed),
+        gauge_family("ragflow_limiter_capacity", "Total tokens of the limiter.", total),
+        gauge_family("ragflow_limiter_waiting", "Tasks waiting for the limiter.", waiting),
+    ]
+
+
+def stats_families(prefix: str, documentation: str, stats: dict, labelnames: Iterable[str] = ()) -> list[Family]:
+    """
+    Families of a dict of running totals, or of such dicts nested under one key per label in `labelnames`,
+    e.g. `timeout_stats()` with ("operation",). `max_*` fields are exported as gauges, the others as counters.
+    """
+    labelnames = tuple(labelnames)
+    rows = [({}, stats)]
+    for name in labelnames:
+        rows = [({**labels, name: k}, v) for labels, st in rows for k, v in st.items()]
+    series = {}
+    for labels, st in rows:
+        for field, value in st.items():
+            if isinstance(value, (int, float)):
+                series.setdefault(field, []).append((labels, value))
+    families = []
+    for field, samples in series.items():
+        if field.startswith("max_"):
+            families.append(gauge_family(f"{prefix}_{field}", f"{documentation} ({field}).", samples))
+        else:
+            families.append(counter_family(f"{prefix}_{field}_total", f"{documentation} ({field}).", samples))
+    return families
+
+
+class TimedDocStoreConnection:
+    """
+    Delegates to a `DocStoreConnection`, observing the latency of its calls that reach the engine.
+    """
+
+    TIMED = {"search", "msearch", "get", "insert", "update", "delete", "createIdx", "deleteIdx", "indexExist", "sql"}
+
+    def __init__(self, conn):
+        self._conn = conn
+        self._engine = conn.dbType()
+
+    def __getattr__(self, name):
+        attr = getattr(self._conn, name)
+        if name not in self.TIMED or not callable(attr):
+            return attr
+
+        def timed(*args, **kwargs):
+            with DOC_STORE_SECONDS.time(engine=self._engine, op=name):
+                return attr(*args, **kwargs)
+
+        return timed
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_metrics(port: int, host: str = "0.0.0.0") -> ThreadingHTTPServer | None:
+    """
+    Serve `/metrics` on a daemon thread, for processes without an HTTP server of their own.
+    """
+    if not METRICS_ENABLED or port <= 0:
+        return None
+    try:
+        server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    except OSError as e:
+        logging.warning(f"Can't serve metrics on {host}:{port}: {e}")
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    logging.info(f"Serving metrics on {host}:{port}/metrics")
+    return server
@@ -21,12 +21,15 @@ from minio.error import S3Error
 from io import BytesIO
 from rag import settings
 from rag.utils import singleton
+from rag.utils.storage_stream import StreamingStorage, STORAGE_MULTIPART_SIZE
 
 
 @singleton
-class RAGFlowMinio:
+class RAGFlowMinio(StreamingStorage):
     def __init__(self):
         self.conn = None
+        # Buckets known to exist, so a put doesn't cost an extra bucket_exists round trip.
+        self._buckets = set()
         self.__open__()
 
     def __open__(self):
@@ -52,19 +55,30 @@ class RAGFlowMinio:
         r = self.conn.put_object(bucket, fnm, BytesIO(binary), len(binary))
         return r
 
+    def _ensure_bucket(self, bucket):
+        if bucket in self._buckets:
+            return
+        if not self.conn.bucket_exists(bucket):
+            self.conn.make_bucket(bucket)
+        self._buckets.add(bucket)
+
     def put(self, bucket, fnm, binary):
         for _ in range(3):
             try:
-                if not self.conn.bucket_exists(bucket):
-                    self.conn.make_bucket(bucket)
-
+                self._ensure_bucket(bucket)
                 r = self.conn.put_object(bucket, fnm, BytesIO(binary), len(binary))
                 return r
             except Exception:
                 logging.exception(f"Fail to put {bucket}/{fnm}:")
+                self._buckets.discard(bucket)
                 self.__open__()
                 time.sleep(1)
 
+    def put_stream(self, bucket, fnm, stream, length=-1):
+        # An unknown length is uploaded as multipart, part by part, without buffering the whole object.
+        self._ensure_bucket(bucket)
+        return self.conn.put_object(bucket, fnm, stream, length, part_size=STORAGE_MULTIPART_SIZE if length < 0 else 0)
+
     def rm(self, bucket, fnm):
         try:
             self.conn.remove_object(bucket, fnm)
@@ -75,13 +89,35 @@ class RAGFlowMinio:
         for _ in range(1):
             try:
                 r = self.conn.get_object(bucket, filename)
-                return r.read()
+                try:
+                    return r.read()
+                finally:
+                    # Hand the connection back to the pool for reuse.
+                    r.close()
+                    r.release_conn()
             except Exception:
                 logging.exception(f"Fail to get {bucket}/{filename}")
                 self.__open__()
                 time.sleep(1)
         return
 
+    def get_stream(self, bucket, filename):
+        try:
+            return self.conn.get_object(bucket, filename)
+        except Exception:
+            logging.exception(f"Fail to get {bucket}/{filename}")
+
+    def get_range(self, bucket, filename, offset, length):
+        try:
+            r = self.conn.get_object(bucket, filename, offset=offset, length=length)
+            try:
+                return r.read()
+            finally:
+                r.close()
+                r.release_conn()
+        except Exception:
+            logging.exception(f"Fail to get {bucket}/{filename} [{offset}:{offset + length}]")
+
     def obj_exist(self, bucket, filename):
         try:
             if not self.conn.bucket_exists(bucket):
@@ -127,5 +163,6 @@ class RAGFlowMinio:
                 for obj in objects_to_delete:
                     self.conn.remove_object(bucket, obj.object_name)
                 self.conn.remove_bucket(bucket)
+            self._buckets.discard(bucket)
         except Exception:
             logging.exception(f"Fail to remove bucket {bucket}")
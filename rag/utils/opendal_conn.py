@@ -5,6 +5,7 @@ from urllib.parse import quote_plus
 
 from api.utils.configs import get_base_config
 from rag.utils import singleton
+from rag.utils.storage_stream import StreamingStorage
 
 
 CREATE_TABLE_SQL = """
@@ -49,7 +50,7 @@ def get_opendal_config():
 
 
 @singleton
-class OpenDALStorage:
+class OpenDALStorage(StreamingStorage):
     def __init__(self):
         self._kwargs = get_opendal_config()
         self._scheme = self._kwargs.get("scheme", "mysql")
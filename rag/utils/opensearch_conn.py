@@ -126,7 +126,7 @@ class OSConnection(DocStoreConnection):
     CRUD operations
     """
 
-    def search(
+    def _search_body(
         self,
         selectFields: list[str],
         highlightFields: list[str],
@@ -140,9 +140,6 @@ class OSConnection(DocStoreConnection):
         aggFields: list[str] = [],
         rank_feature: dict | None = None,
     ):
-        """
-        Refers to https://github.com/opensearch-project/opensearch-py/blob/main/guides/dsl.md
-        """
         use_knn = False
         if isinstance(indexNames, str):
             indexNames = indexNames.split(",")
@@ -160,6 +157,9 @@ class OSConnection(DocStoreConnection):
                 continue
             if not v:
                 continue
+            if k == "id":
+                bqry.filter.append(Q("ids", values=v if isinstance(v, list) else [v]))
+                continue
             if isinstance(v, list):
                 bqry.filter.append(Q("terms", **{k: v}))
             elif isinstance(v, str) or isinstance(v, int):
@@ -236,6 +236,27 @@ class OSConnection(DocStoreConnection):
             del q["query"]
             q["query"] = {"knn": knn_query}
 
+        return indexNames, q
+
+    def search(
+        self,
+        selectFields: list[str],
+        highlightFields: list[str],
+        condition: dict,
+        matchExprs: list[MatchExpr],
+        orderBy: OrderByExpr,
+        offset: int,
+        limit: int,
+        indexNames: str | list[str],
+        knowledgebaseIds: list[str],
+        aggFields: list[str] = [],
+        rank_feature: dict | None = None,
+    ):
+        """
+        Refers to https://github.com/opensearch-project/opensearch-py/blob/main/guides/dsl.md
+        """
+        indexNames, q = self._search_body(selectFields, highlightFields, condition, matchExprs, orderBy, offset, limit, indexNames, knowledgebaseIds, aggFields, rank_feature)
+
         for i in range(ATTEMPT_TIME):
             try:
                 res = self.os.search(
@@ -258,6 +279,62 @@ class OSConnection(DocStoreConnection):
         logger.error(f"OSConnection.search timeout for {ATTEMPT_TIME} times!")
         raise Exception("OSConnection.search timeout.")
 
+    def msearch(self, searches: list[dict]) -> list:
+        """
+        Send a batch of searches in one msearch request.
+        """
+        if not searches:
+            return []
+        body = []
+        for kwargs in searches:
+            indexNames, q = self._search_body(**kwargs)
+            q["track_total_hits"] = True
+            body.append({"index": ",".join(indexNames)})
+            body.append(q)
+
+        for i in range(ATTEMPT_TIME):
+            try:
+                res = self.os.msearch(body=body, max_concurrent_searches=len(searches))
+                results = []
+                for r in res["responses"]:
+                    if "error" in r:
+                        logger.warning(f"OSConnection.msearch sub-search failed: {r['error']}")
+                        r = {"hits": {"total": {"value": 0}, "hits": []}}
+                    results.append(r)
+                return results
+            except Exception as e:
+                logger.exception(f"OSConnection.msearch {len(searches)} searches")
+                if str(e).find("Timeout") > 0:
+                    continue
+                raise e
+        logger.error(f"OSConnection.msearch timeout for {ATTEMPT_TIME} times!")
+        raise Exception("OSConnection.msearch timeout.")
+
+    def vectorSimilarity(self, chunkIds: list[str], matchDense: MatchDenseExpr, indexNames: str | list[str], knowledgebaseIds: list[str]) -> dict[str, float]:
+        if not chunkIds:
+            return {}
+        if isinstance(indexNames, str):
+            indexNames = indexNames.split(",")
+        bqry = Q("bool", filter=[Q("ids", values=chunkIds), Q("terms", kb_id=knowledgebaseIds), Q("exists", field=matchDense.vector_column_name)])
+        q = {
+            # Exact cosine over the given chunks only. Script scores can't be negative, hence the shift by one.
+            "query": {"script_score": {"query": bqry.to_dict(), "script": {"source": "cosineSimilarity(params.query_value, doc[params.field]) + 1.0", "params": {"field": matchDense.vector_column_name, "query_value": list(matchDense.embedding_data)}}}},
+            "size": len(chunkIds),
+            "_source": False,
+        }
+        for i in range(ATTEMPT_TIME):
+            try:
+                res = self.os.search(index=indexNames, body=q, timeout=600)
+                return {d["_id"]: d["_score"] - 1.0 for d in res["hits"]["hits"]}
+            except Exception as e:
+                logger.exception(f"OSConnection.vectorSimilarity {str(indexNames)}")
+                if str(e).find("Timeout") > 0:
+                    continue
+                raise e
+
+        logger.error(f"OSConnection.vectorSimilarity timeout for {ATTEMPT_TIME} times!")
+        raise Exception("OSConnection.vectorSimilarity timeout.")
+
     def get(self, chunkId: str, indexName: str, knowledgebaseIds: list[str]) -> dict | None:
         for i in range(ATTEMPT_TIME):
             try:
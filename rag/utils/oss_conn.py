@@ -20,13 +20,16 @@ from botocore.config import Config
 import time
 from io import BytesIO
 from rag.utils import singleton
+from rag.utils.storage_stream import StreamingStorage
 from rag import settings
 
 
 @singleton
-class RAGFlowOSS:
+class RAGFlowOSS(StreamingStorage):
     def __init__(self):
         self.conn = None
+        # Buckets known to exist, so a put doesn't cost an extra head_bucket round trip.
+        self._buckets = set()
         self.oss_config = settings.OSS
         self.access_key = self.oss_config.get("access_key", None)
         self.secret_key = self.oss_config.get("secret_key", None)
@@ -112,17 +115,31 @@ class RAGFlowOSS:
         logging.debug(f"bucket name {bucket}; filename :{fnm}:")
         for _ in range(1):
             try:
-                if not self.bucket_exists(bucket):
-                    self.conn.create_bucket(Bucket=bucket)
-                    logging.info(f"create bucket {bucket} ********")
+                self._ensure_bucket(bucket)
                 r = self.conn.upload_fileobj(BytesIO(binary), bucket, fnm)
 
                 return r
             except Exception:
                 logging.exception(f"Fail put {bucket}/{fnm}")
+                self._buckets.discard(bucket)
                 self.__open__()
                 time.sleep(1)
 
+    def _ensure_bucket(self, bucket):
+        if bucket in self._buckets:
+            return
+        if not self.bucket_exists(bucket):
+            self.conn.create_bucket(Bucket=bucket)
+            logging.info(f"create bucket {bucket} ********")
+        self._buckets.add(bucket)
+
+    @use_prefix_path
+    @use_default_bucket
+    def put_stream(self, bucket, fnm, stream, length=-1):
+        # upload_fileobj switches to a multipart upload for large objects by itself.
+        self._ensure_bucket(bucket)
+        return self.conn.upload_fileobj(stream, bucket, fnm)
+
     @use_prefix_path
     @use_default_bucket
     def rm(self, bucket, fnm):
@@ -145,6 +162,22 @@ class RAGFlowOSS:
                 time.sleep(1)
         return
 
+    @use_prefix_path
+    @use_default_bucket
+    def get_stream(self, bucket, fnm):
+        try:
+            return self.conn.get_object(Bucket=bucket, Key=fnm)["Body"]
+        except Exception:
+            logging.exception(f"fail get {bucket}/{fnm}")
+
+    @use_prefix_path
+    @use_default_bucket
+    def get_range(self, bucket, fnm, offset, length):
+        try:
+            return self.conn.get_object(Bucket=bucket, Key=fnm, Range=f"bytes={offset}-{offset + length - 1}")["Body"].read()
+        except Exception:
+            logging.exception(f"fail get {bucket}/{fnm} [{offset}:{offset + length}]")
+
     @use_prefix_path
     @use_default_bucket
     def obj_exist(self, bucket, fnm):
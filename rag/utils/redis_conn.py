@@ -32,10 +32,14 @@ class RedisMsg:
         self.__group_name = group_name
         self.__msg_id = msg_id
         self.__message = json.loads(message["message"])
+        # Entries of per flow queues are deleted once acknowledged, so that a drained queue is empty.
+        self.delete_on_ack = False
 
     def ack(self):
         try:
             self.__consumer.xack(self.__queue_name, self.__group_name, self.__msg_id)
+            if self.delete_on_ack:
+                self.__consumer.xdel(self.__queue_name, self.__msg_id)
             return True
         except Exception as e:
             logging.warning("[EXCEPTION]ack" + str(self.__queue_name) + "||" + str(e))
@@ -47,6 +51,9 @@ class RedisMsg:
     def get_msg_id(self):
         return self.__msg_id
 
+    def get_queue_name(self):
+        return self.__queue_name
+
 
 @singleton
 class RedisDB:
@@ -59,6 +66,15 @@ class RedisDB:
         end
         return 0
     """
+    lua_drop_queue_if_empty = None
+    LUA_DROP_QUEUE_IF_EMPTY_SCRIPT = """
+        if redis.call('exists', KEYS[1]) == 0 or redis.call('xlen', KEYS[1]) == 0 then
+            redis.call('del', KEYS[1])
+            redis.call('srem', KEYS[2], ARGV[1])
+            return 1
+        end
+        return 0
+    """
 
     def __init__(self):
         self.REDIS = None
@@ -69,6 +85,7 @@ class RedisDB:
         cls = self.__class__
         client = self.REDIS
         cls.lua_delete_if_equal = client.register_script(cls.LUA_DELETE_IF_EQUAL_SCRIPT)
+        cls.lua_drop_queue_if_empty = client.register_script(cls.LUA_DROP_QUEUE_IF_EMPTY_SCRIPT)
 
     def __open__(self):
         try:
@@ -230,6 +247,45 @@ class RedisDB:
                 self.__open__()
         return False
 
+    def flow_queue_product(self, queue: str, flows_key: str, flow: str, message) -> bool:
+        """
+        Append to the queue of one flow and register the flow in the set `flows_key`, atomically.
+        """
+        for _ in range(3):
+            try:
+                pipeline = self.REDIS.pipeline(transaction=True)
+                pipeline.xadd(queue, {"message": json.dumps(message)})
+                pipeline.sadd(flows_key, flow)
+                pipeline.execute()
+                return True
+            except Exception as e:
+                logging.exception("RedisDB.flow_queue_product " + str(queue) + " got exception: " + str(e))
+                self.__open__()
+        return False
+
+    def drop_flow_queue_if_empty(self, queue: str, flows_key: str, flow: str) -> bool:
+        """
+        Do following atomically:
+        Delete the queue of a flow and unregister the flow if nothing is queued nor unacknowledged in it.
+        """
+        try:
+            return bool(self.lua_drop_queue_if_empty(keys=[queue, flows_key], args=[flow], client=self.REDIS))
+        except Exception as e:
+            logging.warning("RedisDB.drop_flow_queue_if_empty " + str(queue) + " got exception: " + str(e))
+            self.__open__()
+        return False
+
+    def queue_lengths(self, queues: list[str]) -> list[int]:
+        try:
+            pipeline = self.REDIS.pipeline(transaction=False)
+            for queue in queues:
+                pipeline.xlen(queue)
+            return [int(n or 0) for n in pipeline.execute()]
+        except Exception as e:
+            logging.warning("RedisDB.queue_lengths got exception: " + str(e))
+            self.__open__()
+        return [0] * len(queues)
+
     def queue_consumer(self, queue_name, group_name, consumer_name, msg_id=b">") -> RedisMsg:
         """https://redis.io/docs/latest/commands/xreadgroup/"""
         for _ in range(3):
@@ -21,13 +21,16 @@ from botocore.config import Config
 import time
 from io import BytesIO
 from rag.utils import singleton
+from rag.utils.storage_stream import StreamingStorage
 from rag import settings
 
 
 @singleton
-class RAGFlowS3:
+class RAGFlowS3(StreamingStorage):
     def __init__(self):
         self.conn = None
+        # Buckets known to exist, so a put doesn't cost an extra head_bucket round trip.
+        self._buckets = set()
         self.s3_config = settings.S3
         self.access_key = self.s3_config.get("access_key", None)
         self.secret_key = self.s3_config.get("secret_key", None)
@@ -135,17 +138,31 @@ class RAGFlowS3:
         logging.debug(f"bucket name {bucket}; filename :{fnm}:")
         for _ in range(1):
             try:
-                if not self.bucket_exists(bucket):
-                    self.conn[0].create_bucket(Bucket=bucket)
-                    logging.info(f"create bucket {bucket} ********")
+                self._ensure_bucket(bucket)
                 r = self.conn[0].upload_fileobj(BytesIO(binary), bucket, fnm)
 
                 return r
             except Exception:
                 logging.exception(f"Fail put {bucket}/{fnm}")
+                self._buckets.discard(bucket)
                 self.__open__()
                 time.sleep(1)
 
+    def _ensure_bucket(self, bucket):
+        if bucket in self._buckets:
+            return
+        if not self.bucket_exists(bucket):
+            self.conn[0].create_bucket(Bucket=bucket)
+            logging.info(f"create bucket {bucket} ********")
+        self._buckets.add(bucket)
+
+    @use_prefix_path
+    @use_default_bucket
+    def put_stream(self, bucket, fnm, stream, length=-1, *args, **kwargs):
+        # upload_fileobj switches to a multipart upload for large objects by itself.
+        self._ensure_bucket(bucket)
+        return self.conn[0].upload_fileobj(stream, bucket, fnm)
+
     @use_prefix_path
     @use_default_bucket
     def rm(self, bucket, fnm, *args, **kwargs):
@@ -168,6 +185,22 @@ class RAGFlowS3:
                 time.sleep(1)
         return
 
+    @use_prefix_path
+    @use_default_bucket
+    def get_stream(self, bucket, fnm, *args, **kwargs):
+        try:
+            return self.conn[0].get_object(Bucket=bucket, Key=fnm)["Body"]
+        except Exception:
+            logging.exception(f"fail get {bucket}/{fnm}")
+
+    @use_prefix_path
+    @use_default_bucket
+    def get_range(self, bucket, fnm, offset, length, *args, **kwargs):
+        try:
+            return self.conn[0].get_object(Bucket=bucket, Key=fnm, Range=f"bytes={offset}-{offset + length - 1}")["Body"].read()
+        except Exception:
+            logging.exception(f"fail get {bucket}/{fnm} [{offset}:{offset + length}]")
+
     @use_prefix_path
     @use_default_bucket
     def obj_exist(self, bucket, fnm, *args, **kwargs):
@@ -196,6 +229,7 @@ class RAGFlowS3:
 
     @use_default_bucket
     def rm_bucket(self, bucket, *args, **kwargs):
+        self._buckets.discard(bucket)
         for conn in self.conn:
             try:
                 if not conn.bucket_exists(bucket):
@@ -0,0 +1,54 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from typing import BinaryIO
+
+STORAGE_PUT_CONCURRENCY = int(os.environ.get("STORAGE_PUT_CONCURRENCY", 16))
+# Part size of multipart uploads whose length isn't known up front.
+STORAGE_MULTIPART_SIZE = int(os.environ.get("STORAGE_MULTIPART_SIZE", 16 * 1024 * 1024))
+
+PUT_EXECUTOR = ThreadPoolExecutor(max_workers=STORAGE_PUT_CONCURRENCY, thread_name_prefix="storage_put")
+
+
+class StreamingStorage:
+    """
+    Streaming, ranged and batched operations of the storage connectors.
+    These defaults go through the connector's whole-buffer `get`/`put`, connectors override them with native calls.
+    """
+
+    def get_stream(self, bucket, fnm) -> BinaryIO | None:
+        """
+        File-like reader of an object, the caller closes it.
+        """
+        data = self.get(bucket, fnm)
+        return None if data is None else BytesIO(data)
+
+    def get_range(self, bucket, fnm, offset: int, length: int) -> bytes | None:
+        data = self.get(bucket, fnm)
+        return None if data is None else data[offset : offset + length]
+
+    def put_stream(self, bucket, fnm, stream: BinaryIO, length: int = -1):
+        return self.put(bucket, fnm, stream.read())
+
+    def put_many(self, items: list[tuple[str, str, bytes]]) -> list:
+        """
+        Upload many (bucket, fnm, binary) objects concurrently over the connector's pooled connections.
+        """
+        if len(items) <= 1:
+            return [self.put(*item) for item in items]
+        return list(PUT_EXECUTOR.map(lambda item: self.put(*item), items))
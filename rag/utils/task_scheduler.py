@@ -0,0 +1,205 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+"""
+Fair scheduling of document tasks across tenants.
+
+Tasks are queued by lane, then by flow: the tasks of one knowledge base of one tenant, in a Redis stream of its own.
+A task executor picks a lane by smooth weighted round-robin, then a tenant of the lane by weighted round-robin,
+then the knowledge bases of that tenant in turn. A tenant re-parsing ten thousand documents so gets the share of
+the executors of any other tenant with queued tasks, instead of everything queued behind it.
+"""
+
+import logging
+import time
+from bisect import bisect_left, bisect_right
+
+from rag.settings import (
+    MAX_CONCURRENT_TASKS_PER_TENANT,
+    SVR_CONSUMER_GROUP_NAME,
+    SVR_QUEUE_NAME,
+    TASK_FAIR_SCHEDULING,
+    TASK_LANE_WEIGHTS,
+    TASK_TENANT_WEIGHTS,
+    get_svr_queue_name,
+    get_svr_queue_names,
+)
+from rag.utils.redis_conn import REDIS_CONN, RedisMsg
+
+LANE_INTERACTIVE = "interactive"
+LANE_BULK = "bulk"
+LANE_BACKGROUND = "background"
+LANES = [LANE_INTERACTIVE, LANE_BULK, LANE_BACKGROUND]
+FLOW_REFRESH_SECONDS = 1.0
+_depths_cache = (0.0, {})
+
+
+def parse_weights(spec: str) -> dict[str, int]:
+    weights = {}
+    for item in spec.split(","):
+        name, _, weight = item.strip().rpartition(":")
+        if not name:
+            continue
+        try:
+            weights[name] = max(1, int(weight))
+        except ValueError:
+            logging.warning(f"Invalid task scheduling weight: {item}")
+    return weights
+
+
+LANE_WEIGHTS = {lane: 1 for lane in LANES} | {k: v for k, v in parse_weights(TASK_LANE_WEIGHTS).items() if k in LANES}
+TENANT_WEIGHTS = parse_weights(TASK_TENANT_WEIGHTS)
+
+
+def task_lane(task_type: str = "", priority: int = 0, bulk: bool = False) -> str:
+    if task_type in ["raptor", "graphrag"]:
+        return LANE_BACKGROUND
+    if bulk and priority <= 0:
+        return LANE_BULK
+    return LANE_INTERACTIVE
+
+
+def flows_key(lane: str) -> str:
+    return f"{SVR_QUEUE_NAME}_{lane}_flows"
+
+
+def flow_queue_name(lane: str, flow: str) -> str:
+    return f"{SVR_QUEUE_NAME}_{lane}_{flow}"
+
+
+def is_flow_queue(queue_name: str) -> bool:
+    return any(queue_name.startswith(f"{SVR_QUEUE_NAME}_{lane}_") for lane in LANES)
+
+
+def queue_task(task: dict, tenant_id: str, kb_id: str, lane: str = LANE_INTERACTIVE, priority: int = 0) -> bool:
+    """
+    Queue a task in the flow of its knowledge base, or in the shared queue of `priority` with fair scheduling off.
+    """
+    if not TASK_FAIR_SCHEDULING or not tenant_id:
+        return REDIS_CONN.queue_product(get_svr_queue_name(priority), message=task)
+    flow = f"{tenant_id}/{kb_id}"
+    return REDIS_CONN.flow_queue_product(flow_queue_name(lane, flow), flows_key(lane), flow, task)
+
+
+def lane_depths() -> dict[str, dict]:
+    """
+    Tenants, flows and tasks queued or in progress of every lane.
+    """
+    res = {}
+    for lane in LANES:
+        flows = sorted(REDIS_CONN.smembers(flows_key(lane)) or [])
+        lengths = REDIS_CONN.queue_lengths([flow_queue_name(lane, flow) for flow in flows]) if flows else []
+        res[lane] = {"tenants": len({flow.split("/", 1)[0] for flow in flows}), "flows": len(flows), "tasks": sum(lengths)}
+    return res
+
+
+def queue_length(lane: str | None = None) -> int:
+    """
+    Tasks ahead in `lane`, or in every lane, including those left in the shared queues.
+    """
+    global _depths_cache
+    n = 0
+    for queue in get_svr_queue_names():
+        group_info = REDIS_CONN.queue_info(queue, SVR_CONSUMER_GROUP_NAME)
+        if group_info:
+            n += int(group_info.get("lag", 0) or 0)
+    # Asked for every document in progress at each poll, a second old is recent enough.
+    ts, depths = _depths_cache
+    if time.monotonic() - ts > FLOW_REFRESH_SECONDS:
+        depths = lane_depths()
+        _depths_cache = (time.monotonic(), depths)
+    return n + sum(st["tasks"] for ln, st in depths.items() if lane is None or ln == lane)
+
+
+def _rotate(items: list[str], last: str | None, keep: bool) -> list[str]:
+    # Sorted `items` in turn, starting after `last`, or at it when `keep`.
+    if last is None:
+        return items
+    i = bisect_left(items, last) if keep else bisect_right(items, last)
+    return items[i:] + items[:i]
+
+
+class FairScheduler:
+    """
+    Picks the next task of one task executor among the flows of every lane. Each executor keeps its own turns,
+    the shares evening out across executors as every one of them serves the tenants alike.
+    """
+
+    def __init__(self, group_name: str, consumer_name: str):
+        self.group_name = group_name
+        self.consumer_name = consumer_name
+        # Lane to tenant to the sorted flows of the tenant.
+        self._flows: dict[str, dict[str, list[str]]] = {}
+        self._refreshed_at = 0.0
+        self._lane_credit = {lane: 0 for lane in LANES}
+        self._last_tenant: dict[str, str] = {}
+        self._served: dict[str, int] = {}
+        self._last_flow: dict[tuple[str, str], str] = {}
+
+    def refresh(self, force: bool = False):
+        if not force and time.monotonic() - self._refreshed_at < FLOW_REFRESH_SECONDS:
+            return
+        flows = {}
+        for lane in LANES:
+            tenants = {}
+            for flow in sorted(REDIS_CONN.smembers(flows_key(lane)) or []):
+                tenants.setdefault(flow.split("/", 1)[0], []).append(flow)
+            flows[lane] = tenants
+        self._flows = flows
+        self._refreshed_at = time.monotonic()
+
+    def queue_names(self) -> list[str]:
+        self.refresh(force=True)
+        return [flow_queue_name(lane, flow) for lane, tenants in self._flows.items() for flows in tenants.values() for flow in flows]
+
+    def _lane_order(self) -> list[str]:
+        # Smooth weighted round-robin over the lanes with queued flows, the others tried next so no executor idles.
+        lanes = [lane for lane in LANES if self._flows.get(lane)]
+        for lane in LANES:
+            if lane not in lanes:
+                self._lane_credit[lane] = 0
+        if not lanes:
+            return []
+        for lane in lanes:
+            self._lane_credit[lane] += LANE_WEIGHTS[lane]
+        first = max(lanes, key=lambda lane: self._lane_credit[lane])
+        self._lane_credit[first] -= sum(LANE_WEIGHTS[lane] for lane in lanes)
+        return [first] + sorted([lane for lane in lanes if lane != first], key=lambda lane: -LANE_WEIGHTS[lane])
+
+    def next(self, running: dict[str, int]) -> RedisMsg | None:
+        """
+        `running` is the count of tasks by tenant this executor is handling, for MAX_CONCURRENT_TASKS_PER_TENANT.
+        """
+        self.refresh()
+        for lane in self._lane_order():
+            tenants = self._flows[lane]
+            last = self._last_tenant.get(lane)
+            # A tenant of weight w is served w times in a row before the next one's turn.
+            keep = last is not None and self._served.get(lane, 0) < TENANT_WEIGHTS.get(last, 1)
+            for tenant in _rotate(sorted(tenants), last, keep):
+                if 0 < MAX_CONCURRENT_TASKS_PER_TENANT <= running.get(tenant, 0):
+                    continue
+                for flow in _rotate(tenants[tenant], self._last_flow.get((lane, tenant)), False):
+                    queue = flow_queue_name(lane, flow)
+                    redis_msg = REDIS_CONN.queue_consumer(queue, self.group_name, self.consumer_name)
+                    if redis_msg:
+                        redis_msg.delete_on_ack = True
+                        self._served[lane] = self._served.get(lane, 0) + 1 if tenant == last else 1
+                        self._last_tenant[lane] = tenant
+                        self._last_flow[(lane, tenant)] = flow
+                        return redis_msg
+                    if REDIS_CONN.drop_flow_queue_if_empty(queue, flows_key(lane), flow):
+                        self._refreshed_at = 0.0
+        return None
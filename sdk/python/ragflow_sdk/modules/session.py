@@ -85,6 +85,15 @@ class Session(Base):
         if res.get("code") != 0:
             raise Exception(res.get("message"))
 
+    def history(self, before: int | None = None):
+        res = self.get(f"/chats/{self.chat_id}/sessions/{self.id}/history", {"before": before} if before is not None else None)
+        res = res.json()
+        if res.get("code") != 0:
+            raise Exception(res.get("message"))
+        if not res["data"]:
+            return None, []
+        return res["data"]["seq"], [Message(self.rag, m) for m in res["data"]["messages"]]
+
 
 class Message(Base):
     def __init__(self, rag, res_dict):
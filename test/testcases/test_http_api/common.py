@@ -229,6 +229,12 @@ def list_session_with_chat_assistants(auth, chat_assistant_id, params=None):
     return res.json()
 
 
+def list_session_history_with_chat_assistant(auth, chat_assistant_id, session_id, params=None):
+    url = f"{HOST_ADDRESS}{SESSION_WITH_CHAT_ASSISTANT_API_URL}/{session_id}/history".format(chat_id=chat_assistant_id)
+    res = requests.get(url=url, headers=HEADERS, auth=auth, params=params)
+    return res.json()
+
+
 def update_session_with_chat_assistant(auth, chat_assistant_id, session_id, payload=None):
     url = f"{HOST_ADDRESS}{SESSION_WITH_CHAT_ASSISTANT_API_URL}/{session_id}".format(chat_id=chat_assistant_id)
     res = requests.put(url=url, headers=HEADERS, auth=auth, json=payload)
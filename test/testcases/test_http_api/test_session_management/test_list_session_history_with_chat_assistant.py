@@ -0,0 +1,74 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import pytest
+from common import list_session_history_with_chat_assistant, list_session_with_chat_assistants
+from configs import INVALID_API_TOKEN
+from libs.auth import RAGFlowHttpApiAuth
+
+
+@pytest.mark.p1
+class TestAuthorization:
+    @pytest.mark.parametrize(
+        "invalid_auth, expected_code, expected_message",
+        [
+            (None, 0, "`Authorization` can't be empty"),
+            (
+                RAGFlowHttpApiAuth(INVALID_API_TOKEN),
+                109,
+                "Authentication error: API key is invalid!",
+            ),
+        ],
+    )
+    def test_invalid_auth(self, invalid_auth, expected_code, expected_message):
+        res = list_session_history_with_chat_assistant(invalid_auth, "chat_assistant_id", "session_id")
+        assert res["code"] == expected_code
+        assert res["message"] == expected_message
+
+
+class TestSessionHistoryWithChatAssistant:
+    @pytest.mark.p1
+    def test_no_archived_segments(self, HttpApiAuth, add_sessions_with_chat_assistant):
+        chat_assistant_id, session_ids = add_sessions_with_chat_assistant
+        res = list_session_with_chat_assistants(HttpApiAuth, chat_assistant_id, {"id": session_ids[0]})
+        assert res["code"] == 0, res
+        assert res["data"][0]["archived_segments"] == 0
+
+        res = list_session_history_with_chat_assistant(HttpApiAuth, chat_assistant_id, session_ids[0])
+        assert res["code"] == 0, res
+        assert res["data"] is None
+
+    @pytest.mark.p3
+    @pytest.mark.parametrize(
+        "params, expected_code, expected_message",
+        [
+            ({"before": "0"}, 0, ""),
+            ({"before": "-1"}, 102, "`before` should be a non-negative integer."),
+            ({"before": "abc"}, 102, "`before` should be a non-negative integer."),
+        ],
+    )
+    def test_before(self, HttpApiAuth, add_sessions_with_chat_assistant, params, expected_code, expected_message):
+        chat_assistant_id, session_ids = add_sessions_with_chat_assistant
+        res = list_session_history_with_chat_assistant(HttpApiAuth, chat_assistant_id, session_ids[0], params)
+        assert res["code"] == expected_code, res
+        if expected_code != 0:
+            assert res["message"] == expected_message
+
+    @pytest.mark.p3
+    def test_invalid_session_id(self, HttpApiAuth, add_sessions_with_chat_assistant):
+        chat_assistant_id, _ = add_sessions_with_chat_assistant
+        res = list_session_history_with_chat_assistant(HttpApiAuth, chat_assistant_id, "invalid_session_id")
+        assert res["code"] == 102
+        assert res["message"] == "The session doesn't exist"